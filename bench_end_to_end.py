@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+#
+#  Name:  bench_end_to_end.py
+#  Description:  End-to-end timing of the tools against mock switches from mds_mock_server:
+#                sleep-paced vs prompt-driven config push, serial vs concurrent fleet runs,
+#                port usage collection, and per-port vs batched VSAN changes
+#
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import paramiko
+
+import change_port_vsans
+import mds_session
+from cisco_timeout_change import change_timeout
+from collect_san_port_usage_data import count_port_usage
+from mds_parsers import parse_port_brief_records
+from mds_fleet import run_fleet
+from mds_mock_server import MockMDSServer, mock_fleet
+from mds_session import SessionPool, open_client
+
+
+def legacy_change_timeout(result):
+    # The exec-timeout push as it was before the prompt-driven sessions: fixed one second sleeps
+    client = open_client(result.switch)
+    try:
+        remote_conn = client.invoke_shell()
+        output = remote_conn.recv(1000).decode()
+        time.sleep(1)
+        if '(config)' not in output:
+            time.sleep(1)
+            remote_conn.send("config t\n")
+            remote_conn.send('\n')
+            time.sleep(1)
+            output = remote_conn.recv(1000).decode()
+        if '#' in output:
+            remote_conn.send('terminal length 0\n')
+            time.sleep(1)
+            remote_conn.send("line vty\n")
+            time.sleep(1)
+            remote_conn.send("exec-timeout 15\n")
+            time.sleep(1)
+            remote_conn.send("exit\n")
+            time.sleep(1)
+            remote_conn.send("exit\n")
+            result.output = remote_conn.recv(1000).decode()
+            result.ok = True
+    finally:
+        client.close()
+
+
+def collect_usage(result, pool):
+    records = parse_port_brief_records(pool.iter_lines(result.switch, 'sh int brief'))
+    result.data['usage'] = count_port_usage(records)
+    pool.close_switch(result.switch)
+    result.ok = True
+
+
+def timed(name, switches, func, *args):
+    start = time.time()
+    results = func(*args)
+    elapsed = time.time() - start
+    failed = sum(1 for result in results if not result.ok) if results else 0
+    print('%-44s%10d%10.2f%8d' % (name, switches, elapsed, failed))
+
+
+def vsan_changes(server, ports):
+    # Run change_port_vsans per-port and batched against the first mock switch, output discarded
+    address = server.addresses[server.switches[0].name]
+    interfaces = [port['interface'] for port in server.switches[0].port_data[:ports]]
+    for name, execute, vsan in (('vsan change, per port', change_port_vsans.execute_vsan_change, '200'),
+                                ('vsan change, batched (-b)', change_port_vsans.execute_vsan_change_batch, '300')):
+        switch_ports = {address: dict((interface, vsan) for interface in interfaces)}
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            execute(switch_ports)
+        print('%-44s%10d%10.2f%8s' % ('%s (%d ports)' % (name, ports), 1, time.time() - start, '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--switches', type=int, default=8, help='number of mock switches (default: 8)')
+    parser.add_argument('--ports', type=int, default=384, help='fc ports per mock switch (default: 384)')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before each mock command answers')
+    parser.add_argument('--connect-latency', type=float, default=0.2, help='seconds added to each mock SSH handshake')
+    parser.add_argument('--vsan-ports', type=int, default=24, help='ports moved in the vsan change runs')
+    parser.add_argument('--legacy', action='store_true', help='include the sleep-paced config push (about 7s per switch)')
+    args = parser.parse_args()
+
+    # The mock switches accept any key; use a throwaway one so no local keys or agent are needed
+    key_file = os.path.join(tempfile.mkdtemp(), 'id_rsa')
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+    mds_session.connect_options.update(username='admin', key_filename=key_file, look_for_keys=False, allow_agent=False)
+
+    with MockMDSServer(mock_fleet(args.switches, args.ports, 0, args.latency, args.connect_latency)) as server:
+        switches = [server.addresses[switch.name] for switch in server.switches]
+        print('%-44s%10s%10s%8s' % ('Scenario', 'Switches', 'Seconds', 'Failed'))
+        if args.legacy:
+            timed('config push, sleep-paced, serial', len(switches), run_fleet, switches, legacy_change_timeout, (), 1)
+        timed('config push, prompt-driven, serial', len(switches), run_fleet, switches, change_timeout, (), 1)
+        timed('config push, prompt-driven, concurrent', len(switches), run_fleet, switches, change_timeout, (), len(switches))
+        with SessionPool() as pool:
+            timed('usage collection, serial', len(switches), run_fleet, switches, collect_usage, (pool,), 1)
+            timed('usage collection, concurrent', len(switches), run_fleet, switches, collect_usage, (pool,), len(switches))
+        vsan_changes(server, args.vsan_ports)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+#
+#  Name:  bench_parsers.py
+#  Description:  Benchmark harness for the show output parsers of the usage collector and the
+#                port description validator.  Reports throughput (lines/s, ports/s) and peak memory
+#                of each parser on generated 48-, 384- and 768-port switches with a 10k-entry
+#                device-alias database, and compares the validator's FLOGI path (parse_flogi_records into
+#                the WWN index) against the previous single-switch flogi parser
+#
+
+import argparse
+import re
+import time
+import tracemalloc
+
+from collect_san_port_usage_data import parse_port_brief_array, parse_port_detail_array
+from mds_fixtures import switch_outputs
+from mds_parsers import parse_devalias, parse_flogi_records, parse_port_brief_records
+from mds_wwn_index import WWNIndex
+from san_switch_port_desc_validator import parse_port_desc, parse_status
+
+
+def index_flogi_info(output):
+    # The validator's FLOGI path: parse the logins, merge them into a WWN index and report per port
+    index = WWNIndex()
+    index.update_switch('', 'switch', parse_flogi_records(output), {})
+    return index.flogi_info('switch')
+
+
+def legacy_parse_flogi(output):
+    # Previous implementation: lazy section regex, then three regexes on every line
+    flogi_out_regex = re.compile(r'^(fc[\s\S]*?)(port|Total)',re.M)
+    fc_only_flogi = flogi_out_regex.search(output)
+    if not fc_only_flogi:
+        return {}
+    fc_only_string = fc_only_flogi.group(1)
+    fc_line_check = re.compile(r'^(fc[1-9][0-5]*\/[1-9][0-9]*)\s+.*')
+    devalias_line_check = re.compile(r'\[(.*)\]')
+    wwn_regex = re.compile(r'^(fc[1-9][0-5]*\/[1-9][0-9]*)\s+([0-9]*[0-9]*)\s+([\w\d]+)\s+([\w\d:]+)\s+([\w\d:]+)')
+    fc_section = fc_only_string.split('\n')
+    flogi_info = {}
+    last_port_name = ''
+    port_name = ''
+    for line in fc_section:
+        line = line.strip()
+        port_check = fc_line_check.match(line)
+        devalias_check = devalias_line_check.search(line)
+        wwn_check = wwn_regex.search(line)
+        if port_check:
+            port_name = port_check.group(1)
+            if port_name == last_port_name:
+                flogi_info[port_name] = "trunk"
+                continue
+            if wwn_check:
+                flogi_info[port_name] = wwn_check.group(4)
+        elif devalias_check:
+            if flogi_info.get(port_name) != "trunk":
+                flogi_info[port_name] = devalias_check.group(1)
+
+        last_port_name = port_name
+    return flogi_info
+
+
+def measure(parser, make_input, repeat):
+    # Return (best seconds per run, peak bytes allocated during one run)
+    best = None
+    for _ in range(repeat):
+        data = make_input()
+        start = time.perf_counter()
+        parser(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    data = make_input()
+    tracemalloc.start()
+    parser(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def parser_cases(outputs):
+    """
+        (name, parser, command, input factory) for every parser.  The collector parsers consume an
+        iterable of lines, as they do when streaming; the validator parsers take the whole output text.
+    """
+    def lines(cmd):
+        return lambda: iter(outputs[cmd].splitlines())
+
+    def text(cmd):
+        return lambda: outputs[cmd]
+
+    return [('parse_port_detail_array', parse_port_detail_array, 'sh int', lines('sh int')),
+            ('parse_port_brief_array', parse_port_brief_array, 'sh int brief', lines('sh int brief')),
+            ('parse_port_brief_records', parse_port_brief_records, 'sh int brief', lines('sh int brief')),
+            ('parse_port_desc', parse_port_desc, 'sh int desc', text('sh int desc')),
+            ('parse_status', parse_status, 'sh int', text('sh int')),
+            ('parse_devalias', parse_devalias, 'sh device-alias database', text('sh device-alias database')),
+            ('parse_flogi_records', parse_flogi_records, 'sh flogi database', text('sh flogi database')),
+            ('flogi_info (index)', index_flogi_info, 'sh flogi database', text('sh flogi database')),
+            ('flogi_info (legacy)', legacy_parse_flogi, 'sh flogi database', text('sh flogi database'))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ports', type=int, nargs='+', default=[48, 384, 768], help='ports per generated switch')
+    parser.add_argument('--aliases', type=int, default=10000, help='entries in the generated device-alias database')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per parser; the fastest is reported')
+    args = parser.parse_args()
+
+    print('%-28s%7s%9s%10s%14s%12s%11s' % ('Parser', 'Ports', 'Lines', 'ms', 'lines/s', 'ports/s', 'peak KiB'))
+    for ports in args.ports:
+        outputs = switch_outputs(ports, args.aliases)
+        if index_flogi_info(outputs['sh flogi database']) != legacy_parse_flogi(outputs['sh flogi database']):
+            print('flogi_info results differ from the legacy parser for %d ports' % ports)
+        for name, parse, cmd, make_input in parser_cases(outputs):
+            seconds, peak = measure(parse, make_input, args.repeat)
+            line_count = outputs[cmd].count('\n')
+            print('%-28s%7d%9d%10.2f%14.0f%12.0f%11.1f' % (name, ports, line_count, seconds * 1000,
+                                                             line_count / seconds, ports / seconds, peak / 1024.0))
+        print()
+
+
+if __name__ == '__main__':
+    main()
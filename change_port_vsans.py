@@ -8,18 +8,21 @@
 #
 
 import paramiko
-import re
 import sys
-import os
 import csv
 from pprint import pprint
-import json
-import time
 from datetime import datetime
 import argparse
 import socket
 from pathlib import Path
 
+from mds_cache import ShowCache, add_cache_arguments
+from mds_fleet import DEFAULT_WORKERS, add_workers_argument, report_results
+from mds_inventory import load_inventory
+from mds_parsers import parse_port_brief_records, parse_vsan_membership
+from mds_session import SessionPool, apply_config, open_shell
+from mds_waves import DEFAULT_SETTLE, DEFAULT_SETTLE_POLLS, add_wave_arguments, run_waves
+
 switch_ports = {}
 
 def main():
@@ -28,6 +31,9 @@ def main():
     # -f <csv file with switchname,port,vsan> 
     # -t test mode
     # -e execute mode
+    # -b with -e, batch every port of a switch into one vsan database session
+    # -o <csv file> with -t, write the rows that still need a change (input for a later -e run)
+    # --inventory <csv file> with -e, change switches in parallel one fabric at a time (see mds_waves)
     # Example csv file format:
     # switch,port,vsan
     # name1,fc1/1,10
@@ -38,7 +44,13 @@ def main():
     parser.add_argument('-f', action='store',dest='file', type=str, help="csv file with switch, port, vsan info to process.", required=True)
     parser.add_argument('-t', action='store_true', help="test without executing change...")
     parser.add_argument('-e', action='store_true', help="Execute change...")
+    parser.add_argument('-b', action='store_true', help="with -e, change all ports of a switch in one vsan database session and verify once")
+    parser.add_argument('-o', action='store', dest='pending', type=str, help="with -t, write rows not yet in their target vsan to this csv file")
+    add_cache_arguments(parser)
+    add_workers_argument(parser)
+    add_wave_arguments(parser)
     args = parser.parse_args()
+    inventory = load_inventory(args.inventory, args.inventory_state)
     
     file = Path(args.file)
     if file.is_file():
@@ -56,122 +68,154 @@ def main():
     if args.t:
         print('TEST Mode.')
         pprint(switch_ports)
-        test_vsan_change(switch_ports)
+        with SessionPool(timeout=5, cache=ShowCache(args.cache_dir), max_age=args.max_age) as pool:
+            pending = test_vsan_change(switch_ports, pool)
+        if args.pending:
+            write_pending(args.pending, pending)
 
+    ok = True
     if args.e:
         print('EXECUTE Mode.')
         # Process switch port vsan changes
-        execute_vsan_change(switch_ports)
+        if args.b:
+            ok = execute_vsan_change_batch(switch_ports, args.workers, inventory, args.site_limit, args.settle, args.settle_polls)
+        else:
+            ok = execute_vsan_change(switch_ports, args.workers, inventory, args.site_limit, args.settle, args.settle_polls)
     if not args.t and not args.e:
         print('PRINT DATA Mode.')
         pprint(switch_ports)
 
     print('Processing finished.')
     print(datetime.now() - startTime)
+    sys.exit(0 if ok else 1)
 
-def execute_vsan_change(switch_ports):
-    # Execute all changes on provided switch ports
-    for switch, ports in switch_ports.items():
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        remote_conn = ()
-        switch = switch.strip('\n')
-        try:
-            print('\n----- Connecting to {} -----\n'.format(switch))
-            client.connect(switch,timeout=5)
-        except paramiko.SSHException:
-            print('\t*** Authentication Failed ***')
-            sys.exit()
-        except socket.error:
-            print('\t*** {} is Unreachable ***'.format(switch))
-            sys.exit()
-        print('\t*** SSH session established with {} ***'.format(switch))
-        remote_conn = client.invoke_shell()
+
+def change_switch_vsans(result, ports):
+    # Change every port of one switch, entering the vsan database once per port
+    switch = result.switch
+    session = open_shell(switch)
+    try:
+        result.log('\t*** SSH session established with {} ***'.format(switch))
+        failed = 0
         for port, vsan in ports.items():
-            remote_conn.send('\n')
-            time.sleep(1)
-            remote_conn.send('\n')
-            time.sleep(1)
-            remote_conn.send('\n')
-            output = remote_conn.recv(1000).decode()
-            time.sleep(1)
-            if '(config)' not in output:
-                time.sleep(1)
-                print('\t*** Switching to Config Mode ***')
-                remote_conn.send("config t\n")
-                remote_conn.send('\n')
-                time.sleep(1)
-                output = remote_conn.recv(1000).decode()
-            if '#' in output:
-                print('\t*** Successfully entered Config Mode ***')
-                remote_conn.send('terminal length 0\n')
-                time.sleep(1)
-                print('\t*** Entering vsan database on '+switch+' ***')
-                remote_conn.send("vsan database\n")
-                time.sleep(1)
-                output = remote_conn.recv(1000).decode()
-            if '(config-vsan-db)' in output:
-                print('\t*** Changing vsan on '+switch+' port '+port+' to vsan '+vsan+' ***')
-                remote_conn.send("vsan "+vsan+" interface "+port+"\n")
-                time.sleep(1)
-                remote_conn.send("y\n")
-                time.sleep(1)
-                remote_conn.send("exit\n")
-                time.sleep(1)
-                output = remote_conn.recv(1000).decode()
-                print(output)
+            if session.enter_config_mode(result.log):
+                result.log('\t*** Entering vsan database on '+switch+' ***')
+                session.send_command("vsan database")
+            if '(config-vsan-db)' in session.prompt:
+                result.log('\t*** Changing vsan on '+switch+' port '+port+' to vsan '+vsan+' ***')
+                output = session.send_command("vsan "+vsan+" interface "+port)
+                if session.confirm:
+                    output += session.send_command("y")
+                output += session.send_command("exit")
+                result.output += output
             else:
-                print('\t*** Error in attempting config mode ***')
-        client.close()
+                failed += 1
+                result.log('\t*** Error in attempting config mode ***')
+        result.ok = not failed
+    finally:
+        session.close()
 
-def test_vsan_change(switch_ports):
+def change_switch_vsans_batch(result, ports):
+    # Change every port of one switch and read back "show vsan membership" in one pipelined block;
+    # "terminal dont-ask" skips the y/n confirmation of each port so no line is read as the answer
+    switch = result.switch
+    session = open_shell(switch)
+    try:
+        result.log('\t*** SSH session established with {} ***'.format(switch))
+        result.log('\t*** Changing vsan on {} ports of {} ***'.format(len(ports), switch))
+        commands = ["terminal dont-ask", "config t", "vsan database"]
+        commands += ["vsan "+vsan+" interface "+port for port, vsan in ports.items()]
+        commands += ["end", "show vsan membership"]
+        replies = apply_config(session, result, commands)
+
+        result.log('\t*** Verifying vsan membership on '+switch+' ***')
+        command, output, error = replies[-1]
+        membership = parse_vsan_membership(output)
+        failed = 0
+        for port, vsan in ports.items():
+            if membership.get(port) != vsan:
+                failed += 1
+                result.log('\t*** {} port {} is in vsan {}, expected vsan {} ***'.format(switch, port, membership.get(port), vsan))
+        result.log('\t*** {} of {} ports on {} verified ***'.format(len(ports) - failed, len(ports), switch))
+        result.ok = result.ok and not failed
+    finally:
+        session.close()
+
+def change_switch(result, task, switch_ports):
+    task(result, switch_ports[result.switch])
+
+def run_vsan_changes(switch_ports, task, workers, inventory, site_limit, settle, settle_polls):
+    # Run task(result, ports) for each switch and report.  Without an inventory the fabric of a switch is
+    # unknown, so switches are changed one at a time as before.
+    switch_ports = dict((switch.strip('\n'), ports) for switch, ports in switch_ports.items())
+    if inventory is None or not inventory.switches:
+        workers = 1
+    results = run_waves(list(switch_ports), change_switch, args=(task, switch_ports), workers=workers,
+                        inventory=inventory, site_limit=site_limit, settle=settle, settle_polls=settle_polls)
+    return report_results(results)
+
+def execute_vsan_change(switch_ports, workers=DEFAULT_WORKERS, inventory=None, site_limit=0,
+                        settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
+    # Execute all changes on provided switch ports
+    return run_vsan_changes(switch_ports, change_switch_vsans, workers, inventory, site_limit, settle, settle_polls)
+
+def execute_vsan_change_batch(switch_ports, workers=DEFAULT_WORKERS, inventory=None, site_limit=0,
+                              settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
+    # Execute all changes on each switch from a single vsan database session per switch
+    return run_vsan_changes(switch_ports, change_switch_vsans_batch, workers, inventory, site_limit, settle, settle_polls)
+
+def preflight_switch(switch, ports, pool):
+    # Current vsan and status of every requested port from one "show vsan membership" and one "show interface brief"
+    membership = parse_vsan_membership(pool.run(switch, "show vsan membership"))
+    status = dict((record['interface'], record['status']) for record in parse_port_brief_records(pool.run(switch, "show interface brief").splitlines()))
+    rows = []
+    for port, vsan in ports.items():
+        current = membership.get(port)
+        if current is None:
+            action = 'MISSING'
+        elif current == vsan:
+            action = 'COMPLIANT'
+        else:
+            action = 'CHANGE'
+        rows.append({'switch': switch, 'port': port, 'status': status.get(port, '--'), 'current': current or '--', 'vsan': vsan, 'action': action})
+    return rows
+
+def test_vsan_change(switch_ports, pool):
     # Test run through target list of switch ports to be changed
     # This will only show current settings for each port and not make any change
+    # Each switch is read once; show output comes over exec channels so it can be shared through the cache
+    # Returns {switch: {port: vsan}} of the rows that still need a change
+    pending = {}
+    print("%18s%10s%18s%14s%14s%12s" % ("Switch","Port","Status","Current VSAN","Target VSAN","Action"))
     for switch, ports in switch_ports.items():
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        remote_conn = ()
         switch = switch.strip('\n')
         try:
-            print('\n----- Connecting to {} -----\n'.format(switch))
-            client.connect(switch,timeout=5)
+            rows = preflight_switch(switch, ports, pool)
         except paramiko.SSHException:
             print('\t*** Authentication Failed ***')
             sys.exit()
         except socket.error:
             print('\t*** {} is Unreachable ***'.format(switch))
             sys.exit()
-        print('\t*** SSH session established with {} ***'.format(switch))
-        remote_conn = client.invoke_shell()
-        for port, vsan in ports.items():
-            remote_conn.send('\n')
-            time.sleep(1)
-            remote_conn.send('\n')
-            time.sleep(1)
-            remote_conn.send('\n')
-            output = remote_conn.recv(1000).decode()
-            time.sleep(1)
-            if '(config)' not in output:
-                time.sleep(1)
-                print('\t*** Switching to Config Mode ***')
-                remote_conn.send("config t\n")
-                remote_conn.send('\n')
-                time.sleep(1)
-                output = remote_conn.recv(1000).decode()
-            if '#' in output:
-                print('\t*** Successfully entered Config Mode ***')
-                remote_conn.send('terminal length 0\n')
-                time.sleep(1)
-                print('\t*** Showing vsan membership for port '+port+' ***')
-                remote_conn.send("sh vsan membership interface "+port+"\n")
-                time.sleep(1)
-                remote_conn.send("sh interface "+port+" brief\n")
-                time.sleep(1)
-                output = remote_conn.recv(1000).decode()
-                print(output)
-            else:
-                print('\t*** Error in attempting config mode ***')
-        client.close()
+        pool.close_switch(switch)
+        for row in rows:
+            print("%18s%10s%18s%14s%14s%12s" % (row['switch'], row['port'], row['status'], row['current'], row['vsan'], row['action']))
+            if row['action'] != 'COMPLIANT':
+                pending.setdefault(switch, {})[row['port']] = row['vsan']
+    total = sum(len(ports) for ports in switch_ports.values())
+    changes = sum(len(ports) for ports in pending.values())
+    print('\n{} of {} rows already compliant, {} to change'.format(total - changes, total, changes))
+    return pending
+
+def write_pending(filename, pending):
+    # Write rows that still need a change in the -f csv format
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['switch', 'port', 'vsan'])
+        for switch, ports in pending.items():
+            for port, vsan in ports.items():
+                writer.writerow([switch, port, vsan])
+    print('Wrote rows to change to {}'.format(filename))
 
 if __name__ == '__main__':
     main()
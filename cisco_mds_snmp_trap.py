@@ -7,79 +7,73 @@
 #  Original creation date: 3/15/17
 #
 
-import re
 import sys
-import time
 import os
-import getpass
-import socket
 import argparse
-import paramiko
 
+from mds_session import apply_config, open_shell
+from mds_fleet import DEFAULT_WORKERS, add_workers_argument, read_switch_list, report_results
+from mds_inventory import load_inventory
+from mds_compliance import add_check_argument, config_lines, pending_switches
+from mds_waves import DEFAULT_SETTLE, DEFAULT_SETTLE_POLLS, add_wave_arguments, run_waves
 
-def connect(state,switch_file):
+
+def traps_compliant(switch, pool, statestring):
+    # True when link traps are already enabled ("") or disabled ("no ") on switch
+    enabled = 'snmp-server enable traps link' in config_lines(pool.run(switch, 'show run | inc snmp-server enable traps'))
+    return enabled == (statestring == "")
+
+
+def change_snmp_traps(result, statestring, commandmsg):
+    # Enable or disable link SNMP traps on a single switch
+    host = result.switch
+    session = open_shell(host)
+    try:
+        result.log('\t*** SSH session established with %s ***' % host)
+        if session.enter_config_mode(result.log):
+            result.log('\t*** '+commandmsg+' SNMP traps on switch '+host+' ***')
+            apply_config(session, result, [statestring+"snmp-server enable traps link", "exit"])
+        else:
+            result.log('\t*** Error in attempting config mode ***')
+    finally:
+        session.close()
+
+
+def connect(state, switch_file, workers=DEFAULT_WORKERS, inventory=None, site_limit=0, check_first=False,
+            settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
     if state == "enable":
         statestring = ""
         commandmsg = "Enabling"
     elif state == "disable":
         statestring = "no "
         commandmsg = "Disabling"
-    global remote_conn
-    global host
     if os.path.isfile(switch_file):
-        myfile = open(switch_file, 'r')
-        for ip in myfile:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            remote_conn = ()
-            ip = ip.strip('\n')
-            host = ip
-            print_host = host
-            print_host = print_host.replace('\n', '')
-            try:
-                print('\n----- Connecting to %s -----\n' % print_host)
-                client.connect(host,timeout=5)
-                print('\t*** SSH session established with %s ***' % print_host)
-                remote_conn = client.invoke_shell()
-                output = remote_conn.recv(1000)
-                time.sleep(1)
-                if '(config)' not in output:
-                    time.sleep(1)
-                    print('\t*** Switching to Config Mode ***')
-                    remote_conn.send("config t\n")
-                    remote_conn.send('\n')
-                    time.sleep(1)
-                    output = remote_conn.recv(1000)
-                if '#' in output:
-                    print('\t*** Successfully entered Config Mode ***')
-                    remote_conn.send('terminal length 0\n')
-                    time.sleep(1)
-                    print('\t*** '+commandmsg+' SNMP traps on switch '+host+' ***')
-                    remote_conn.send(statestring+"snmp-server enable traps link\n")
-                    time.sleep(1)
-                    remote_conn.send("exit\n")
-                    time.sleep(1)
-                    print(remote_conn.recv(1000))
-                else:
-                    print('\t*** Error in attempting config mode ***')
-            except paramiko.SSHException:
-                print('\t*** Authentication Failed ***')
-            except socket.error:
-                print('\t*** %s is Unreachable ***' % host)
-            client.close()
+        switches = read_switch_list(switch_file)
+        if check_first:
+            switches = pending_switches(switches, traps_compliant, args=(statestring,), workers=workers)
+        print('%s SNMP traps on %d switches with %d workers ...' % (commandmsg, len(switches), workers))
+        results = run_waves(switches, change_snmp_traps, args=(statestring, commandmsg), workers=workers, inventory=inventory, site_limit=site_limit,
+                            settle=settle, settle_polls=settle_polls)
+        return report_results(results)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('action', help='(enable or disable) SNMP traps on switch list')
     parser.add_argument('switchlistfile', help='filename including path if not in current directory for switch list')
+    add_workers_argument(parser)
+    add_wave_arguments(parser)
+    add_check_argument(parser)
     args = parser.parse_args()
+    inventory = load_inventory(args.inventory, args.inventory_state)
     
     if os.path.isfile(args.switchlistfile):
         if args.action == "enable":
-            connect("enable",args.switchlistfile)
+            sys.exit(0 if connect("enable",args.switchlistfile,args.workers,inventory=inventory,site_limit=args.site_limit,check_first=args.check_first,
+                              settle=args.settle,settle_polls=args.settle_polls) else 1)
         elif args.action == "disable":
-            connect("disable",args.switchlistfile)
+            sys.exit(0 if connect("disable",args.switchlistfile,args.workers,inventory=inventory,site_limit=args.site_limit,check_first=args.check_first,
+                              settle=args.settle,settle_polls=args.settle_polls) else 1)
         else: 
             print("enable OR disable are expected arguments.")
     else:
@@ -5,91 +5,225 @@
 #  Description:  This script adds a new user's sshkey to each switch listed in the
 #                switchlistfile provided
 #
+#                With --manifest, every user of a YAML or CSV manifest (username, role, sshkey file,
+#                remove) is added or removed in one config session per switch; users whose role and
+#                key are already in place are skipped.
+#
 #  Original creation date: 10/16/18
 #
 
-import re
 import sys
-import time
+import csv
 import os
-import socket
 import argparse
-import paramiko
+
+try:
+    import yaml
+except ImportError:
+    # Only needed for YAML manifests; CSV manifests work without it
+    yaml = None
+
+from mds_parsers import parse_user_accounts, parse_username_config
+from mds_session import apply_config, open_shell
+from mds_fleet import DEFAULT_WORKERS, add_workers_argument, read_switch_list, report_results
+from mds_inventory import load_inventory
+from mds_compliance import add_check_argument, pending_switches
+from mds_waves import DEFAULT_SETTLE, DEFAULT_SETTLE_POLLS, add_wave_arguments, run_waves
+
+
+def user_compliant(switch, pool, username, sshkey):
+    # True when username already exists on switch as network-admin with sshkey; show user-account has the
+    # account and its roles, the key itself is only in the running-config
+    if 'network-admin' not in parse_user_accounts(pool.run(switch, 'show user-account')).get(username, []):
+        return False
+    user = parse_username_config(pool.run(switch, 'show run | inc username')).get(username)
+    return user is not None and user['sshkey'] == sshkey.strip()
+
+
+def add_user_sshkey(result, username, sshkey):
+    # Add the user and their ssh key on a single switch
+    host = result.switch
+    session = open_shell(host)
+    try:
+        result.log('\t*** SSH session established with %s ***' % host)
+        if session.enter_config_mode(result.log):
+            result.log('\t*** Adding user and their ssh key on '+host+' ***')
+            # remove user before adding again (fails harmlessly when the user does not exist yet)
+            apply_config(session, result, ["no username "+username,
+                                           "username "+username+" password 5 ! role network-admin",
+                                           "username "+username+" sshkey "+sshkey.strip(),
+                                           "exit"], optional=("no username "+username,))
+        else:
+            result.log('\t*** Error in attempting config mode ***')
+    finally:
+        session.close()
+
+
+MANIFEST_FIELDS = ('username', 'role', 'sshkey', 'remove')
+DEFAULT_ROLE = 'network-admin'
+
+
+def read_manifest(manifest_file):
+    """
+        Read a user manifest into a list of {'username', 'role', 'sshkey', 'remove'}.  The manifest is YAML (a list
+        of users, or a mapping with a "users" list) or CSV with a username,role,sshkey,remove header.  sshkey is
+        the path of the key file, relative to the manifest; it is replaced by the key itself.  role defaults to
+        network-admin, and users with remove set (yes/true/1) are removed instead of added.
+    """
+    with open(manifest_file, 'r', newline='') as f:
+        text = f.read()
+    if manifest_file.endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise SystemExit('Reading %s needs PyYAML (pip install pyyaml), or use a CSV manifest' % manifest_file)
+        rows = yaml.safe_load(text) or []
+        if isinstance(rows, dict):
+            rows = rows.get('users') or []
+    else:
+        rows = list(csv.DictReader(line for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')))
+    directory = os.path.dirname(os.path.abspath(manifest_file))
+    users = []
+    for row in rows:
+        user = dict((name, str(row.get(name) or '').strip()) for name in MANIFEST_FIELDS)
+        if not user['username']:
+            continue
+        user['role'] = user['role'] or DEFAULT_ROLE
+        user['remove'] = user['remove'].lower() in ('yes', 'y', 'true', '1')
+        if not user['remove']:
+            if not user['sshkey']:
+                raise SystemExit('%s: no sshkey file for user %s' % (manifest_file, user['username']))
+            with open(os.path.join(directory, user['sshkey']), 'r') as f:
+                user['sshkey'] = f.read().strip()
+        users.append(user)
+    return users
 
 
-def connect(username, sshkeyfile, switch_file):
-    global remote_conn
-    global host
+def manifest_commands(users, existing):
+    """
+        Config lines that bring a switch whose users are existing ({username: {'role', 'sshkey'}}, see
+        parse_username_config) in line with users.  Returns (commands, optional) where optional lists the
+        commands allowed to fail.
+    """
+    commands = []
+    optional = []
+    for user in users:
+        current = existing.get(user['username'])
+        if user['remove']:
+            if current is not None:
+                commands.append("no username "+user['username'])
+            continue
+        if current is not None and current['role'] == user['role'] and current['sshkey'] == user['sshkey']:
+            continue
+        if current is not None:
+            # remove user before adding again
+            commands.append("no username "+user['username'])
+            optional.append(commands[-1])
+        commands.append("username "+user['username']+" password 5 ! role "+user['role'])
+        commands.append("username "+user['username']+" sshkey "+user['sshkey'])
+    return commands, optional
+
+
+def manifest_compliant(switch, pool, users):
+    # True when switch needs no change for users (for --check-first)
+    return not manifest_commands(users, parse_username_config(pool.run(switch, 'show run | inc username')))[0]
+
+
+def provision_users(result, users):
+    # Add and remove the users of a manifest on a single switch in one config session
+    host = result.switch
+    session = open_shell(host)
+    try:
+        result.log('\t*** SSH session established with %s ***' % host)
+        existing = parse_username_config(session.send_command('show run | inc username'))
+        commands, optional = manifest_commands(users, existing)
+        if not commands:
+            result.log('\t*** All %d users already in place on %s ***' % (len(users), host))
+            result.ok = True
+        elif session.enter_config_mode(result.log):
+            result.log('\t*** Applying %d user changes on %s ***' % (len(commands), host))
+            apply_config(session, result, commands + ["exit"], optional=optional)
+        else:
+            result.log('\t*** Error in attempting config mode ***')
+    finally:
+        session.close()
+
+
+def connect_manifest(manifest_file, switch_file, workers=DEFAULT_WORKERS, inventory=None, site_limit=0, check_first=False,
+                     settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
+    users = read_manifest(manifest_file)
+    if os.path.isfile(switch_file):
+        switches = read_switch_list(switch_file)
+        if check_first:
+            switches = pending_switches(switches, manifest_compliant, args=(users,), workers=workers)
+        print('Provisioning %d users on %d switches with %d workers ...' % (len(users), len(switches), workers))
+        results = run_waves(switches, provision_users, args=(users,), workers=workers, inventory=inventory, site_limit=site_limit,
+                            settle=settle, settle_polls=settle_polls)
+        return report_results(results)
+
+
+def connect(username, sshkeyfile, switch_file, workers=DEFAULT_WORKERS, inventory=None, site_limit=0, check_first=False,
+            settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
     with open(sshkeyfile, 'r') as f:
         sshkey=f.read()
-    
+
     if os.path.isfile(switch_file):
-        myfile = open(switch_file, 'r')
-        for ip in myfile:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            remote_conn = ()
-            ip = ip.strip('\n')
-            host = ip
-            print_host = host
-            print_host = print_host.replace('\n', '')
-            try:
-                print('\n----- Connecting to %s -----\n' % print_host)
-                client.connect(host,timeout=5)
-                print('\t*** SSH session established with %s ***' % print_host)
-                remote_conn = client.invoke_shell()
-                output = remote_conn.recv(1000)
-                time.sleep(1)
-                if '(config)' not in output:
-                    time.sleep(1)
-                    print('\t*** Switching to Config Mode ***')
-                    remote_conn.send("config t\n")
-                    remote_conn.send('\n')
-                    time.sleep(1)
-                    output = remote_conn.recv(1000)
-                if '#' in output:
-                    print('\t*** Successfully entered Config Mode ***')
-                    remote_conn.send('terminal length 0\n')
-                    time.sleep(1)
-                    print('\t*** Adding user and their ssh key on '+host+' ***')
-                    # remove user before adding again
-                    remote_conn.send("no username "+username+"\n")
-                    time.sleep(1)
-                    remote_conn.send("username "+username+" password 5 ! role network-admin\n")
-                    time.sleep(1)
-                    remote_conn.send("username "+username+" sshkey "+sshkey+"\n")
-                    time.sleep(1)
-                    remote_conn.send("exit\n")
-                    time.sleep(1)
-                    print(remote_conn.recv(1000))
-                else:
-                    print('\t*** Error in attempting config mode ***')
-            except paramiko.SSHException:
-                print('\t*** Authentication Failed ***')
-            except socket.error:
-                print('\t*** %s is Unreachable ***' % host)
-            client.close()
+        switches = read_switch_list(switch_file)
+        if check_first:
+            switches = pending_switches(switches, user_compliant, args=(username, sshkey), workers=workers)
+        print('Adding user %s on %d switches with %d workers ...' % (username, len(switches), workers))
+        results = run_waves(switches, add_user_sshkey, args=(username, sshkey), workers=workers, inventory=inventory, site_limit=site_limit,
+                            settle=settle, settle_polls=settle_polls)
+        return report_results(results)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('sshkeyfile', help='filename including path if not in current directory for users sshkey')
-    parser.add_argument('switchlistfile', help='filename including path if not in current directory for switch list')
-    parser.add_argument('username', help='username of user to add to switch')
+    parser.add_argument('sshkeyfile', nargs='?', help='filename including path if not in current directory for users sshkey')
+    parser.add_argument('switchlistfile', nargs='?', help='filename including path if not in current directory for switch list')
+    parser.add_argument('username', nargs='?', help='username of user to add to switch')
+    parser.add_argument('--manifest', help='YAML or CSV manifest of users to add or remove, used with --switches instead of the positional arguments')
+    parser.add_argument('--switches', help='with --manifest, filename including path if not in current directory for switch list')
+    add_workers_argument(parser)
+    add_wave_arguments(parser)
+    add_check_argument(parser)
     args = parser.parse_args()
+    positionals = [args.sshkeyfile, args.switchlistfile, args.username]
+    if args.manifest:
+        if not args.switches:
+            parser.error('--manifest needs --switches')
+        if any(positionals):
+            parser.error('--manifest takes no sshkeyfile, switchlistfile or username arguments')
+    else:
+        if args.switches:
+            parser.error('--switches is only used with --manifest')
+        if not all(positionals):
+            parser.error('sshkeyfile, switchlistfile and username are required without --manifest')
+    inventory = load_inventory(args.inventory, args.inventory_state)
     
     # sshkeyfile should be in this format:
     # ssh-rsa AAAAB3NzaC12cyEAAAADAQABAAABAQDnZNT3fEvvROHtB+uKgkVso+XQfh2PanSx9WhYm/TH4L1LqwM5H/3+YiEpgD2Mm5tjMSJDTZAWkagTAm5GmrnC0MuvhD2/gmsSFzOp2PR2vTieIqWawAQTAdssZOA8StZzAOmVkLpHGkZtsutP0ZPqXSU3dxP5HcoYSqWEyMDUOxwTfNKStmVGlw+nK8G3RTU+i8Y8m/SD+TJxB4v0Sbkh32S6d6CuNmVmuhhZIB74Ly7qwz6C8S/FvDSesZRO9iDWgDSbu5qULD1S+q2Vu97LE5d/7efaDSgnytasJl1yKAqn/KpL2/KDCYX6nMVbVSEaMdXzUCbhCeyKhDcHVUVn somebody@somewhere
     # 
     # switchlistfile should just be a text file with a list of each switch name accessible via ssh
     # 
+    # manifest (--manifest team.csv --switches switchlistfile) should be in this format, sshkey paths relative to the manifest:
+    # username,role,sshkey,remove
+    # alice,network-admin,keys/alice.pub,
+    # bob,network-operator,keys/bob.pub,
+    # carol,,,yes
+    #
     # Assumption:  The user executing this script has admin access and SSH key enabled on all switches in switchlistfile to avoid having to login to each
     #              switch.
 
-    if os.path.isfile(args.switchlistfile) and os.path.isfile(args.sshkeyfile) and args.username:
-        connect(args.username,args.sshkeyfile,args.switchlistfile)
+    if args.manifest:
+        if os.path.isfile(args.manifest) and os.path.isfile(args.switches):
+            sys.exit(0 if connect_manifest(args.manifest,args.switches,args.workers,inventory=inventory,site_limit=args.site_limit,check_first=args.check_first,
+                                           settle=args.settle,settle_polls=args.settle_polls) else 1)
+        else:
+            print("Please make sure to have both manifest and switchlist files.")
+    elif os.path.isfile(args.switchlistfile) and os.path.isfile(args.sshkeyfile):
+        sys.exit(0 if connect(args.username,args.sshkeyfile,args.switchlistfile,args.workers,inventory=inventory,site_limit=args.site_limit,check_first=args.check_first,
+                              settle=args.settle,settle_polls=args.settle_polls) else 1)
     else:
-        print("Please make sure to have username and both sshkey and switchlist files.")
+        print("Please make sure to have both sshkey and switchlist files.")
      
 
 if __name__ == '__main__':
@@ -8,73 +8,62 @@
 #  Original creation date: 11/05/18
 #
 
-import re
 import sys
-import time
 import os
-import getpass
-import socket
 import argparse
-import paramiko
 
+from mds_session import apply_config, open_shell
+from mds_fleet import DEFAULT_WORKERS, add_workers_argument, read_switch_list, report_results
+from mds_inventory import load_inventory
+from mds_compliance import add_check_argument, config_lines, pending_switches
+from mds_waves import DEFAULT_SETTLE, DEFAULT_SETTLE_POLLS, add_wave_arguments, run_waves
 
-def connect(switch_file):
-    global remote_conn
-    global host
-    
+
+def timeout_compliant(switch, pool):
+    # True when the vty lines of switch already have exec-timeout 15
+    return 'exec-timeout 15' in config_lines(pool.run(switch, 'show run | sec "line vty"'))
+
+
+def change_timeout(result):
+    # Set exec-timeout on the vty lines of a single switch
+    host = result.switch
+    session = open_shell(host)
+    try:
+        result.log('\t*** SSH session established with %s ***' % host)
+        if session.enter_config_mode(result.log):
+            result.log('\t*** Changing exec-timeout on '+host+' ***')
+            # One pipelined block; each line's echo and any "% Invalid command" is matched back to it
+            apply_config(session, result, ["line vty", "exec-timeout 15", "exit", "exit"])
+        else:
+            result.log('\t*** Error in attempting config mode ***')
+    finally:
+        session.close()
+
+
+def connect(switch_file, workers=DEFAULT_WORKERS, inventory=None, site_limit=0, check_first=False,
+            settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
     if os.path.isfile(switch_file):
-        myfile = open(switch_file, 'r')
-        for ip in myfile:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            remote_conn = ()
-            ip = ip.strip('\n')
-            host = ip
-            print_host = host
-            print_host = print_host.replace('\n', '')
-            try:
-                print('\n----- Connecting to %s -----\n' % print_host)
-                client.connect(host,timeout=5)
-                print('\t*** SSH session established with %s ***' % print_host)
-                remote_conn = client.invoke_shell()
-                output = remote_conn.recv(1000)
-                time.sleep(1)
-                if '(config)' not in output:
-                    time.sleep(1)
-                    print('\t*** Switching to Config Mode ***')
-                    remote_conn.send("config t\n")
-                    remote_conn.send('\n')
-                    time.sleep(1)
-                    output = remote_conn.recv(1000)
-                if '#' in output:
-                    print('\t*** Successfully entered Config Mode ***')
-                    remote_conn.send('terminal length 0\n')
-                    time.sleep(1)
-                    print('\t*** Changing exec-timeout on '+host+' ***')
-                    remote_conn.send("line vty\n")
-                    time.sleep(1)
-                    remote_conn.send("exec-timeout 15\n")
-                    time.sleep(1)
-                    remote_conn.send("exit\n")
-                    time.sleep(1)
-                    remote_conn.send("exit\n")
-                    print(remote_conn.recv(1000))
-                else:
-                    print('\t*** Error in attempting config mode ***')
-            except paramiko.SSHException:
-                print('\t*** Authentication Failed ***')
-            except socket.error:
-                print('\t*** %s is Unreachable ***' % host)
-            client.close()
+        switches = read_switch_list(switch_file)
+        if check_first:
+            switches = pending_switches(switches, timeout_compliant, workers=workers)
+        print('Changing exec-timeout on %d switches with %d workers ...' % (len(switches), workers))
+        results = run_waves(switches, change_timeout, workers=workers, inventory=inventory, site_limit=site_limit,
+                            settle=settle, settle_polls=settle_polls)
+        return report_results(results)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('switchlistfile', help='filename including path if not in current directory for switch list')
+    add_workers_argument(parser)
+    add_wave_arguments(parser)
+    add_check_argument(parser)
     args = parser.parse_args()
+    inventory = load_inventory(args.inventory, args.inventory_state)
     
     if os.path.isfile(args.switchlistfile):
-        connect(args.switchlistfile)
+        sys.exit(0 if connect(args.switchlistfile,args.workers,inventory=inventory,site_limit=args.site_limit,check_first=args.check_first,
+                              settle=args.settle,settle_polls=args.settle_polls) else 1)
     else:
         print("Please make sure to have switchlist file.")
     
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+#
+#  Title:  collect_san_port_counters.py
+#  Description:  This script polls 'show interface counters' on every MDS switch in the inventory on an interval,
+#                keeps the per-port counters of each switch in NumPy arrays, turns consecutive samples into
+#                reset-safe deltas and rates, and writes per-port rollups (traffic, errors, average and
+#                peak throughput) to a PostgreSQL database in bulk once per rollup period
+#
+
+import psycopg2
+import psycopg2.extras
+import sys
+import re
+import time
+import datetime
+import logging
+import argparse
+
+import numpy as np
+
+from mds_fleet import add_workers_argument, run_fleet
+from mds_inventory import add_inventory_argument, load_inventory
+from mds_session import SessionPool
+from mds_timing import Timings, add_metrics_arguments, measure
+
+# Column order of the counter arrays
+COUNTER_FIELDS = ('rx_frames', 'rx_bytes', 'rx_discards', 'rx_errors', 'rx_crc',
+                  'tx_frames', 'tx_bytes', 'tx_discards', 'tx_errors')
+FIELD_INDEX = dict((name, index) for index, name in enumerate(COUNTER_FIELDS))
+# Fields each polling mode fills in; the others are stored as NULL
+MODE_FIELDS = {'detail': COUNTER_FIELDS, 'brief': ('rx_frames', 'tx_frames')}
+MODE_COMMANDS = {'detail': 'show interface counters', 'brief': 'show interface counters brief'}
+
+# Rows kept for the next rollup while the database cannot be written (about 3 days of 5 minute rows for 1000 ports)
+MAX_PENDING_ROWS = 1000000
+
+
+def parse_port_counters(lines):
+    """
+        Parse 'show interface counters' lines into (ports, rows) where rows holds one list of COUNTER_FIELDS
+        values per fc port.  The discards/errors line after 'frames input' and 'frames output' belongs to that direction.
+    """
+    port_regex = re.compile(r'^(fc\d+/\d+)\s*$')
+    frames_regex = re.compile(r'^\s+(\d+) frames (input|output),\s*(\d+) bytes')
+    errors_regex = re.compile(r'^\s+(\d+) discards,\s*(\d+) errors')
+    crc_regex = re.compile(r'^\s+(\d+) (?:invalid )?CRC')
+    ports = []
+    rows = []
+    row = None
+    direction = None
+    for line in lines:
+        match = port_regex.match(line)
+        if match:
+            row = [0] * len(COUNTER_FIELDS)
+            ports.append(match.group(1))
+            rows.append(row)
+            direction = None
+            continue
+        if row is None:
+            continue
+        match = frames_regex.match(line)
+        if match:
+            direction = 'rx' if match.group(2) == 'input' else 'tx'
+            row[FIELD_INDEX[direction + '_frames']] = int(match.group(1))
+            row[FIELD_INDEX[direction + '_bytes']] = int(match.group(3))
+            continue
+        match = errors_regex.match(line)
+        if match and direction:
+            row[FIELD_INDEX[direction + '_discards']] = int(match.group(1))
+            row[FIELD_INDEX[direction + '_errors']] = int(match.group(2))
+            continue
+        match = crc_regex.match(line)
+        if match and direction == 'rx':
+            row[FIELD_INDEX['rx_crc']] = int(match.group(1))
+    return ports, rows
+
+
+def parse_port_counters_brief(lines):
+    # Parse 'show interface counters brief' lines (Interface, input MB/s, input frames, output MB/s, output frames)
+    port_regex = re.compile(r'^(fc\d+/\d+)\s+\d+\s+(\d+)\s+\d+\s+(\d+)')
+    ports = []
+    rows = []
+    for line in lines:
+        match = port_regex.match(line)
+        if match:
+            row = [0] * len(COUNTER_FIELDS)
+            row[FIELD_INDEX['rx_frames']] = int(match.group(2))
+            row[FIELD_INDEX['tx_frames']] = int(match.group(3))
+            ports.append(match.group(1))
+            rows.append(row)
+    return ports, rows
+
+
+MODE_PARSERS = {'detail': parse_port_counters, 'brief': parse_port_counters_brief}
+
+
+def counter_deltas(previous, current):
+    """
+        Increase of every counter between two samples (uint64 arrays of shape ports x fields).  MDS counters are
+        64 bits wide and do not wrap in practice, so a counter that went down was reset (clear counters, line card
+        reload) and its current value is the increase since the reset.
+    """
+    return np.where(current < previous, current, current - previous)
+
+
+class PortCounters(object):
+    """
+        Counters of one switch: the last sample as a uint64 array (ports x COUNTER_FIELDS) and the rollup of the
+        current period, i.e. summed deltas, peak rx/tx bytes per second, sampled seconds and sample count.
+    """
+    def __init__(self, switch, fields=COUNTER_FIELDS):
+        self.switch = switch
+        self.fields = fields
+        self.ports = None
+        self.last = None
+        self.last_time = None
+        self.reset_rollup(None)
+
+    def reset_rollup(self, period_start):
+        self.period_start = period_start
+        self.totals = None
+        self.peaks = None
+        self.seconds = 0.0
+        self.samples = 0
+
+    def update(self, ports, rows, when):
+        """
+            Add one sample taken at when (epoch seconds).  The first sample, and any sample with a different port list
+            (line card inserted or removed), only sets the baseline; the rollup so far is returned as rows first.
+        """
+        rows_out = []
+        current = np.array(rows, dtype=np.uint64).reshape(len(ports), len(COUNTER_FIELDS))
+        if self.ports != ports:
+            rows_out = self.rollup(when)
+            self.ports = ports
+            self.last = current
+            self.last_time = when
+            self.reset_rollup(when)
+            return rows_out
+        seconds = when - self.last_time
+        if seconds <= 0:
+            return rows_out
+        delta = counter_deltas(self.last, current)
+        rates = delta[:, [FIELD_INDEX['rx_bytes'], FIELD_INDEX['tx_bytes']]] / seconds
+        if self.totals is None:
+            self.totals = delta
+            self.peaks = rates
+        else:
+            self.totals += delta
+            np.maximum(self.peaks, rates, out=self.peaks)
+        self.seconds += seconds
+        self.samples += 1
+        self.last = current
+        self.last_time = when
+        return rows_out
+
+    def rollup(self, period_end):
+        """
+            Rows for the san_port_counters table covering the period since the last rollup, one per port, and start
+            the next period.  Fields the polling mode does not collect are None.
+        """
+        if self.totals is None or not self.samples:
+            self.reset_rollup(period_end)
+            return []
+        start = datetime.datetime.fromtimestamp(self.period_start)
+        end = datetime.datetime.fromtimestamp(period_end)
+        totals = self.totals.tolist()
+        has_bytes = 'rx_bytes' in self.fields
+        averages = (self.totals[:, [FIELD_INDEX['rx_bytes'], FIELD_INDEX['tx_bytes']]] * 8 / self.seconds).tolist()
+        peaks = (self.peaks * 8).tolist()
+        rows = []
+        for index, port in enumerate(self.ports):
+            values = [totals[index][FIELD_INDEX[name]] if name in self.fields else None for name in COUNTER_FIELDS]
+            bps = averages[index] + peaks[index] if has_bytes else [None] * 4
+            rows.append(tuple([self.switch, port, start, end, self.samples] + values + bps))
+        self.reset_rollup(period_end)
+        return rows
+
+
+def poll_switch(result, pool, mode):
+    # Fleet task: one counter sample of a switch in result.data (ports, rows, time)
+    cmd = MODE_COMMANDS[mode]
+    output = pool.run(result.switch, cmd)
+    result.data['time'] = time.time()
+    with measure(pool.timings, result.switch, 'parse', MODE_PARSERS[mode].__name__):
+        result.data['ports'], result.data['rows'] = MODE_PARSERS[mode](output.splitlines())
+    result.ok = bool(result.data['ports'])
+    if not result.ok:
+        result.log('\t*** No fc ports in %s output ***' % cmd)
+
+
+def write_counter_rows(con, rows):
+    """
+        Write all rollup rows in one transaction, replacing rows of a period that was already written.
+        Log the error and roll back on failure; polling goes on.
+    """
+    # Database schema
+    #            Table "public.san_port_counters"
+    #    Column       |            Type             | Modifiers
+    #    -------------+-----------------------------+-----------
+    #    switchname   | character varying(34)       | not null
+    #    interface    | character varying(16)       | not null
+    #    period_start | timestamp without time zone | not null
+    #    period_end   | timestamp without time zone | not null
+    #    samples      | integer                     | not null
+    #    rx_frames, rx_bytes, rx_discards, rx_errors, rx_crc,
+    #    tx_frames, tx_bytes, tx_discards, tx_errors        | bigint
+    #    avg_rx_bps, avg_tx_bps, peak_rx_bps, peak_tx_bps  | double precision
+    #    Indexes:
+    #        "san_port_counters_pkey" PRIMARY KEY, btree (switchname, interface, period_start)
+    columns = ('switchname', 'interface', 'period_start', 'period_end', 'samples') + COUNTER_FIELDS + \
+              ('avg_rx_bps', 'avg_tx_bps', 'peak_rx_bps', 'peak_tx_bps')
+    updates = ', '.join('%s = EXCLUDED.%s' % (column, column) for column in columns[3:])
+    try:
+        with con.cursor() as cur:
+            psycopg2.extras.execute_values(cur,
+                "INSERT INTO san_port_counters (%s) VALUES %%s "
+                "ON CONFLICT (switchname, interface, period_start) DO UPDATE SET %s" % (', '.join(columns), updates),
+                rows, page_size=1000)
+        con.commit()
+        return True
+    except psycopg2.DatabaseError as e:
+        con.rollback()
+        logging.error("Error with database insert.  Error: %s" % e)
+        print(f'Error: {e}')
+        return False
+
+
+def flush_rollup(con, counters, pending, timings, metrics_dir):
+    """
+        Roll up every switch into pending and write all pending rows, including those of earlier periods whose
+        write failed.  Returns True when pending was written (or empty); on False the caller keeps pending for
+        the next rollup.  Past MAX_PENDING_ROWS the oldest rows are dropped so an outage cannot grow it forever.
+    """
+    now = time.time()
+    for switch_counters in counters.values():
+        pending.extend(switch_counters.rollup(now))
+    if len(pending) > MAX_PENDING_ROWS:
+        logging.warning("Dropping %s unwritten port rows, more than %s are pending." % (len(pending) - MAX_PENDING_ROWS, MAX_PENDING_ROWS))
+        del pending[:len(pending) - MAX_PENDING_ROWS]
+    written = True
+    if pending:
+        with measure(timings, None, 'db_write', 'san_port_counters'):
+            written = write_counter_rows(con, pending)
+        if written:
+            logging.info("Wrote %s port rows to san_port_counters." % len(pending))
+        else:
+            logging.warning("Keeping %s port rows for the next rollup." % len(pending))
+    if metrics_dir:
+        timings.write(metrics_dir)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--interval', type=float, default=60, help='seconds between counter samples (default: 60)')
+    parser.add_argument('--rollup', type=float, default=300, help='seconds of samples per database row (default: 300)')
+    parser.add_argument('--count', type=int, default=0, help='stop after this many samples (default: 0, run until interrupted)')
+    parser.add_argument('--mode', choices=sorted(MODE_COMMANDS), default='detail',
+                        help="detail polls 'show interface counters' (bytes, frames, errors); brief polls "
+                             "'show interface counters brief' (frames only, much smaller output) (default: detail)")
+    add_workers_argument(parser)
+    add_inventory_argument(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    if not args.inventory:
+        parser.error('an inventory of the switches is needed (--inventory or $MDS_INVENTORY)')
+    switches = load_inventory(args.inventory, args.inventory_state).names()
+
+    logging.basicConfig(filename='/var/log/san_port_counters.log', level=logging.INFO,
+                        format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p :')
+
+    # Connect to PostgreSQL database
+    try:
+        con = psycopg2.connect(host='dbserver', database='dbname', user='dbuser', password='##############')
+    except psycopg2.DatabaseError as e:
+        print(e)
+        logging.error(e)
+        sys.exit(1)
+
+    logging.info("Starting collection of switch port counters on %d switches." % len(switches))
+    counters = dict((switch, PortCounters(switch, MODE_FIELDS[args.mode])) for switch in switches)
+    timings = Timings('san_port_counters')
+    # Transports stay open (with keepalives) between samples, or the samples go through mds_sessiond
+    pool = SessionPool(timeout=8, timings=timings, keepalive=args.interval)
+    pending = []
+    samples = 0
+    next_sample = time.time()
+    next_rollup = next_sample + args.rollup
+    try:
+        while not args.count or samples < args.count:
+            for result in run_fleet(switches, poll_switch, args=(pool, args.mode), workers=args.workers):
+                if result.ok:
+                    pending.extend(counters[result.switch].update(result.data['ports'], result.data['rows'], result.data['time']))
+                else:
+                    logging.warning("%s sample failed: %s" % (result.switch, ' '.join(message.strip() for message in result.messages)))
+            samples += 1
+            if time.time() >= next_rollup:
+                if flush_rollup(con, counters, pending, pool.timings, args.metrics_dir):
+                    pending = []
+                # Start a new Timings per rollup so a long run does not accumulate samples
+                pool.timings = Timings('san_port_counters')
+                next_rollup += args.rollup
+            next_sample += args.interval
+            if not args.count or samples < args.count:
+                time.sleep(max(0.0, next_sample - time.time()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Write whatever the current period holds so far
+        flush_rollup(con, counters, pending, pool.timings, args.metrics_dir)
+        pool.close()
+        con.close()
+    logging.info("Completed switch port counter collection.")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,47 +4,47 @@
 #  Author:  T. Reppert
 #  Description:  This script will collect port usage count for every MDS switch and write it to a PostgreSQL database
 #
+#                The switches now come from the shared inventory csv (see mds_inventory) instead of a list in
+#                this script, so a cron entry that ran it with no arguments needs --inventory <csv file> added
+#                (or MDS_INVENTORY set in the crontab).
+#
 #  Original creation date: 12/7/2018
 #
 
 import psycopg2
-import os
+import psycopg2.extras
 import sys
-import subprocess
-import string
+import socket
 import re
-from pprint import pprint
 import datetime
-from datetime import date
 import paramiko
 import logging
+import argparse
 
-# Setup logging globally
-logging.basicConfig(filename='/var/log/san_port_usage_table_update.log', level=logging.INFO,
-                    format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p :')
+from mds_cache import ShowCache, add_cache_arguments
+from mds_inventory import add_inventory_argument, load_inventory
+from mds_json import add_parser_argument, interface_brief_records, run_json
+from mds_parsers import parse_port_brief_records
+from mds_session import SessionPool
+from mds_timing import Timings, add_metrics_arguments, measure
 
 
-def run_switch_cmd(switch, cmd):
+def stream_switch_cmd(pool, switch, cmd):
     """
-        Run the provided switch command against given switch and return output as list.  Log and exit on error.
+        Run the provided switch command against given switch and yield output lines as they arrive.  Log and exit on error.
     """
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # The pool connects on first use, through mds_sessiond when it is running, so connection errors surface here
     try:
-        ssh.connect(switch, timeout=8)
-    except Exception as e:
+        for line in pool.iter_lines(switch, cmd):
+            yield line
+    except (socket.error, paramiko.SSHException) as e:
         print(f"Issue with connecting to {switch}.  Please investigate: {e}")
         logging.info("Issue with connecting to %s.  Please investigate: %s " % (switch, e))
         sys.exit()
-    try:
-        stdin1, stdout1, stderr1 = ssh.exec_command(cmd)
-        stdin1.flush()
     except Exception as e:
         print(f"Issue with executing command {cmd} on {switch}.  Please investigate: {e}")
         logging.info("Issue with executing command %s on %s.  Please investigate: %s " % (cmd, switch, e))
         sys.exit()
-    
-    return stdout1.read().decode("utf-8").splitlines()
 
 
 def parse_port_detail_array(port_detail_output):
@@ -68,15 +68,88 @@ def parse_port_brief_array(port_brief_output):
     return total_ports
 
 
+# 'sh int brief' Status values counted as administratively down (shutdown ports report "down";
+# ports that are enabled but have no light report notConnected, sfpAbsent, etc.)
+ADMIN_DOWN_STATUSES = ('down',)
+
+
+def count_port_usage(records):
+    # Return (admin_down_ports, total_ports) from parsed 'sh int brief' records
+    admin_down_ports = sum(1 for record in records if record['status'] in ADMIN_DOWN_STATUSES)
+    return admin_down_ports, len(records)
+
+
+def collect_brief_records(pool, switch, parser_mode='auto'):
+    """
+        Return ('sh int brief' records, parser path) for switch, using '| json' when the switch supports it.  Log and exit on error.
+    """
+    if parser_mode != 'regex':
+        try:
+            data = run_json(pool, switch, 'sh int brief')
+        except Exception as e:
+            print(f"Issue with executing command sh int brief | json on {switch}.  Please investigate: {e}")
+            logging.info("Issue with executing command sh int brief | json on %s.  Please investigate: %s " % (switch, e))
+            sys.exit()
+        if data is not None:
+            with measure(pool.timings, switch, 'parse', 'interface_brief_records'):
+                return interface_brief_records(data), 'json'
+        if parser_mode == 'json':
+            print(f"{switch} does not support 'sh int brief | json'")
+            logging.info("%s does not support 'sh int brief | json'" % switch)
+            sys.exit()
+    # Streamed parsing overlaps the transfer, so its time is part of the command time
+    return parse_port_brief_records(filter(None, stream_switch_cmd(pool, switch, 'sh int brief'))), 'regex'
+
+
+def write_usage_rows(con, rows):
+    """
+        Write all (switchname, used_ports, total_ports, date) rows in one transaction.  Re-running on the same day
+        updates the existing (switchname, date) rows instead of failing on the primary key.  Log and exit on error.
+    """
+    try:
+        with con.cursor() as cur:
+            psycopg2.extras.execute_values(cur,
+                "INSERT INTO san_port_usage (switchname, used_ports, total_ports, date) VALUES %s "
+                "ON CONFLICT (switchname, date) DO UPDATE SET used_ports = EXCLUDED.used_ports, total_ports = EXCLUDED.total_ports",
+                rows, page_size=1000)
+        con.commit()
+    except psycopg2.DatabaseError as e:
+        con.rollback()
+        logging.info("Error with database insert.  Error: %s" % e)
+        print(f'Error: {e}')
+        sys.exit(1)
+
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cross-check', action='store_true',
+                        help="also count admin down ports from the full 'sh int' output and log any difference")
+    add_parser_argument(parser)
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_inventory_argument(parser)
+    args = parser.parse_args()
+    timings = Timings('san_port_usage')
+
+    # Setup logging globally (here rather than at import so the parsers can be imported by the benchmarks)
+    logging.basicConfig(filename='/var/log/san_port_usage_table_update.log', level=logging.INFO,
+                        format='%(asctime)s %(levelname)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p :')
+
+    if not args.inventory:
+        # The switch list used to be in this script; tell cron users what changed, in the log as well
+        message = ('no switch inventory: the switch list moved to an inventory csv (switch,fabric,site,role,address), '
+                   'add --inventory <csv file> to the cron entry or set MDS_INVENTORY')
+        logging.error(message)
+        parser.error(message)
+    inventory = load_inventory(args.inventory, args.inventory_state)
+
     # Get current date/time
     now = datetime.datetime.now().strftime('%Y-%m-%d')
 
     # Connect to PostgreSQL database
     try:
         con = psycopg2.connect(host='dbserver', database='dbname', user='dbuser', password='##############')
-        cur = con.cursor()
-    
+
     except psycopg2.DatabaseError as e:
         print(e)
         logging.error(e)
@@ -84,57 +157,60 @@ def main():
 
     logging.info("Starting collection of switch port usage data.")
 
-    switches = {'mds1': '192.168.100.100',
-                'mds2': '192.168.100.101'
-                }
-
-    for switch, switchip in sorted(switches.items()):
-        port_detail_output = run_switch_cmd(switch, 'sh int')
-        port_brief_output = run_switch_cmd(switch, 'sh int brief')
-
-        if port_brief_output and port_detail_output:
-            port_detail_output = filter(None, port_detail_output)
-            port_brief_output = filter(None, port_brief_output)
-
-            admin_down_ports = parse_port_detail_array(port_detail_output)
-            total_ports = parse_port_brief_array(port_brief_output)
-
-        if admin_down_ports and total_ports:
-            # Database schema
-            #            Table "public.san_port_usage"
-            #    Column    |         Type          | Modifiers
-            #    -------------+-----------------------+-----------
-            #    switchname  | character varying(34) | not null
-            #    used_ports  | integer               | not null
-            #    total_ports | integer               | not null
-            #    date        | date                  | not null
-            #    Indexes:
-            #        "san_port_usage_pkey" PRIMARY KEY, btree (switchname, date)
-            #
-            # Query db with "SELECT * FROM san_port_usage WHERE switchname = '$switchname' and date = '$date'"
-
-            used_ports = total_ports - admin_down_ports
-            percent_used = round((used_ports / total_ports) * 100)
-            print(f'{switch}    Used: {used_ports}    Total: {total_ports}    Percent Used: {percent_used}')
-
-            # Insert data into database
-            try:
-                cur.execute("INSERT INTO san_port_usage (switchname, used_ports, total_ports, date) VALUES (%s, %s, %s, %s)", (switch, used_ports, total_ports, now))
-                con.commit()
-
-            except psycopg2.DatabaseError as e:
-                logging.info("Error with database insert.  Error: %s" % e)
-                print(f'Error: {e}')
-                sys.exit(1)            
+    # Switches (and their management addresses) come from the shared inventory
+    switches = inventory.names()
+
+    usage_rows = []
+    with SessionPool(timeout=8, cache=ShowCache(args.cache_dir), max_age=args.max_age, timings=timings) as pool:
+        for switch in sorted(switches):
+            # Both counts come from 'sh int brief'; the verbose 'sh int' is only pulled for --cross-check
+            records, parser_path = collect_brief_records(pool, switch, args.parser)
+            logging.info("%s port records collected with %s parser" % (switch, parser_path))
+            admin_down_ports, total_ports = count_port_usage(records)
+            if args.cross_check:
+                # Lines are counted as they stream in so the full 'sh int' output is never held in memory
+                detail_admin_down = parse_port_detail_array(filter(None, stream_switch_cmd(pool, switch, 'sh int')))
+                if detail_admin_down != admin_down_ports:
+                    print(f"{switch} admin down mismatch: 'sh int brief' {admin_down_ports}, 'sh int' {detail_admin_down}")
+                    logging.warning("%s admin down mismatch: 'sh int brief' %s, 'sh int' %s" % (switch, admin_down_ports, detail_admin_down))
+            pool.close_switch(switch)
+
+            if admin_down_ports and total_ports:
+                # Database schema
+                #            Table "public.san_port_usage"
+                #    Column    |         Type          | Modifiers
+                #    -------------+-----------------------+-----------
+                #    switchname  | character varying(34) | not null
+                #    used_ports  | integer               | not null
+                #    total_ports | integer               | not null
+                #    date        | date                  | not null
+                #    Indexes:
+                #        "san_port_usage_pkey" PRIMARY KEY, btree (switchname, date)
+                #
+                # Query db with "SELECT * FROM san_port_usage WHERE switchname = '$switchname' and date = '$date'"
+
+                used_ports = total_ports - admin_down_ports
+                percent_used = round((used_ports / total_ports) * 100)
+                print(f'{switch}    Used: {used_ports}    Total: {total_ports}    Percent Used: {percent_used}    Parser: {parser_path}')
+
+                usage_rows.append((switch, used_ports, total_ports, now))
+
+    # Insert data into database
+    if usage_rows:
+        with measure(timings, None, 'db_write', 'san_port_usage'):
+            write_usage_rows(con, usage_rows)
+        logging.info("Wrote %s switch rows to san_port_usage." % len(usage_rows))
 
     print()
     logging.info("Completed switch port usage data collection/update.")
 
     # Disconnect from san_db database
     if con:
-        cur.close()
         con.close()
 
+    if args.metrics_dir:
+        timings.write(args.metrics_dir)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_cache.py
+#  Description:  On-disk cache of show command output shared by the MDS tools.  Output is stored
+#                zlib-compressed per (switch, command) with its collection time, so a tool run with
+#                --max-age can reuse what another tool pulled from the same switch minutes earlier.
+#                The cache is trimmed oldest-first once it grows past its size limit.
+#
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+import zlib
+
+DEFAULT_CACHE_DIR = os.environ.get('MDS_CACHE_DIR', os.path.expanduser('~/.cache/mds_tools'))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Abbreviations normalized so "sh int desc" and "show interface description" share an entry
+abbreviations = {'sh': 'show', 'int': 'interface', 'desc': 'description', 'br': 'brief', 'run': 'running-config'}
+# Output filters whose pattern after the pipe is matched case-sensitively by the switch
+filter_keywords = ('include', 'inc', 'exclude', 'ex', 'grep', 'egrep', 'section', 'sec', 'begin')
+# A quoted argument or a run of non-blank characters
+command_token_regex = re.compile(r'"[^"]*"|\'[^\']*\'|\S+')
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--max-age', type=int, default=0,
+                        help='reuse cached show output up to this many seconds old instead of asking the switch (default: 0, always ask)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory for cached show output (default: %s)' % DEFAULT_CACHE_DIR)
+
+
+def normalize_command(cmd):
+    # Collapse whitespace and lowercase/expand the keywords; quoted arguments and filter patterns are kept as typed
+    words = []
+    in_pattern = False
+    for token in command_token_regex.findall(cmd):
+        if token == '|':
+            in_pattern = False
+            words.append(token)
+            continue
+        if in_pattern or token[0] in '"\'':
+            words.append(token)
+            continue
+        word = token.lower()
+        in_pattern = bool(words) and words[-1] == '|' and word in filter_keywords
+        words.append(abbreviations.get(word, word))
+    return ' '.join(words)
+
+
+class ShowCache(object):
+    """
+        Compressed show output keyed by (switch, command).  The file modification time is the time the
+        output was collected.  Safe to share between threads and processes: entries are replaced atomically.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, switch, cmd):
+        key = '%s\0%s' % (switch.lower(), normalize_command(cmd))
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.z')
+
+    def is_fresh(self, switch, cmd, max_age):
+        if not max_age or max_age <= 0:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self.path(switch, cmd)) <= max_age
+        except OSError:
+            return False
+
+    def get(self, switch, cmd, max_age):
+        # Return cached output no older than max_age seconds, or None
+        if not max_age or max_age <= 0:
+            return None
+        path = self.path(switch, cmd)
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                return None
+            with open(path, 'rb') as f:
+                return zlib.decompress(f.read()).decode('utf-8')
+        except (OSError, zlib.error):
+            return None
+
+    def put(self, switch, cmd, output):
+        self.put_compressed(switch, cmd, zlib.compress(output.encode('utf-8')))
+
+    def put_compressed(self, switch, cmd, data):
+        # Store already zlib-compressed output, e.g. built up with zlib.compressobj while streaming
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(switch, cmd))
+        self.evict()
+
+    def evict(self):
+        # Remove the oldest entries until the cache fits in max_bytes
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.z'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
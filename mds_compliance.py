@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_compliance.py
+#  Description:  Check-first mode for the config-push scripts.  Before any config session is opened,
+#                the relevant show output of every switch in the list is read in one parallel,
+#                read-only pass and compared with the desired state; only the switches that differ
+#                (or could not be checked) are then pushed to.
+#
+
+from mds_fleet import DEFAULT_WORKERS, run_fleet
+from mds_session import SessionPool
+
+
+def add_check_argument(parser):
+    parser.add_argument('--check-first', action='store_true',
+                        help='read the current config of every switch first and only push to the switches that differ')
+
+
+def check_switch(result, pool, check, args):
+    # Fleet task: result.data['compliant'] is what check(switch, pool, *args) says about one switch
+    try:
+        result.data['compliant'] = check(result.switch, pool, *args)
+        result.ok = True
+    finally:
+        pool.close_switch(result.switch)
+
+
+def pending_switches(switches, check, args=(), workers=DEFAULT_WORKERS):
+    """
+        Run check(switch, pool, *args), which returns True when a switch already has the desired config, against
+        every switch in parallel.  Returns the switches still to be pushed to: those that differ and those whose
+        check failed (the push reports their error).
+    """
+    with SessionPool(timeout=8) as pool:
+        results = run_fleet(switches, check_switch, args=(pool, check, args), workers=workers)
+    pending = []
+    for result in results:
+        if result.ok and result.data['compliant']:
+            continue
+        if not result.ok:
+            print('%s: check failed, will push anyway %s' % (result.switch, ' '.join(message.strip() for message in result.messages)))
+        pending.append(result.switch)
+    print('%d of %d switches already compliant, pushing to %d' % (len(switches) - len(pending), len(switches), len(pending)))
+    return pending
+
+
+def config_lines(output):
+    # Stripped, non-empty lines of show output for membership tests
+    return [line.strip() for line in output.splitlines() if line.strip()]
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_fixtures.py
+#  Description:  Generates realistic, mutually consistent MDS show output (sh int, sh int brief,
+#                sh int desc, sh int counters, sh flogi database, sh device-alias database) for a
+#                switch of a given port count, for the parser benchmarks and offline testing
+#
+
+import argparse
+import os
+import random
+import time
+
+SEPARATOR = '-' * 79
+
+# Port state mix seen on a typical edge director: (weight, status, sh int state line, oper mode)
+PORT_STATES = [
+    (60, 'up', 'is up', 'F'),
+    (4, 'trunking', 'is trunking', 'TE'),
+    (20, 'down', 'is down (Administratively down)', '--'),
+    (10, 'notConnected', 'is down (Link failure or not-connected)', '--'),
+    (6, 'sfpAbsent', 'is down (SFP not present)', '--'),
+]
+
+
+def wwn(prefix, number):
+    octets = [prefix, 0x00, 0x00, 0x25, 0xb5] + list((number >> shift) & 0xff for shift in (16, 8, 0))
+    return ':'.join('%02x' % octet for octet in octets)
+
+
+def port_names(ports):
+    # Directors carry up to 12 line cards; larger port counts use denser cards
+    per_slot = max(48, -(-ports // 12))
+    return ['fc%d/%d' % (index // per_slot + 1, index % per_slot + 1) for index in range(ports)]
+
+
+def build_switch(ports, logins_per_trunk=8, alias_ratio=0.9, seed=1):
+    """
+        Return one dict per port (interface, vsan, status, state, oper_mode, speed, description, logins) where
+        logins is a list of (pwwn, nwwn, alias or None).  Trunking ports are NPV uplinks with several logins.
+    """
+    rng = random.Random(seed)
+    weights = [state[0] for state in PORT_STATES]
+    switch = []
+    login = 0
+    for index, interface in enumerate(port_names(ports)):
+        weight, status, state, oper_mode = rng.choices(PORT_STATES, weights)[0]
+        port = {'interface': interface, 'vsan': 10 + index % 4, 'status': status, 'state': state,
+                'oper_mode': oper_mode, 'speed': 32 if status == 'trunking' else 16 if status == 'up' else None,
+                'description': '--', 'logins': []}
+        count = logins_per_trunk if status == 'trunking' else 1 if status == 'up' else 0
+        for _ in range(count):
+            login += 1
+            alias = 'host%05d_hba%d' % (login, login % 2) if rng.random() < alias_ratio else None
+            port['logins'].append((wwn(0x20, login), wwn(0x10, login), alias))
+        if status == 'trunking':
+            port['description'] = 'ISL_npv%02d' % (index % 100)
+        elif port['logins']:
+            # Most descriptions match the alias that logged in; a few are stale
+            alias = port['logins'][0][2]
+            port['description'] = alias if alias and rng.random() < 0.95 else 'host%05d_old' % login
+        elif status == 'down' and rng.random() < 0.5:
+            port['description'] = 'decom_%05d' % index
+        switch.append(port)
+    return switch
+
+
+def sh_int(switch):
+    lines = []
+    for port in switch:
+        lines.append('%s %s' % (port['interface'], port['state']))
+        lines.append('    Hardware is Fibre Channel, SFP is short wave laser w/o OFC (SN)')
+        lines.append('    Port WWN is %s' % wwn(0x20, 0x10000 + len(lines)))
+        lines.append('    Admin port mode is auto, trunk mode is on')
+        lines.append('    snmp link state traps are enabled')
+        if port['status'] in ('up', 'trunking'):
+            lines.append('    Port mode is %s, FCID is 0x%06x' % (port['oper_mode'], 0x010000 + len(lines)))
+            lines.append('    Port vsan is %d' % port['vsan'])
+            lines.append('    Speed is %d Gbps' % port['speed'])
+            lines.append('    Rate mode is dedicated')
+            lines.append('    Transmit B2B Credit is 40')
+            lines.append('    Receive B2B Credit is 32')
+            lines.append('    Receive data field Size is 2112')
+        else:
+            lines.append('    Port vsan is %d' % port['vsan'])
+            lines.append('    Receive data field Size is 2112')
+        lines.append('    Beacon is turned off')
+        lines.append('    Logical type is edge')
+        lines.append('    5 minutes input rate 1024 bits/sec,128 bytes/sec, 0 frames/sec')
+        lines.append('    5 minutes output rate 512 bits/sec,64 bytes/sec, 0 frames/sec')
+        lines.append('      123456 frames input,12345678 bytes')
+        lines.append('        0 discards,0 errors')
+        lines.append('        0 invalid CRC/FCS,0 unknown class')
+        lines.append('        0 too long,0 too short')
+        lines.append('      123456 frames output,12345678 bytes')
+        lines.append('        0 discards,0 errors')
+        lines.append('      0 input OLS,0 LRR,0 NOS,0 loop inits')
+        lines.append('      0 output OLS,0 LRR, 0 NOS, 0 loop inits')
+        lines.append('    Last clearing of "show interface" counters : never')
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def sh_int_brief(switch):
+    lines = ['', SEPARATOR,
+             'Interface  Vsan   Admin  Admin   Status          SFP    Oper  Oper   Port',
+             '                  Mode   Trunk                          Mode  Speed  Channel',
+             '                         Mode                                 (Gbps)',
+             SEPARATOR]
+    for port in switch:
+        sfp = '--' if port['status'] == 'sfpAbsent' else 'swl'
+        speed = str(port['speed']) if port['speed'] else ''
+        lines.append('%-11s%-7d%-7s%-8s%-17s%-7s%-6s%-7s%s' % (port['interface'], port['vsan'], 'auto', 'on', port['status'],
+                                                                sfp, port['oper_mode'], speed, '--'))
+    return '\n'.join(lines) + '\n'
+
+
+def sh_int_desc(switch):
+    lines = ['', SEPARATOR, 'Interface          Description', SEPARATOR]
+    for port in switch:
+        lines.append('%-19s%s' % (port['interface'], port['description']))
+    return '\n'.join(lines) + '\n'
+
+
+def port_rates(port, index):
+    # Steady bytes/sec (rx, tx) of a generated port: trunks carry more, down ports nothing
+    if port['status'] == 'trunking':
+        return 400000000 + index * 1000, 350000000 + index * 1000
+    if port['status'] == 'up':
+        return 50000000 + index * 1000, 30000000 + index * 1000
+    return 0, 0
+
+
+def port_counters(port, index, elapsed):
+    # Counters of a generated port elapsed seconds into the run, starting from a large per-port base
+    rx_rate, tx_rate = port_rates(port, index)
+    base = (index + 1) * 10 ** 9
+    rx_bytes = base + int(rx_rate * elapsed)
+    tx_bytes = base + int(tx_rate * elapsed)
+    errors = int(elapsed // 60) if port['status'] == 'up' and index % 7 == 0 else 0
+    return {'rx_frames': rx_bytes // 1024, 'rx_bytes': rx_bytes, 'rx_discards': 0, 'rx_errors': errors, 'rx_crc': errors,
+            'tx_frames': tx_bytes // 1024, 'tx_bytes': tx_bytes, 'tx_discards': 0, 'tx_errors': 0}
+
+
+def sh_int_counters(switch, elapsed=0.0):
+    lines = []
+    for index, port in enumerate(switch):
+        counters = port_counters(port, index, elapsed)
+        rx_rate, tx_rate = port_rates(port, index)
+        lines.append(port['interface'])
+        lines.append('    5 minutes input rate %d bits/sec, %d bytes/sec, %d frames/sec' % (rx_rate * 8, rx_rate, rx_rate // 1024))
+        lines.append('    5 minutes output rate %d bits/sec, %d bytes/sec, %d frames/sec' % (tx_rate * 8, tx_rate, tx_rate // 1024))
+        lines.append('    %d frames input, %d bytes' % (counters['rx_frames'], counters['rx_bytes']))
+        lines.append('      %d discards, %d errors' % (counters['rx_discards'], counters['rx_errors']))
+        lines.append('      %d invalid CRC/FCS, 0 unknown class' % counters['rx_crc'])
+        lines.append('      0 too long, 0 too short')
+        lines.append('    %d frames output, %d bytes' % (counters['tx_frames'], counters['tx_bytes']))
+        lines.append('      %d discards, %d errors' % (counters['tx_discards'], counters['tx_errors']))
+        lines.append('    0 input OLS, 0 LRR, 0 NOS, 0 loop inits')
+        lines.append('    0 output OLS, 0 LRR, 0 NOS, 0 loop inits')
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def sh_int_counters_brief(switch, elapsed=0.0):
+    lines = [SEPARATOR,
+             'Interface          Input (rate is 5 min avg)      Output (rate is 5 min avg)',
+             '                   -----------------------------  -----------------------------',
+             '                   Rate     Total                 Rate     Total',
+             '                   MB/s     Frames                MB/s     Frames',
+             SEPARATOR]
+    for index, port in enumerate(switch):
+        counters = port_counters(port, index, elapsed)
+        rx_rate, tx_rate = port_rates(port, index)
+        lines.append('%-19s%-9d%-22d%-9d%d' % (port['interface'], rx_rate // 1000000, counters['rx_frames'],
+                                               tx_rate // 1000000, counters['tx_frames']))
+    return '\n'.join(lines) + '\n'
+
+
+def sh_flogi_database(switch):
+    lines = [SEPARATOR, 'INTERFACE        VSAN    FCID           PORT NAME               NODE NAME', SEPARATOR]
+    fcid = 0x010000
+    for port in switch:
+        for pwwn, nwwn, alias in port['logins']:
+            fcid += 1
+            lines.append('%-17s%-8d0x%06x       %s %s' % (port['interface'], port['vsan'], fcid, pwwn, nwwn))
+            if alias:
+                lines.append('                           [%s]' % alias)
+    lines.append('')
+    lines.append('Total number of flogi = %d.' % (fcid - 0x010000))
+    return '\n'.join(lines) + '\n'
+
+
+def sh_device_alias_database(switch, entries=0, seed=1):
+    """
+        Device-alias database holding every alias logged in on switch plus enough fabric-wide
+        entries for hosts on other switches to reach entries in total
+    """
+    rng = random.Random(seed)
+    lines = []
+    for port in switch:
+        for pwwn, nwwn, alias in port['logins']:
+            if alias:
+                lines.append('device-alias name %s pwwn %s' % (alias, pwwn))
+    number = 0x800000
+    while len(lines) < entries:
+        number += 1
+        lines.append('device-alias name remote%06d_hba%d pwwn %s' % (number & 0xfffff, rng.randint(0, 3), wwn(0x21, number)))
+    lines.append('')
+    lines.append('Total number of entries = %d' % (len(lines) - 1))
+    return '\n'.join(lines) + '\n'
+
+
+def sh_device_alias_status(switch, entries=0, seed=1):
+    # Status summary of the database from sh_device_alias_database, its checksum included
+    database = sh_device_alias_database(switch, entries, seed)
+    count = database.count('device-alias name ')
+    checksum = 0
+    for char in database:
+        checksum = (checksum * 31 + ord(char)) & 0xffffffff
+    return ('Fabric Distribution: Enabled\n'
+            'Database:- Device Aliases %d   Mode: Enhanced\n'
+            '          Checksum: 0x%08x\n'
+            'Locked By:- User "" SWWN 00:00:00:00:00:00:00:00\n'
+            'Pending Database:- Device Aliases 0   Mode: Enhanced\n'
+            'Last Action Time Stamp: None\n' % (count, checksum))
+
+
+def default_settings():
+    # Global config of a generated switch, changed by the mock shell: banner, link traps, users and vty timeout
+    return {'banner': 'User Access Verification\n', 'link_traps': True, 'exec_timeout': 0,
+            'users': {'admin': {'role': 'network-admin', 'sshkey': None}}}
+
+
+def sh_banner_motd(settings):
+    return settings['banner']
+
+
+def sh_user_account(settings):
+    lines = []
+    for username, user in sorted(settings['users'].items()):
+        lines.append('user:%s' % username)
+        lines.append('        this user account has no expiry date')
+        lines.append('        roles:%s ' % user['role'])
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def sh_running_config(switch, last_change, settings=None):
+    # Header with the time of the last config change, the global settings, the vsan database and every
+    # interface with its description
+    settings = settings or default_settings()
+    lines = ['!Command: show running-config',
+             '!Running configuration last done at: %s' % time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(last_change)),
+             '!Time: %s' % time.strftime('%a %b %d %H:%M:%S %Y'),
+             '', 'version 9.4(2)']
+    lines.append('banner motd #%s#' % settings['banner'].rstrip('\n'))
+    lines.append('%ssnmp-server enable traps link' % ('' if settings['link_traps'] else 'no '))
+    for username, user in sorted(settings['users'].items()):
+        lines.append('username %s password 5 ! role %s' % (username, user['role']))
+        if user['sshkey']:
+            lines.append('username %s sshkey %s' % (username, user['sshkey']))
+    lines.append('line vty')
+    if settings['exec_timeout']:
+        lines.append('  exec-timeout %d' % settings['exec_timeout'])
+    lines.append('vsan database')
+    for port in switch:
+        lines.append('  vsan %d interface %s' % (port['vsan'], port['interface']))
+    for port in switch:
+        lines.append('')
+        lines.append('interface %s' % port['interface'])
+        if port['description'] != '--':
+            lines.append('  switchport description %s' % port['description'])
+        lines.append('  shutdown' if port['status'] == 'down' else '  no shutdown')
+    return '\n'.join(lines) + '\n'
+
+
+def switch_outputs(ports, aliases=0, seed=1):
+    # Return {command: output} for a generated switch with ports ports and an aliases-entry device-alias database
+    switch = build_switch(ports, seed=seed)
+    return {'sh int': sh_int(switch),
+            'sh int brief': sh_int_brief(switch),
+            'sh int desc': sh_int_desc(switch),
+            'sh flogi database': sh_flogi_database(switch),
+            'sh device-alias database': sh_device_alias_database(switch, aliases, seed)}
+
+
+def write_fixtures(directory, ports, aliases=0, seed=1):
+    # Write each generated output to <directory>/<ports>/<command with spaces as _>.txt
+    target = os.path.join(directory, str(ports))
+    os.makedirs(target, exist_ok=True)
+    for cmd, output in switch_outputs(ports, aliases, seed).items():
+        with open(os.path.join(target, cmd.replace(' ', '_') + '.txt'), 'w') as f:
+            f.write(output)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', help='directory to write the generated outputs to')
+    parser.add_argument('--ports', type=int, nargs='+', default=[48, 384, 768], help='port counts to generate')
+    parser.add_argument('--aliases', type=int, default=10000, help='entries in the device-alias database')
+    args = parser.parse_args()
+
+    for ports in args.ports:
+        print('Wrote %s' % write_fixtures(args.directory, ports, args.aliases))
+
+
+if __name__ == '__main__':
+    main()
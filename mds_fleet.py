@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_fleet.py
+#  Description:  Shared executor used by the config-push scripts to run a per-switch task
+#                against every switch in a switch list concurrently through a bounded
+#                thread pool, collecting and reporting the result of each switch separately
+#
+
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+DEFAULT_WORKERS = 10
+
+
+class SwitchResult(object):
+    """
+        Outcome of running a task against one switch.  Tasks append progress lines with log()
+        instead of printing so output from concurrent switches is not interleaved.  Tasks that
+        collect information rather than push config keep it in data.
+    """
+    def __init__(self, switch):
+        self.switch = switch
+        self.ok = False
+        self.messages = []
+        self.output = ''
+        self.data = {}
+        self.elapsed = 0.0
+
+    def log(self, message):
+        self.messages.append(message)
+
+
+def read_switch_list(switch_file):
+    # Return switch names from switchlistfile, ignoring blank lines
+    with open(switch_file, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def add_workers_argument(parser):
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of switches to work on at the same time (default: %d)' % DEFAULT_WORKERS)
+
+
+def _run_task(switch, task, args):
+    result = SwitchResult(switch)
+    start = time.time()
+    try:
+        task(result, *args)
+    except paramiko.BadHostKeyException:
+        result.ok = False
+        result.log('\t*** Host key of %s does not match the pinned key ***' % switch)
+    except paramiko.SSHException:
+        result.ok = False
+        result.log('\t*** Authentication Failed ***')
+    except socket.error:
+        result.ok = False
+        result.log('\t*** %s is Unreachable ***' % switch)
+    except Exception as e:
+        result.ok = False
+        result.log('\t*** Unexpected error on %s: %s ***' % (switch, e))
+    result.elapsed = time.time() - start
+    return result
+
+
+def run_fleet(switches, task, args=(), workers=DEFAULT_WORKERS):
+    """
+        Run task(result, *args) for every switch in switches with at most workers switches in flight.
+        The task should set result.ok and result.output; connection errors are caught and recorded here.
+        Returns a list of SwitchResult in the same order as switches.
+    """
+    workers = max(1, min(workers, len(switches) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_task, switch, task, args) for switch in switches]
+        return [future.result() for future in futures]
+
+
+def report_results(results):
+    # Print the collected messages and output of each switch, followed by a summary
+    for result in results:
+        print('\n----- %s (%.1fs) -----\n' % (result.switch, result.elapsed))
+        for message in result.messages:
+            print(message)
+        if result.output:
+            print(result.output)
+
+    failed = [result.switch for result in results if not result.ok]
+    print('\n%d switches processed, %d succeeded, %d failed' % (len(results), len(results) - len(failed), len(failed)))
+    if failed:
+        print('Failed: ' + ', '.join(failed))
+    return not failed
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_inventory.py
+#  Description:  Switch inventory shared by the MDS tools.  A csv file lists every switch with the
+#                fabric (A/B side of the dual-pathed SAN), site and role it belongs to and optionally
+#                its management address.  Resolved addresses and the host key first seen for each
+#                switch are kept in a JSON state file, so connects skip the DNS lookup and a changed
+#                host key is refused instead of silently accepted.
+#
+
+import argparse
+import base64
+import csv
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import paramiko
+
+import mds_session
+from mds_session import split_host_port
+
+DEFAULT_INVENTORY = os.environ.get('MDS_INVENTORY')
+DEFAULT_STATE_FILE = os.environ.get('MDS_INVENTORY_STATE', os.path.expanduser('~/.cache/mds_tools/inventory_state.json'))
+# Resolved addresses are looked up again after this many seconds, or at once when a connect to them fails
+DEFAULT_RESOLVE_AGE = 24 * 3600
+
+# Example inventory file format (address may be left empty to resolve the switch name):
+# switch,fabric,site,role,address
+# mds1,A,dc1,core,192.168.100.100
+# mds2,B,dc1,core,192.168.100.101
+# mds3,A,dc2,edge,
+INVENTORY_FIELDS = ('switch', 'fabric', 'site', 'role', 'address')
+
+key_classes = {'ssh-rsa': paramiko.RSAKey, 'ssh-ed25519': paramiko.Ed25519Key}
+key_classes.update(dict((name, paramiko.ECDSAKey) for name in ('ecdsa-sha2-nistp256', 'ecdsa-sha2-nistp384', 'ecdsa-sha2-nistp521')))
+
+
+def add_inventory_argument(parser):
+    parser.add_argument('--inventory', default=DEFAULT_INVENTORY,
+                        help='csv inventory (switch,fabric,site,role,address) of the switches (default: $MDS_INVENTORY)')
+    parser.add_argument('--inventory-state', default=DEFAULT_STATE_FILE,
+                        help='file keeping resolved addresses and pinned host keys (default: %s)' % DEFAULT_STATE_FILE)
+
+
+def read_inventory(inventory_file):
+    """
+        Read the inventory into {switch: {'switch', 'fabric', 'site', 'role', 'address'}}, keeping file order.
+        Blank lines and lines starting with # are ignored; missing columns are stored as ''.
+    """
+    inventory = {}
+    with open(inventory_file, 'r', newline='') as f:
+        lines = [line for line in f if line.strip() and not line.lstrip().startswith('#')]
+    for row in csv.DictReader(lines):
+        switch = (row.get('switch') or '').strip()
+        if not switch:
+            continue
+        inventory[switch] = dict((name, (row.get(name) or '').strip()) for name in INVENTORY_FIELDS)
+    return inventory
+
+
+class Inventory(object):
+    """
+        The switches of the inventory file (if any) plus the state file of resolved addresses and pinned host
+        keys.  Any switch name works, including ones not in the inventory file; state is filled in lazily on
+        the first connect and written back at once.  Safe to share between threads.
+    """
+    def __init__(self, inventory_file=None, state_file=DEFAULT_STATE_FILE, resolve_age=DEFAULT_RESOLVE_AGE):
+        self.inventory_file = inventory_file
+        self.switches = read_inventory(inventory_file) if inventory_file else {}
+        self.state_file = state_file
+        self.resolve_age = resolve_age
+        self.lock = threading.Lock()
+        self.state = {}
+        if state_file and os.path.isfile(state_file):
+            try:
+                with open(state_file, 'r') as f:
+                    self.state = json.load(f)
+            except ValueError:
+                self.state = {}
+
+    def names(self, fabric=None, site=None, role=None):
+        # Switch names of the inventory file in file order, optionally only one fabric, site or role
+        return [switch for switch, entry in self.switches.items()
+                if (fabric is None or entry['fabric'] == fabric) and (site is None or entry['site'] == site)
+                and (role is None or entry['role'] == role)]
+
+    def save(self):
+        # Called with self.lock held; replace the state file atomically
+        if not self.state_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_file)
+
+    def address(self, switch, refresh=False):
+        """
+            Return the address to connect to for switch: the address column of the inventory, else the cached
+            resolution of the switch name while younger than resolve_age, else a fresh lookup.
+        """
+        host, port = split_host_port(switch)
+        entry = self.switches.get(switch)
+        if entry and entry['address']:
+            return entry['address']
+        with self.lock:
+            cached = self.state.get(switch, {})
+            if cached.get('address') and not refresh and time.time() - cached.get('resolved', 0) <= self.resolve_age:
+                return cached['address']
+        address = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)[0][4][0]
+        with self.lock:
+            self.state.setdefault(switch, {}).update(address=address, resolved=time.time())
+            self.save()
+        return address
+
+    def host_key(self, switch):
+        # The pinned host key of switch as a paramiko key, or None before the first connect
+        with self.lock:
+            cached = self.state.get(switch, {})
+            if 'host_key' not in cached or cached.get('host_key_type') not in key_classes:
+                return None
+            return key_classes[cached['host_key_type']](data=base64.b64decode(cached['host_key']))
+
+    def pin_host_key(self, switch, key):
+        with self.lock:
+            cached = self.state.setdefault(switch, {})
+            cached.update(host_key_type=key.get_name(), host_key=key.get_base64())
+            self.save()
+
+    def forget(self, switch):
+        # Drop the cached address and pinned key, e.g. after a supervisor replacement changed the host key
+        with self.lock:
+            if self.state.pop(switch, None) is not None:
+                self.save()
+
+
+def load_inventory(inventory_file=None, state_file=DEFAULT_STATE_FILE):
+    # Load the inventory and make open_client use it for every connection of this run
+    inventory = Inventory(inventory_file, state_file)
+    mds_session.inventory = inventory
+    return inventory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_inventory_argument(parser)
+    parser.add_argument('--forget', nargs='+', metavar='SWITCH',
+                        help='drop the cached address and pinned host key of these switches (e.g. after a supervisor swap)')
+    args = parser.parse_args()
+
+    inventory = Inventory(args.inventory, args.inventory_state)
+    if args.forget:
+        for switch in args.forget:
+            inventory.forget(switch)
+            print('Forgot %s' % switch)
+        return
+    print("%-24s%8s%10s%10s%18s%14s" % ("Switch", "Fabric", "Site", "Role", "Address", "Host key"))
+    for switch in inventory.names() + sorted(set(inventory.state) - set(inventory.switches)):
+        entry = inventory.switches.get(switch, {})
+        cached = inventory.state.get(switch, {})
+        print("%-24s%8s%10s%10s%18s%14s" % (switch, entry.get('fabric', '--'), entry.get('site', '--'), entry.get('role', '--'),
+                                            entry.get('address') or cached.get('address', '--'), cached.get('host_key_type', '--')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_json.py
+#  Description:  Structured output path for the MDS tools.  Runs "show ... | json" where the NX-OS
+#                release supports it and turns the TABLE_/ROW_ structures into the same records
+#                and dictionaries the regex parsers build, so callers can fall back per switch.
+#
+
+import json
+import re
+
+PARSER_MODES = ('auto', 'json', 'regex')
+
+fc_port_regex = re.compile(r'^fc\d+/\d+$')
+
+
+def add_parser_argument(parser):
+    parser.add_argument('--parser', choices=PARSER_MODES, default='auto',
+                        help="auto tries 'show ... | json' and falls back to the regex parsers per switch (default: auto)")
+
+
+def run_json(pool, switch, cmd):
+    """
+        Run "cmd | json" on switch and return the decoded document, or None when the release does not
+        support JSON for this command (syntax error, empty output or anything that is not a JSON object).
+    """
+    output = pool.run(switch, cmd + ' | json').strip()
+    if not output.startswith('{'):
+        return None
+    try:
+        return json.loads(output)
+    except ValueError:
+        return None
+
+
+def rows(data):
+    # Return every ROW_* entry in the document as a list of dicts (NX-OS collapses one-row tables to a dict)
+    found = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key.startswith('ROW_'):
+                found.extend(value if isinstance(value, list) else [value])
+            else:
+                found.extend(rows(value))
+    elif isinstance(data, list):
+        for value in data:
+            found.extend(rows(value))
+    return found
+
+
+def field(row, *names):
+    # Return the first of names present in row; key names differ slightly between NX-OS releases
+    for name in names:
+        if name in row and row[name] is not None:
+            return str(row[name]).strip()
+    return None
+
+
+def interface_brief_records(data):
+    # 'show interface brief | json' into the records built by mds_parsers.parse_port_brief_records
+    records = []
+    for row in rows(data):
+        interface = field(row, 'interface_fc', 'interface')
+        if not interface or not fc_port_regex.match(interface):
+            continue
+        speed = field(row, 'oper_speed', 'speed')
+        records.append({'interface': interface,
+                        'vsan': field(row, 'vsan_brief', 'vsan'),
+                        'admin_mode': field(row, 'admin_mode'),
+                        'admin_trunk_mode': field(row, 'admin_trunk_mode'),
+                        'status': field(row, 'status', 'state'),
+                        'sfp': field(row, 'fcot_info', 'sfp'),
+                        'oper_mode': field(row, 'oper_mode'),
+                        'oper_speed': int(speed) if speed and speed.isdigit() else None})
+    return records
+
+
+def port_desc_dict(data):
+    # 'show interface description | json' into {port: description}
+    port_dict = {}
+    for row in rows(data):
+        interface = field(row, 'interface')
+        if interface and fc_port_regex.match(interface):
+            port_dict[interface] = field(row, 'description', 'desc') or '--'
+    return port_dict
+
+
+def status_dict(data):
+    # 'show interface | json' into {port: "is <state> (<reason>)"} as printed by the regex parser
+    port_status_dict = {}
+    for row in rows(data):
+        interface = field(row, 'interface')
+        if not interface or not fc_port_regex.match(interface):
+            continue
+        status = 'is ' + (field(row, 'state', 'status') or 'unknown')
+        reason = field(row, 'state_reason', 'state_rsn_desc', 'state_rsn')
+        if reason and reason.lower() not in ('none', 'up'):
+            status += ' (%s)' % reason
+        port_status_dict[interface] = status
+    return port_status_dict
+
+
+def devalias_dict(data):
+    # 'show device-alias database | json' into {pwwn: alias}
+    deval_info = {}
+    for row in rows(data):
+        pwwn = field(row, 'pwwn', 'port_wwn')
+        alias = field(row, 'dev_alias_name', 'device_alias', 'name')
+        if pwwn and alias:
+            deval_info[pwwn] = alias
+    return deval_info
+
+
+def flogi_records(data):
+    # 'show flogi database | json' into the records built by mds_parsers.parse_flogi_records (alias is always None)
+    records = []
+    for row in rows(data):
+        interface = field(row, 'interface')
+        pwwn = field(row, 'port_name', 'pwwn')
+        if not interface or not pwwn:
+            continue
+        records.append({'interface': interface,
+                        'vsan': field(row, 'vsan'),
+                        'fcid': field(row, 'fcid'),
+                        'pwwn': pwwn.lower(),
+                        'nwwn': (field(row, 'node_name', 'nwwn') or '').lower(),
+                        'alias': None})
+    return records
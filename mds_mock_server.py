@@ -0,0 +1,455 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_mock_server.py
+#  Description:  Local stand-in for MDS switches so the tools can be run and timed offline.  Each mock
+#                switch listens on its own local port and answers exec commands and an interactive
+#                NX-OS shell (prompts, config t, vsan database with its y/n confirmation unless
+#                terminal dont-ask was given, line vty, banner motd) with show output generated by mds_fixtures, after a configurable
+#                per-command and per-connection latency.  Any key or password is accepted.
+#
+
+import argparse
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+import paramiko
+
+from mds_cache import normalize_command
+from mds_fixtures import (build_switch, default_settings, sh_banner_motd, sh_device_alias_database, sh_device_alias_status,
+                          sh_flogi_database, sh_int, sh_int_brief, sh_int_counters, sh_int_counters_brief, sh_int_desc,
+                          sh_running_config, sh_user_account)
+
+INVALID_COMMAND = "% Invalid command at '^' marker.\r\n"
+# The exec reply is sent by the transport after check_channel_exec_request returns, so the handler
+# waits this long before closing the channel or the client sees it closed before it was accepted
+EXEC_SETTLE = 0.05
+vsan_interface_regex = re.compile(r'^vsan (\d+) interface (\S+)$')
+
+# Server-side transports log every client disconnect as a socket error; keep that out of the output
+transport_log = logging.getLogger('mds_mock_server.transport')
+transport_log.addHandler(logging.NullHandler())
+transport_log.propagate = False
+
+
+class MockSwitch(object):
+    """
+        State of one simulated switch.  Show output is generated from the port list, so VSAN changes made
+        through the shell show up in later output.  Extra canned output can be added to outputs by command,
+        config lines listed in invalid are answered with "% Invalid command", and every accepted config
+        line is recorded in config.
+    """
+    def __init__(self, name, ports=48, aliases=0, latency=0.0, connect_latency=0.0, seed=1):
+        self.name = name
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.aliases = aliases
+        self.seed = seed
+        self.port_data = build_switch(ports, seed=seed)
+        self.outputs = {}
+        self.invalid = set()
+        self.config = []
+        self.settings = default_settings()
+        self.lock = threading.Lock()
+        # Traffic counters grow with the time since the switch was created
+        self.started = time.time()
+        self.config_time = self.started
+        self.generators = {'show interface': sh_int,
+                           'show interface brief': sh_int_brief,
+                           'show interface description': sh_int_desc,
+                           'show interface counters': lambda ports: sh_int_counters(ports, time.time() - self.started),
+                           'show interface counters brief': lambda ports: sh_int_counters_brief(ports, time.time() - self.started),
+                           'show flogi database': sh_flogi_database,
+                           'show device-alias database': lambda ports: sh_device_alias_database(ports, self.aliases, self.seed),
+                           'show device-alias status': lambda ports: sh_device_alias_status(ports, self.aliases, self.seed),
+                           'show running-config': lambda ports: sh_running_config(ports, self.config_time, self.settings),
+                           'show banner motd': lambda ports: sh_banner_motd(self.settings),
+                           'show user-account': lambda ports: sh_user_account(self.settings)}
+
+    def port(self, interface):
+        for port in self.port_data:
+            if port['interface'] == interface:
+                return port
+        return None
+
+    def vsan_membership(self, interface=None):
+        vsans = {}
+        for port in self.port_data:
+            if interface is None or port['interface'] == interface:
+                vsans.setdefault(port['vsan'], []).append(port['interface'])
+        lines = []
+        for vsan in sorted(vsans):
+            lines.append('vsan %d interfaces:' % vsan)
+            members = vsans[vsan]
+            for index in range(0, len(members), 4):
+                lines.append('    ' + ''.join('%-18s' % member for member in members[index:index + 4]).rstrip())
+            lines.append('')
+        return '\n'.join(lines) + '\n'
+
+    def record_config(self, line):
+        # Called with self.lock held for every accepted config line
+        self.config.append(line)
+        self.config_time = time.time()
+
+    def apply_setting(self, mode, command):
+        # Called with self.lock held: reflect a global config line in settings (and so in show output)
+        words = command.split()
+        users = self.settings['users']
+        if command == 'snmp-server enable traps link':
+            self.settings['link_traps'] = True
+        elif command == 'no snmp-server enable traps link':
+            self.settings['link_traps'] = False
+        elif mode == 'config-line' and len(words) == 2 and words[0] == 'exec-timeout':
+            self.settings['exec_timeout'] = int(words[1])
+        elif mode == 'config-line' and command == 'no exec-timeout':
+            self.settings['exec_timeout'] = 0
+        elif len(words) == 3 and words[:2] == ['no', 'username']:
+            users.pop(words[2], None)
+        elif len(words) >= 6 and words[0] == 'username' and words[2] == 'password' and words[4] == '!' and words[5] == 'role':
+            users.setdefault(words[1], {'role': 'network-operator', 'sshkey': None})['role'] = words[6] if len(words) > 6 else 'network-operator'
+        elif len(words) >= 3 and words[0] == 'username' and words[2] == 'sshkey':
+            users.setdefault(words[1], {'role': 'network-operator', 'sshkey': None})['sshkey'] = command.split(None, 3)[3] if len(words) > 3 else None
+
+    def set_vsan(self, interface, vsan):
+        with self.lock:
+            port = self.port(interface)
+            if port:
+                port['vsan'] = int(vsan)
+            self.record_config('vsan %s interface %s' % (vsan, interface))
+
+    def run(self, cmd):
+        # Output of an exec-mode command, or None when the command is not known
+        norm = normalize_command(cmd)
+        command, sep, pipe = norm.partition(' | ')
+        if sep and pipe.startswith(('include ', 'inc ', 'grep ')) and norm not in self.outputs:
+            # "| include <regex>" filters the output of the command before the pipe
+            output = self.run(command)
+            if output is None:
+                return None
+            pattern = re.compile(pipe.split(None, 1)[1].strip('"'), re.I)
+            return ''.join(line for line in output.splitlines(True) if pattern.search(line))
+        if sep and pipe.startswith(('section ', 'sec ')) and norm not in self.outputs:
+            # "| section <regex>": matching lines with the indented lines below them
+            output = self.run(command)
+            if output is None:
+                return None
+            pattern = re.compile(pipe.split(None, 1)[1].strip('"'), re.I)
+            lines = []
+            in_section = False
+            for line in output.splitlines(True):
+                if not line.startswith(' '):
+                    in_section = bool(pattern.search(line))
+                if in_section:
+                    lines.append(line)
+            return ''.join(lines)
+        if norm in self.outputs:
+            return self.outputs[norm]
+        with self.lock:
+            if norm in self.generators:
+                return self.generators[norm](self.port_data)
+            if norm == 'show vsan membership':
+                return self.vsan_membership()
+            match = re.match(r'^show vsan membership interface (\S+)$', norm)
+            if match:
+                return self.vsan_membership(match.group(1))
+            match = re.match(r'^show interface (fc\S+) brief$', norm)
+            if match:
+                port = self.port(match.group(1))
+                return sh_int_brief([port]) if port else None
+            # Single-port variants used when one port is re-checked after a link trap
+            match = re.match(r'^show interface (fc\S+)( description)?$', norm)
+            if match:
+                port = self.port(match.group(1))
+                if not port:
+                    return None
+                return sh_int_desc([port]) if match.group(2) else sh_int([port])
+            match = re.match(r'^show flogi database interface (fc\S+)$', norm)
+            if match:
+                port = self.port(match.group(1))
+                return sh_flogi_database([port]) if port else None
+        return None
+
+
+class MockShell(object):
+    # Interactive NX-OS shell on one channel
+    def __init__(self, switch, channel):
+        self.switch = switch
+        self.channel = channel
+        self.mode = ''
+        self.confirm = None
+        self.dont_ask = False
+        self.banner_delimiter = None
+        self.banner_lines = []
+
+    def prompt(self):
+        return '%s%s# ' % (self.switch.name, '(%s)' % self.mode if self.mode else '')
+
+    def write(self, text):
+        self.channel.sendall(text.replace('\r\n', '\n').replace('\n', '\r\n').encode('utf-8'))
+
+    def serve(self):
+        try:
+            self.write('\nCisco Nexus Operating System (NX-OS) Software\nMock MDS %s\n\n%s' % (self.switch.name, self.prompt()))
+            buffer = ''
+            while True:
+                data = self.channel.recv(4096)
+                if not data:
+                    break
+                buffer += data.decode('utf-8', 'replace')
+                while '\n' in buffer:
+                    line, buffer = buffer.split('\n', 1)
+                    if not self.handle(line.rstrip('\r')):
+                        return
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            try:
+                self.channel.close()
+            except (EOFError, OSError):
+                # The client already closed the transport
+                pass
+
+    def handle(self, line):
+        # Process one input line; returns False when the session ends
+        self.write(line + '\n')
+        command = line.strip()
+        if self.confirm:
+            interface, vsan = self.confirm
+            self.confirm = None
+            if command.lower().startswith('y'):
+                self.switch.set_vsan(interface, vsan)
+            self.write(self.prompt())
+            return True
+        if self.banner_delimiter:
+            if self.banner_delimiter in line:
+                self.banner_lines.append(line[:line.index(self.banner_delimiter)])
+                self.set_banner(self.banner_lines)
+                self.banner_delimiter = None
+                self.write(self.prompt())
+            else:
+                self.banner_lines.append(line.rstrip('\r'))
+            return True
+        if self.switch.latency:
+            time.sleep(self.switch.latency)
+        output = self.execute(command)
+        if output is False:
+            return False
+        if output is None:
+            return True
+        self.write(output + self.prompt())
+        return True
+
+    def execute(self, command):
+        # Returns text to print before the prompt, None when the command prints its own prompt or
+        # confirmation, or False to close the session
+        norm = normalize_command(command)
+        if norm == 'terminal dont-ask':
+            self.dont_ask = True
+            return ''
+        if not norm or norm.startswith('terminal '):
+            return ''
+        if norm in ('config t', 'configure terminal', 'conf t', 'config'):
+            self.mode = 'config'
+            return 'Enter configuration commands, one per line.  End with CNTL/Z.\n'
+        if norm == 'end':
+            self.mode = ''
+            return ''
+        if norm == 'exit':
+            if not self.mode:
+                return False
+            self.mode = '' if self.mode == 'config' else 'config'
+            return ''
+        if norm.startswith('show '):
+            output = self.switch.run(command)
+            return INVALID_COMMAND if output is None else output
+        if not self.mode or command in self.switch.invalid:
+            return INVALID_COMMAND
+        return self.configure(command)
+
+    def configure(self, command):
+        if self.mode == 'config-vsan-db':
+            match = vsan_interface_regex.match(command)
+            if match and self.dont_ask:
+                self.switch.set_vsan(match.group(2), match.group(1))
+                return ''
+            if match:
+                self.confirm = (match.group(2), match.group(1))
+                self.write('Traffic on %s may be impacted. Do you want to continue? (y/n) [n] ' % match.group(2))
+                return None
+        with self.switch.lock:
+            self.switch.record_config(command)
+            self.switch.apply_setting(self.mode, command)
+        if command == 'vsan database':
+            self.mode = 'config-vsan-db'
+        elif command == 'line vty':
+            self.mode = 'config-line'
+        elif command.startswith('interface '):
+            self.mode = 'config-if'
+        elif command.startswith('banner motd '):
+            text = command[len('banner motd '):]
+            if text and text.count(text[0]) < 2:
+                self.banner_delimiter = text[0]
+                self.banner_lines = [text[1:]]
+                return None
+            if text:
+                self.set_banner([text[1:text.index(text[0], 1)]])
+        return ''
+
+    def set_banner(self, lines):
+        with self.switch.lock:
+            self.switch.settings['banner'] = '\n'.join(lines).rstrip('\n') + '\n'
+
+
+class MockServerInterface(paramiko.ServerInterface):
+    def __init__(self, switch):
+        self.switch = switch
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=MockShell(self.switch, channel).serve, daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.exec_command, args=(channel, command.decode('utf-8')), daemon=True).start()
+        return True
+
+    def exec_command(self, channel, command):
+        try:
+            if self.switch.latency:
+                time.sleep(self.switch.latency)
+            output = self.switch.run(command)
+            if output is None:
+                output = INVALID_COMMAND
+            channel.sendall(output.encode('utf-8'))
+            time.sleep(EXEC_SETTLE)
+            channel.send_exit_status(0)
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            channel.close()
+
+
+class MockMDSServer(object):
+    """
+        Serves a list of MockSwitch on local ports (base_port, base_port + 1, ... or any free port when
+        base_port is 0).  After start(), addresses maps each switch name to the "host:port" the tools connect to.
+    """
+    def __init__(self, switches, host='127.0.0.1', base_port=0, host_key=None):
+        self.switches = switches
+        self.host = host
+        self.base_port = base_port
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.addresses = {}
+        self.sockets = []
+        self.transports = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for index, switch in enumerate(self.switches):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, self.base_port + index if self.base_port else 0))
+            sock.listen(100)
+            self.sockets.append(sock)
+            self.addresses[switch.name] = '%s:%d' % (self.host, sock.getsockname()[1])
+            threading.Thread(target=self.accept, args=(sock, switch), daemon=True).start()
+        return self
+
+    def accept(self, sock, switch):
+        while self.running:
+            try:
+                conn, address = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_connection, args=(conn, switch), daemon=True).start()
+
+    def serve_connection(self, conn, switch):
+        if switch.connect_latency:
+            time.sleep(switch.connect_latency)
+        transport = paramiko.Transport(conn)
+        transport.set_log_channel(transport_log.name)
+        transport.add_server_key(self.host_key)
+        self.transports.append(transport)
+        try:
+            transport.start_server(server=MockServerInterface(switch))
+        except (EOFError, OSError, paramiko.SSHException):
+            transport.close()
+
+    def stop(self):
+        self.running = False
+        for sock in self.sockets:
+            # shutdown wakes the accept thread; close alone leaves the port listening until it returns
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        for transport in self.transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def mock_fleet(count, ports=48, aliases=0, latency=0.0, connect_latency=0.0):
+    # count switches named mds01, mds02, ... each with its own seeded port layout
+    return [MockSwitch('mds%02d' % (index + 1), ports, aliases, latency, connect_latency, seed=index + 1) for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--switches', type=int, default=4, help='number of mock switches (default: 4)')
+    parser.add_argument('--base-port', type=int, default=2201, help='port of the first switch; the others follow (default: 2201)')
+    parser.add_argument('--ports', type=int, default=48, help='fc ports per switch (default: 48)')
+    parser.add_argument('--aliases', type=int, default=0, help='entries in each device-alias database')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each command is answered')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='seconds added to each SSH handshake')
+    parser.add_argument('--switch-list', help='write the host:port of every mock switch to this switchlistfile')
+    parser.add_argument('--host-key', help='RSA host key file, created if missing; keeps the key pinned by mds_inventory valid across restarts')
+    args = parser.parse_args()
+
+    host_key = None
+    if args.host_key:
+        if not os.path.isfile(args.host_key):
+            paramiko.RSAKey.generate(2048).write_private_key_file(args.host_key)
+        host_key = paramiko.RSAKey(filename=args.host_key)
+    server = MockMDSServer(mock_fleet(args.switches, args.ports, args.aliases, args.latency, args.connect_latency),
+                           base_port=args.base_port, host_key=host_key).start()
+    for name, address in sorted(server.addresses.items()):
+        print('%s  %s' % (name, address))
+    if args.switch_list:
+        with open(args.switch_list, 'w') as f:
+            f.write('\n'.join(address for name, address in sorted(server.addresses.items())) + '\n')
+        print('Wrote %s' % args.switch_list)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_parsers.py
+#  Description:  Parsers for show output needed by more than one of the MDS tools
+#                (sh int brief records, show vsan membership, device-alias database, flogi records,
+#                user accounts)
+#
+
+import re
+
+
+def parse_port_brief_records(port_brief_output):
+    """
+        Parse 'sh int brief' lines into one record per fc port with its vsan, admin mode, status, oper mode and speed.
+        Columns: Interface Vsan Admin-Mode Admin-Trunk-Mode Status SFP Oper-Mode Oper-Speed Port-Channel [Logical-Type]
+    """
+    port_fc_regex = re.compile(r'^fc\d+/\d+', re.I)
+    records = []
+    for line in port_brief_output:
+        if not port_fc_regex.match(line):
+            continue
+        fields = line.split()
+        if len(fields) < 7:
+            continue
+        rest = fields[5:]
+        speed = rest[2] if len(rest) > 2 and rest[2].isdigit() else None
+        records.append({'interface': fields[0],
+                        'vsan': fields[1],
+                        'admin_mode': fields[2],
+                        'admin_trunk_mode': fields[3],
+                        'status': fields[4],
+                        'sfp': rest[0],
+                        'oper_mode': rest[1],
+                        'oper_speed': int(speed) if speed else None})
+    return records
+
+
+def parse_vsan_membership(output):
+    # Parse "show vsan membership" output into {port: vsan}
+    vsan_regex = re.compile(r'^vsan (\d+)')
+    port_regex = re.compile(r'\b((?:fc|vfc|port-channel|san-port-channel)\s?\d+(?:/\d+)*)')
+    membership = {}
+    vsan = None
+    for line in output.splitlines():
+        vsan_match = vsan_regex.match(line)
+        if vsan_match:
+            vsan = vsan_match.group(1)
+            continue
+        if vsan is not None:
+            for port in port_regex.findall(line):
+                membership[port.replace(" ", "")] = vsan
+    return membership
+
+
+def parse_devalias(output):
+    # Parse list of device aliases defined on switch
+    deval_info = {}
+    deval_regex = re.compile('^device-alias name (.*) pwwn (.*)$',re.M)
+    deval_data = output.split('\n')
+    for line in deval_data:
+        deval_match = deval_regex.search(line.rstrip('\r'))
+        if deval_match:
+            deval_info[(deval_match.group(2))] = deval_match.group(1).strip()
+
+    return deval_info
+
+
+def parse_flogi_records(output):
+    """
+        Parse 'sh flogi database' into one record per login: interface, vsan, fcid, pwwn, nwwn and the
+        [device-alias] printed below it (None when the pwwn has no alias).  Trunk and NPV ports have one
+        record per login on the same interface.
+    """
+    login_regex = re.compile(r'^((?:fc|vfc|port-channel|san-port-channel)\s?\d+(?:/\d+)*)\s+(\d+)\s+(0x[0-9a-f]+)\s+([0-9a-f:]{23})\s+([0-9a-f:]{23})', re.I)
+    records = []
+    for line in output.splitlines():
+        stripped = line.strip()
+        login_match = login_regex.match(stripped)
+        if login_match:
+            records.append({'interface': login_match.group(1).replace(' ', ''),
+                            'vsan': login_match.group(2),
+                            'fcid': login_match.group(3),
+                            'pwwn': login_match.group(4).lower(),
+                            'nwwn': login_match.group(5).lower(),
+                            'alias': None})
+        elif stripped.startswith('[') and records and records[-1]['alias'] is None:
+            records[-1]['alias'] = stripped[1:stripped.rfind(']')]
+        elif stripped.startswith('Total'):
+            break
+    return records
+
+
+def parse_user_accounts(output):
+    # Parse 'show user-account' into {username: [role, ...]}
+    users = {}
+    username = None
+    for line in output.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('user:'):
+            username = stripped[len('user:'):].strip()
+            users[username] = []
+        elif stripped.startswith('roles:') and username is not None:
+            users[username] = stripped[len('roles:'):].split()
+    return users
+
+
+def parse_username_config(output):
+    """
+        Parse the 'username' lines of the running-config ('show run | include username') into
+        {username: {'role': role or None, 'sshkey': key or None}}.
+    """
+    users = {}
+    for line in output.splitlines():
+        words = line.split()
+        if len(words) < 2 or words[0] != 'username':
+            continue
+        user = users.setdefault(words[1], {'role': None, 'sshkey': None})
+        if len(words) > 3 and words[2] == 'sshkey':
+            user['sshkey'] = line.strip().split(None, 3)[3]
+        elif 'role' in words[2:-1]:
+            user['role'] = words[words.index('role', 2) + 1]
+    return users
@@ -0,0 +1,541 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_session.py
+#  Description:  Shared SSH helpers for the MDS tools.  ShellSession drives an interactive
+#                invoke_shell channel by reading until the NX-OS prompt (or a y/n confirmation)
+#                comes back instead of pacing commands with fixed sleeps and recv(1000).
+#                SessionPool keeps one SSH transport per switch for non-interactive commands.
+#                Both go through mds_sessiond's warm transports when the daemon is running.
+#
+
+import codecs
+import json
+import os
+import re
+import socket
+import threading
+import time
+import zlib
+
+import paramiko
+
+from mds_timing import measure
+
+DEFAULT_COMMAND_TIMEOUT = 30
+
+# Matches the last line of output when the switch is waiting for input:
+#   mds1#   mds1(config)#   mds1(config-vsan-db)#   ... Do you want to continue? (y/n) [n]
+PROMPT_REGEX = re.compile(r'^[\w.\-]+(\([\w\-]+\))?#\s*$')
+CONFIRM_REGEX = re.compile(r'\(y/n\)\s*(\[[yn]\])?\s*\??\s*$', re.I)
+# Terminal escape sequences and other control characters the switch may mix into the echo of a long line
+ESCAPE_REGEX = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]|\x1b[()][A-Za-z0-9]|\x1b.|[\x00-\x07\x0b-\x1f\x7f]')
+# Widest terminal NX-OS supports, so long config lines (ssh keys, banners) are echoed without wrapping
+SHELL_WIDTH = 511
+
+
+# Unix socket of mds_sessiond.  While the daemon runs, commands use its already authenticated
+# transports; otherwise the tools connect to the switch themselves.  None never uses the daemon.
+DEFAULT_SESSIOND_SOCKET = os.environ.get('MDS_SESSIOND_SOCKET', os.path.expanduser('~/.cache/mds_tools/sessiond.sock'))
+sessiond_socket = DEFAULT_SESSIOND_SOCKET
+
+
+class PromptTimeout(Exception):
+    """Raised when the switch does not return a prompt within the command timeout"""
+    def __init__(self, command, output):
+        Exception.__init__(self, 'no prompt after %r, last output: %r' % (command, output[-200:]))
+        self.command = command
+        self.output = output
+
+
+class SessiondError(Exception):
+    """Error reported by mds_sessiond that is not an SSH, connection or prompt failure"""
+
+
+class SessiondHostKeyError(paramiko.BadHostKeyException):
+    """Pinned host key mismatch seen by mds_sessiond; only the daemon's message comes back, not the keys"""
+    def __init__(self, message):
+        paramiko.SSHException.__init__(self, message)
+        self.hostname = None
+        self.key = None
+        self.expected_key = None
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+# Extra paramiko connect() arguments for every connection, e.g. key_filename/username when
+# running against the mock switches in mds_mock_server
+connect_options = {}
+
+# mds_inventory.Inventory used by open_client for cached addresses and pinned host keys (set by
+# mds_inventory.load_inventory); None connects by name and accepts any host key
+inventory = None
+
+
+def split_host_port(switch, default_port=22):
+    # "mds1" -> ("mds1", 22), "127.0.0.1:2201" -> ("127.0.0.1", 2201)
+    host, sep, port = switch.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return switch, default_port
+
+
+def open_client(switch, timeout=5):
+    """
+        Return a connected paramiko SSHClient for switch (switch may be given as host:port).
+        With an inventory loaded the cached address is used and the host key must match the pinned one
+        (paramiko.BadHostKeyException otherwise); the key is pinned on the first connect.  A cached address
+        that cannot be reached is resolved again once.
+    """
+    host, port = split_host_port(switch)
+    if inventory is None:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(host, port=port, timeout=timeout, **connect_options)
+        return client
+    address = inventory.address(switch)
+    try:
+        return connect_pinned(switch, address, port, timeout)
+    except socket.error:
+        fresh = inventory.address(switch, refresh=True)
+        if fresh == address:
+            raise
+        return connect_pinned(switch, fresh, port, timeout)
+
+
+def connect_pinned(switch, address, port, timeout):
+    client = paramiko.SSHClient()
+    key = inventory.host_key(switch)
+    if key is None:
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    else:
+        # Only the pinned key type is offered during key exchange, and any other key is rejected
+        client.get_host_keys().add(address if port == 22 else '[%s]:%d' % (address, port), key.get_name(), key)
+        client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    client.connect(address, port=port, timeout=timeout, **connect_options)
+    if key is None:
+        inventory.pin_host_key(switch, client.get_transport().get_remote_server_key())
+    return client
+
+
+def prompt_line_regex(hostname):
+    # A prompt of hostname at the start of a line, followed by the echo of the next command when pipelined
+    return re.compile(r'(?m)^%s(?:\([\w\-]+\))?# ?' % re.escape(hostname))
+
+
+def split_block(commands, output, hostname):
+    """
+        Split the output of a pipelined block at the prompts into one (command, output, error) per command.
+        error is the "% ..." line the switch printed for the command (Invalid command, Incomplete command, ...),
+        a note when no prompt came back after it, or None.  How the command was echoed is not checked here,
+        see echo_matches.
+    """
+    pieces = prompt_line_regex(hostname).split(output.replace('\r', ''))
+    replies = []
+    for index, command in enumerate(commands):
+        if index >= len(pieces) - 1:
+            # No prompt came back after this command (a confirmation prompt or the session ended)
+            replies.append((command, pieces[index] if index < len(pieces) else '', 'no prompt after command'))
+            continue
+        piece = pieces[index]
+        lines = piece.split('\n')
+        error = None
+        for line in lines[1:]:
+            if line.strip().startswith('%'):
+                error = line.strip()
+                break
+        replies.append((command, piece, error))
+    return replies
+
+
+def clean_echo(line):
+    # The echoed line as it reads on screen: backspaces erase the character before them, other control
+    # characters and escape sequences are dropped
+    text = ''
+    for part in re.split(r'(\x08)', line):
+        if part == '\x08':
+            text = text[:-1]
+        else:
+            text += ESCAPE_REGEX.sub('', part)
+    return text.strip()
+
+
+def echo_matches(command, output):
+    # True when the first line of the output of command (a split_block piece) is its echo
+    return clean_echo(output.split('\n')[0]) == command.split('\n')[0].strip()
+
+
+def apply_config(session, result, commands, optional=(), timeout=None):
+    """
+        Send commands to session as one pipelined block for a fleet task: result.output gets the switch output,
+        each failed command is logged, and result.ok is set when every command not listed in optional (cleanup
+        lines that may legitimately fail) was accepted.  An echo that does not match its command (a long line
+        scrolled by the terminal) is only logged as a warning; the "% ..." error lines decide.  Returns the (command, output, error) replies so show
+        commands at the end of the block can be read back.
+    """
+    replies = session.send_block(commands, timeout)
+    result.output = ''.join(output for command, output, error in replies)
+    result.ok = True
+    for command, output, error in replies:
+        if error:
+            result.log('\t*** %s: %s ***' % (command.split('\n')[0], error))
+            if command not in optional:
+                result.ok = False
+        elif not echo_matches(command, output):
+            result.log('\t*** Warning: %s: echoed as %r ***' % (command.split('\n')[0], clean_echo(output.split('\n')[0])))
+    return replies
+
+
+class ShellSession(object):
+    """
+        Interactive NX-OS shell over a paramiko channel.  Every command returns as soon as the
+        prompt is seen, and output is drained completely rather than cut off at a fixed size.
+    """
+    def __init__(self, channel, timeout=DEFAULT_COMMAND_TIMEOUT, client=None):
+        self.channel = channel
+        self.timeout = timeout
+        self.client = client
+        self.prompt = ''
+        self.hostname = ''
+        self.confirm = False
+
+    def read_until_prompt(self, timeout=None, command='', prompts=1):
+        # Drain the channel until the last line is a CLI prompt (the prompts-th one after a pipelined block)
+        # or a y/n confirmation
+        deadline = time.time() + (timeout or self.timeout)
+        chunks = []
+        tail = ''
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise PromptTimeout(command, ''.join(chunks))
+            self.channel.settimeout(remaining)
+            try:
+                data = self.channel.recv(65535)
+            except socket.timeout:
+                raise PromptTimeout(command, ''.join(chunks))
+            if not data:
+                raise EOFError('channel closed by switch after %r' % command)
+            chunk = data.decode('utf-8', 'replace')
+            chunks.append(chunk)
+            tail = (tail + chunk)[-512:]
+            last_line = tail[tail.rfind('\n') + 1:].replace('\r', '')
+            if PROMPT_REGEX.match(last_line) and last_line.startswith(self.hostname):
+                if prompts > 1 and len(prompt_line_regex(self.hostname).findall(''.join(chunks).replace('\r', ''))) < prompts:
+                    continue
+                self.prompt = last_line.strip()
+                self.confirm = False
+                break
+            if CONFIRM_REGEX.search(last_line):
+                self.confirm = True
+                break
+        return ''.join(chunks)
+
+    def send_command(self, command, timeout=None):
+        # Send one line and return everything the switch printed up to the next prompt
+        self.channel.send(command + '\n')
+        return self.read_until_prompt(timeout, command)
+
+    def send_block(self, commands, timeout=None):
+        """
+            Pipelined config: write every command at once and read until one prompt per command has come back,
+            so the whole block costs one round trip.  Returns one (command, output, error) per command, see
+            split_block.  Commands that ask for a y/n confirmation must not be sent this way, as the next
+            command would be read as the answer.
+        """
+        self.channel.send(''.join(command + '\n' for command in commands))
+        output = self.read_until_prompt(timeout, commands[-1], prompts=len(commands))
+        return split_block(commands, output, self.hostname)
+
+    def start(self):
+        # Wait for the login prompt and turn off paging
+        output = self.read_until_prompt(command='<login>')
+        # Later prompts must start with the switch name so echoed text ending in '#' is not taken for one
+        self.hostname = re.split(r'[(#]', self.prompt)[0]
+        output += self.send_command('terminal length 0')
+        return output
+
+    def in_config_mode(self):
+        return '(config' in self.prompt
+
+    def enter_config_mode(self, log=None):
+        # Enter config mode if the session is not already there; returns True on success
+        if not self.in_config_mode():
+            if log:
+                log('\t*** Switching to Config Mode ***')
+            self.send_command('config t')
+        if self.in_config_mode() and log:
+            log('\t*** Successfully entered Config Mode ***')
+        return self.in_config_mode()
+
+    def close(self):
+        # Close the channel, and the client when the session owns it (see open_shell)
+        self.channel.close()
+        if self.client:
+            self.client.close()
+
+
+class SessiondShellSession(ShellSession):
+    """
+        ShellSession on a channel held by mds_sessiond; each command is relayed over the daemon socket
+        and the daemon closes the channel when this connection is closed.
+    """
+    def __init__(self, connection, switch, timeout=DEFAULT_COMMAND_TIMEOUT):
+        ShellSession.__init__(self, None, timeout)
+        self.connection = connection
+        self.switch = switch
+
+    def start(self):
+        reply = self.connection.request(op='shell', switch=self.switch, timeout=self.timeout)
+        self.prompt = reply['prompt']
+        self.hostname = reply['hostname']
+        return reply['output']
+
+    def send_command(self, command, timeout=None):
+        reply = self.connection.request(op='send', command=command, timeout=timeout or self.timeout)
+        self.prompt = reply['prompt']
+        self.confirm = reply['confirm']
+        return reply['output']
+
+    def send_block(self, commands, timeout=None):
+        reply = self.connection.request(op='block', commands=commands, timeout=timeout or self.timeout)
+        self.prompt = reply['prompt']
+        self.confirm = reply['confirm']
+        return [tuple(entry) for entry in reply['replies']]
+
+    def close(self):
+        self.connection.close()
+
+
+class SessiondConnection(object):
+    # One connection to mds_sessiond: JSON request lines out, one JSON reply line back per request
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    def request(self, **fields):
+        self.sock.sendall((json.dumps(fields) + '\n').encode('utf-8'))
+        line = self.reader.readline()
+        if not line:
+            raise EOFError('mds_sessiond closed the connection')
+        reply = json.loads(line.decode('utf-8'))
+        if not reply.get('ok'):
+            raise_sessiond_error(reply)
+        return reply
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def raise_sessiond_error(reply):
+    # Raise the exception the direct SSH path would have raised, so callers handle both alike
+    kind = reply.get('kind')
+    message = reply.get('error', 'unknown error')
+    if kind == 'hostkey':
+        raise SessiondHostKeyError(message)
+    if kind == 'auth':
+        raise paramiko.AuthenticationException(message)
+    if kind == 'ssh':
+        raise paramiko.SSHException(message)
+    if kind == 'unreachable':
+        raise socket.error(message)
+    if kind == 'eof':
+        raise EOFError(message)
+    if kind == 'timeout':
+        raise PromptTimeout(reply.get('command', ''), reply.get('output', ''))
+    raise SessiondError(message)
+
+
+def sessiond_connect():
+    # Return a SessiondConnection, or None when the daemon is not running
+    if not sessiond_socket or not os.path.exists(sessiond_socket):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sessiond_socket)
+    except OSError:
+        sock.close()
+        return None
+    return SessiondConnection(sock)
+
+
+def open_shell(switch, timeout=5):
+    """
+        Return a started ShellSession on switch: through mds_sessiond when it is running, so no new
+        handshake or login is needed, or over a new SSH connection otherwise.  Close it with close().
+    """
+    connection = sessiond_connect()
+    if connection is not None:
+        session = SessiondShellSession(connection, switch)
+    else:
+        client = open_client(switch, timeout)
+        session = ShellSession(client.invoke_shell(width=SHELL_WIDTH), client=client)
+    try:
+        session.start()
+    except Exception:
+        session.close()
+        raise
+    return session
+
+
+class SessionPool(object):
+    """
+        One authenticated SSH transport per switch, shared by every command run against that
+        switch.  Each command gets its own exec_command channel on the existing transport.
+        Use as a context manager (or call close()) so every transport is closed at the end of a run.
+        With a ShowCache, every output is stored and outputs younger than max_age are served from it
+        without connecting to the switch.  With a Timings, connect time and the latency and size of
+        every command are recorded per switch.  Commands go through mds_sessiond while it is running
+        (use_sessiond=False always connects directly, as the daemon itself does); keepalive sets the
+        SSH keepalive interval in seconds of every transport.
+    """
+    def __init__(self, timeout=8, command_timeout=DEFAULT_COMMAND_TIMEOUT, cache=None, max_age=0, timings=None,
+                 use_sessiond=True, keepalive=0):
+        self.timeout = timeout
+        self.command_timeout = command_timeout
+        self.cache = cache
+        self.max_age = max_age
+        self.timings = timings
+        self.use_sessiond = use_sessiond
+        self.keepalive = keepalive
+        self.clients = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def client(self, switch):
+        # Return the open client for switch, connecting (or reconnecting) on first use
+        with self.lock:
+            switch_lock = self.locks.setdefault(switch, threading.Lock())
+        with switch_lock:
+            client = self.clients.get(switch)
+            transport = client.get_transport() if client else None
+            if transport is None or not transport.is_active():
+                if client:
+                    client.close()
+                with measure(self.timings, switch, 'connect'):
+                    client = open_client(switch, self.timeout)
+                if self.keepalive:
+                    client.get_transport().set_keepalive(self.keepalive)
+                self.clients[switch] = client
+            return client
+
+    def cached(self, switch, cmd):
+        # Return fresh cached output for cmd, or None when the switch has to be asked
+        if self.cache is None:
+            return None
+        return self.cache.get(switch, cmd, self.max_age)
+
+    def has_cached(self, switch, cmd):
+        return self.cache is not None and self.cache.is_fresh(switch, cmd, self.max_age)
+
+    def sessiond_run(self, switch, cmd):
+        # Output of cmd through mds_sessiond, or None when the daemon is not running
+        if not self.use_sessiond:
+            return None
+        connection = sessiond_connect()
+        if connection is None:
+            # Not running; do not look for it again for the rest of this run
+            self.use_sessiond = False
+            return None
+        try:
+            with measure(self.timings, switch, 'command', cmd) as sample:
+                output = connection.request(op='exec', switch=switch, command=cmd, timeout=self.command_timeout)['output']
+                sample['bytes'] = len(output.encode('utf-8'))
+        finally:
+            connection.close()
+        if self.cache is not None:
+            self.cache.put(switch, cmd, output)
+        return output
+
+    def run(self, switch, cmd, use_cache=True):
+        # Run cmd on its own channel of the switch transport and return the output as text.  With use_cache=False
+        # the switch is always asked, e.g. for change detection; the fresh output still refreshes the cache.
+        output = self.cached(switch, cmd) if use_cache else None
+        if output is not None:
+            if self.timings is not None:
+                self.timings.record(switch, 'command', cmd, 0.0, len(output), cached=True)
+            return output
+        output = self.sessiond_run(switch, cmd)
+        if output is not None:
+            return output
+        client = self.client(switch)
+        with measure(self.timings, switch, 'command', cmd) as sample:
+            stdin, stdout, stderr = client.exec_command(cmd, timeout=self.command_timeout)
+            try:
+                data = stdout.read()
+            finally:
+                stdout.channel.close()
+            sample['bytes'] = len(data)
+        output = data.decode('utf-8', 'replace')
+        if self.cache is not None:
+            self.cache.put(switch, cmd, output)
+        return output
+
+    def iter_lines(self, switch, cmd, chunk_size=32768):
+        """
+            Run cmd and yield decoded output lines as chunks arrive from the channel, so large
+            outputs are parsed while they transfer and never held in memory as a whole.
+        """
+        output = self.cached(switch, cmd)
+        if output is not None:
+            if self.timings is not None:
+                self.timings.record(switch, 'command', cmd, 0.0, len(output), cached=True)
+            for line in output.splitlines():
+                yield line
+            return
+        # The daemon returns the whole output at once; only direct connections stream
+        output = self.sessiond_run(switch, cmd)
+        if output is not None:
+            for line in output.splitlines():
+                yield line
+            return
+        client = self.client(switch)
+        with measure(self.timings, switch, 'command', cmd) as sample:
+            stdin, stdout, stderr = client.exec_command(cmd, timeout=self.command_timeout)
+            channel = stdout.channel
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            # Compress into the cache as the output streams so it is never held uncompressed
+            compressor = zlib.compressobj() if self.cache is not None else None
+            compressed = []
+            partial = ''
+            try:
+                while True:
+                    data = channel.recv(chunk_size)
+                    sample['bytes'] += len(data)
+                    if compressor and data:
+                        compressed.append(compressor.compress(data))
+                    text = partial + decoder.decode(data, final=not data)
+                    lines = text.split('\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        yield line.rstrip('\r')
+                    if not data:
+                        break
+                if partial:
+                    yield partial.rstrip('\r')
+                if compressor:
+                    compressed.append(compressor.flush())
+                    self.cache.put_compressed(switch, cmd, b''.join(compressed))
+            finally:
+                channel.close()
+
+    def close_switch(self, switch):
+        # Close the transport of a switch once no more commands will be run against it
+        with self.lock:
+            client = self.clients.pop(switch, None)
+        if client:
+            client.close()
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
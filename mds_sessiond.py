@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_sessiond.py
+#  Description:  Long-running local daemon that keeps an authenticated SSH transport open to every
+#                switch of the inventory (with keepalives, reconnecting dropped ones) and runs commands
+#                for the other tools over a Unix socket, so a cron run no longer pays the handshake and
+#                login to every switch.  The tools use it automatically while it is running (see
+#                SessionPool and open_shell in mds_session) and connect directly otherwise.
+#
+#                Protocol: one JSON object per line each way on the socket.
+#                  {"op": "ping"}                                     -> {"ok": true, "switches": [...]}
+#                  {"op": "exec", "switch": s, "command": c}          -> {"ok": true, "output": "..."}
+#                  {"op": "shell", "switch": s}                       -> {"ok": true, "output", "prompt", "hostname"}
+#                  {"op": "send", "command": c}  (after "shell")      -> {"ok": true, "output", "prompt", "confirm"}
+#                  {"op": "block", "commands": [c, ...]}  (after "shell") -> {"ok": true, "replies": [[c, output, error], ...], "prompt", "confirm"}
+#                Errors reply {"ok": false, "kind": auth|ssh|unreachable|eof|timeout|hostkey|error, "error": "..."}.
+#                A shell channel is closed when the client closes its connection.
+#
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+import paramiko
+
+from mds_fleet import DEFAULT_WORKERS, run_fleet
+from mds_inventory import add_inventory_argument, load_inventory
+from mds_session import DEFAULT_COMMAND_TIMEOUT, DEFAULT_SESSIOND_SOCKET, SHELL_WIDTH, PromptTimeout, SessionPool, ShellSession
+
+DEFAULT_KEEPALIVE = 30
+
+
+def error_reply(e):
+    # Classify an exception for the client, which raises the matching exception again
+    if isinstance(e, paramiko.BadHostKeyException):
+        kind = 'hostkey'
+    elif isinstance(e, paramiko.AuthenticationException):
+        kind = 'auth'
+    elif isinstance(e, paramiko.SSHException):
+        kind = 'ssh'
+    elif isinstance(e, PromptTimeout):
+        return {'ok': False, 'kind': 'timeout', 'error': str(e), 'command': e.command, 'output': e.output}
+    elif isinstance(e, socket.error):
+        kind = 'unreachable'
+    elif isinstance(e, EOFError):
+        kind = 'eof'
+    else:
+        kind = 'error'
+    return {'ok': False, 'kind': kind, 'error': str(e) or e.__class__.__name__}
+
+
+class SessiondHandler(socketserver.StreamRequestHandler):
+    # One client connection; a connection that opened a shell keeps it until it is closed
+
+    def handle(self):
+        self.shell = None
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    reply = self.dispatch(request)
+                except ValueError as e:
+                    reply = {'ok': False, 'kind': 'error', 'error': 'bad request: %s' % e}
+                except Exception as e:
+                    reply = error_reply(e)
+                self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            if self.shell:
+                self.shell.channel.close()
+
+    def dispatch(self, request):
+        daemon = self.server.sessiond
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True, 'switches': sorted(daemon.pool.clients)}
+        if op == 'exec':
+            return {'ok': True, 'output': daemon.run(request['switch'], request['command'])}
+        if op == 'shell':
+            if self.shell:
+                self.shell.channel.close()
+            self.shell, output = daemon.open_shell(request['switch'], request.get('timeout') or DEFAULT_COMMAND_TIMEOUT)
+            return {'ok': True, 'output': output, 'prompt': self.shell.prompt, 'hostname': self.shell.hostname}
+        if op == 'send':
+            if not self.shell:
+                return {'ok': False, 'kind': 'error', 'error': 'send before shell'}
+            output = self.shell.send_command(request['command'], request.get('timeout'))
+            return {'ok': True, 'output': output, 'prompt': self.shell.prompt, 'confirm': self.shell.confirm}
+        if op == 'block':
+            if not self.shell:
+                return {'ok': False, 'kind': 'error', 'error': 'block before shell'}
+            replies = self.shell.send_block(request['commands'], request.get('timeout'))
+            return {'ok': True, 'replies': replies, 'prompt': self.shell.prompt, 'confirm': self.shell.confirm}
+        return {'ok': False, 'kind': 'error', 'error': 'unknown op %r' % op}
+
+
+class SessiondServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SessionDaemon(object):
+    """
+        The warm transports (a SessionPool that never uses the daemon itself) and the Unix socket server.
+        start() warms up the inventory switches and serves in background threads; stop() closes everything.
+    """
+    def __init__(self, socket_path=DEFAULT_SESSIOND_SOCKET, switches=(), keepalive=DEFAULT_KEEPALIVE,
+                 timeout=8, command_timeout=DEFAULT_COMMAND_TIMEOUT, workers=DEFAULT_WORKERS):
+        self.socket_path = socket_path
+        self.switches = list(switches)
+        self.keepalive = keepalive
+        self.workers = workers
+        self.pool = SessionPool(timeout=timeout, command_timeout=command_timeout, use_sessiond=False, keepalive=keepalive)
+        self.server = None
+        self.stopped = threading.Event()
+
+    def run(self, switch, cmd):
+        # exec cmd on the warm transport; a transport that died since the last check is reconnected once
+        try:
+            return self.pool.run(switch, cmd)
+        except (EOFError, paramiko.SSHException) as e:
+            if isinstance(e, (paramiko.AuthenticationException, paramiko.BadHostKeyException)):
+                raise
+            logging.info('%s: %s, reconnecting' % (switch, e))
+            self.pool.close_switch(switch)
+            return self.pool.run(switch, cmd)
+
+    def open_shell(self, switch, timeout):
+        # Started ShellSession (login prompt read, paging off) on the warm transport, and its output so far
+        try:
+            channel = self.pool.client(switch).invoke_shell(width=SHELL_WIDTH)
+        except (EOFError, paramiko.SSHException) as e:
+            if isinstance(e, (paramiko.AuthenticationException, paramiko.BadHostKeyException)):
+                raise
+            logging.info('%s: %s, reconnecting' % (switch, e))
+            self.pool.close_switch(switch)
+            channel = self.pool.client(switch).invoke_shell(width=SHELL_WIDTH)
+        shell = ShellSession(channel, timeout)
+        try:
+            output = shell.start()
+        except Exception:
+            channel.close()
+            raise
+        return shell, output
+
+    def connect(self, result):
+        # Fleet task: open (or check) the transport of one switch
+        self.pool.client(result.switch)
+        result.ok = True
+
+    def warm(self):
+        # Connect every known switch in parallel (only dropped transports are reopened); log failures and keep going
+        for result in run_fleet(self.switches, self.connect, workers=self.workers):
+            if not result.ok:
+                logging.warning('%s: not connected: %s' % (result.switch, ' '.join(message.strip() for message in result.messages)))
+
+    def watch(self):
+        # Reconnect transports that dropped (switch reload, supervisor switchover) every keepalive interval
+        while not self.stopped.wait(self.keepalive or DEFAULT_KEEPALIVE):
+            if self.switches:
+                self.warm()
+
+    def start(self):
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            # A socket left behind by a daemon that did not shut down cleanly
+            os.remove(self.socket_path)
+        self.server = SessiondServer(self.socket_path, SessiondHandler)
+        self.server.sessiond = self
+        # Only the user running the daemon may submit commands through it
+        os.chmod(self.socket_path, 0o600)
+        if self.switches:
+            self.warm()
+            logging.info('%d of %d switches connected' % (len(self.pool.clients), len(self.switches)))
+        threading.Thread(target=self.watch, daemon=True).start()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info('listening on %s' % self.socket_path)
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        self.pool.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_inventory_argument(parser)
+    parser.add_argument('--socket', default=DEFAULT_SESSIOND_SOCKET,
+                        help='Unix socket to serve on (default: $MDS_SESSIOND_SOCKET or %s)' % DEFAULT_SESSIOND_SOCKET)
+    parser.add_argument('--keepalive', type=int, default=DEFAULT_KEEPALIVE,
+                        help='seconds between SSH keepalives and reconnect checks (default: %d)' % DEFAULT_KEEPALIVE)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='switches connected at the same time while warming up (default: %d)' % DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s mds_sessiond %(levelname)s: %(message)s')
+    inventory = load_inventory(args.inventory, args.inventory_state)
+    daemon = SessionDaemon(args.socket, inventory.names(), args.keepalive, workers=args.workers).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stopped.set())
+    try:
+        daemon.stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
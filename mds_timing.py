@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_timing.py
+#  Description:  Per-switch, per-command timing for the collection tools.  Records SSH connect time,
+#                command latency and bytes received, parse time and database write time, and writes
+#                them at the end of a run as a Prometheus textfile (for the node_exporter textfile
+#                collector) and as a JSON summary.
+#
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_METRICS_DIR = os.environ.get('MDS_METRICS_DIR')
+
+# stage -> (help text) of the exported <prefix>_<stage>_seconds metrics
+STAGES = {'connect': 'SSH connect and authentication time per switch',
+          'command': 'Time from sending a command to the end of its output (includes streamed parsing)',
+          'parse': 'Time spent in each parser per switch',
+          'db_write': 'Time spent writing results to the database'}
+# stage -> label name used for the sample name
+NAME_LABELS = {'command': 'command', 'parse': 'parser', 'db_write': 'table'}
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-dir', default=DEFAULT_METRICS_DIR,
+                        help='write <job>.prom (Prometheus textfile) and <job>.json timing summaries here at the end of the run')
+
+
+class Timings(object):
+    """
+        Thread-safe collection of timing samples (switch, stage, name, seconds, bytes, cached).
+        switch is None for samples that belong to the whole run, such as the database write.
+    """
+    def __init__(self, job):
+        self.job = job
+        self.started = time.time()
+        self.finished = None
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def record(self, switch, stage, name=None, seconds=0.0, bytes=0, cached=False):
+        with self.lock:
+            self.samples.append({'switch': switch, 'stage': stage, 'name': name, 'seconds': seconds,
+                                 'bytes': bytes, 'cached': cached})
+
+    @contextmanager
+    def measure(self, switch, stage, name=None):
+        # Time the enclosed block; the block may set sample['bytes'] or sample['cached']
+        sample = {'bytes': 0, 'cached': False}
+        start = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            self.record(switch, stage, name, time.perf_counter() - start, sample['bytes'], sample['cached'])
+
+    def totals(self):
+        # Sum samples by (switch, stage, name) -> [seconds, bytes, count]
+        totals = {}
+        with self.lock:
+            for sample in self.samples:
+                key = (sample['switch'], sample['stage'], sample['name'])
+                total = totals.setdefault(key, [0.0, 0, 0])
+                total[0] += sample['seconds']
+                total[1] += sample['bytes']
+                total[2] += 1
+        return totals
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        # JSON-friendly summary grouped by switch
+        switches = {}
+        run = {}
+        for (switch, stage, name), (seconds, received, count) in sorted(self.totals().items(), key=str):
+            target = switches.setdefault(switch, {}) if switch else run
+            entry = {'seconds': round(seconds, 6), 'count': count}
+            if received:
+                entry['bytes'] = received
+            target.setdefault(stage, {})[name or stage] = entry
+        for switch, stages in switches.items():
+            stages['total_seconds'] = round(sum(entry['seconds'] for stage in stages.values() for entry in stage.values()), 6)
+        return {'job': self.job,
+                'started': self.started,
+                'run_seconds': round((self.finished or time.time()) - self.started, 6),
+                'run': run,
+                'switches': switches}
+
+    def prometheus(self, prefix='mds'):
+        totals = self.totals()
+        lines = ['# HELP %s_run_seconds Wall clock time of the whole run' % prefix,
+                 '# TYPE %s_run_seconds gauge' % prefix,
+                 '%s_run_seconds{job="%s"} %.6f' % (prefix, escape(self.job), (self.finished or time.time()) - self.started),
+                 '# HELP %s_run_timestamp_seconds Unix time the run finished' % prefix,
+                 '# TYPE %s_run_timestamp_seconds gauge' % prefix,
+                 '%s_run_timestamp_seconds{job="%s"} %.0f' % (prefix, escape(self.job), self.finished or time.time())]
+        for stage, help_text in STAGES.items():
+            keys = sorted((key for key in totals if key[1] == stage), key=str)
+            if not keys:
+                continue
+            metric = '%s_%s_seconds' % (prefix, stage)
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s gauge' % metric)
+            for key in keys:
+                lines.append('%s{%s} %.6f' % (metric, labels(self.job, key), totals[key][0]))
+            if stage == 'command':
+                metric = '%s_command_bytes' % prefix
+                lines.append('# HELP %s Bytes of output received per command' % metric)
+                lines.append('# TYPE %s gauge' % metric)
+                for key in keys:
+                    lines.append('%s{%s} %d' % (metric, labels(self.job, key), totals[key][1]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory):
+        # Write <job>.prom and <job>.json into directory, each replaced atomically
+        self.finish()
+        os.makedirs(directory, exist_ok=True)
+        write_atomic(os.path.join(directory, self.job + '.prom'), self.prometheus())
+        write_atomic(os.path.join(directory, self.job + '.json'), json.dumps(self.summary(), indent=2, sort_keys=True) + '\n')
+
+
+@contextmanager
+def measure(timings, switch, stage, name=None):
+    # Timings.measure() when timings is set, otherwise a no-op, so callers need not check
+    if timings is None:
+        yield {'bytes': 0, 'cached': False}
+    else:
+        with timings.measure(switch, stage, name) as sample:
+            yield sample
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(job, key):
+    switch, stage, name = key
+    pairs = [('job', job)]
+    if switch:
+        pairs.append(('switch', switch))
+    if name:
+        pairs.append((NAME_LABELS.get(stage, 'name'), name))
+    return ','.join('%s="%s"' % (label, escape(value)) for label, value in pairs)
+
+
+def write_atomic(path, text):
+    # The textfile collector may read at any time, so never leave a partly written file in place
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
@@ -0,0 +1,377 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_traps.py
+#  Description:  Minimal SNMPv2c trap receiver for the link traps turned on by cisco_mds_snmp_trap.py.
+#                Trap PDUs are decoded with a small BER reader (no SNMP library needed), linkUp/linkDown
+#                (IF-MIB and CISCO-IF-EXTENSION-MIB) are turned into (switch, interface) events, and repeats
+#                of the same port within a short window are merged before anything is re-checked.
+#                The sender half (encode_link_trap, "python3 mds_traps.py send ...") fakes switch traps
+#                for testing the listener locally.
+#
+
+import argparse
+import logging
+import re
+import socket
+import threading
+import time
+
+DEFAULT_TRAP_PORT = 162
+DEFAULT_WINDOW = 5.0
+DEFAULT_COMMUNITY = 'public'
+
+SNMP_TRAP_OID = '1.3.6.1.6.3.1.1.4.1.0'
+SYS_UPTIME_OID = '1.3.6.1.2.1.1.3.0'
+IF_INDEX_OID = '1.3.6.1.2.1.2.2.1.1.'
+IF_NAME_OID = '1.3.6.1.2.1.31.1.1.1.1.'
+# Trap OID -> event; MDS sends the IF-MIB or the Cisco variant depending on "snmp-server enable traps link"
+LINK_TRAPS = {'1.3.6.1.6.3.1.1.5.3': 'down',
+              '1.3.6.1.6.3.1.1.5.4': 'up',
+              '1.3.6.1.4.1.9.9.276.0.1': 'down',
+              '1.3.6.1.4.1.9.9.276.0.2': 'up'}
+
+# ifIndex of fc<slot>/<port> on MDS: 0x1000000 + (slot - 1) * 0x80000 + (port - 1) * 0x1000
+FC_IF_INDEX_BASE = 0x1000000
+FC_SLOT_STRIDE = 0x80000
+FC_PORT_STRIDE = 0x1000
+fc_interface_regex = re.compile(r'^fc(\d+)/(\d+)$')
+
+# BER tags used by SNMPv2c traps
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_OID = 0x06
+TAG_SEQUENCE = 0x30
+TAG_IP_ADDRESS = 0x40
+TAG_TIMETICKS = 0x43
+TAG_TRAP_V2 = 0xa7
+TAG_INFORM = 0xa6
+UNSIGNED_TAGS = (0x41, 0x42, 0x43, 0x46)
+
+
+class TrapError(ValueError):
+    pass
+
+
+def read_tlv(data, offset):
+    # (tag, value bytes, offset after the value) of the BER element at offset
+    if offset + 2 > len(data):
+        raise TrapError('truncated element at %d' % offset)
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if not count or count > 4 or offset + count > len(data):
+            raise TrapError('bad length at %d' % offset)
+        length = int.from_bytes(data[offset:offset + count], 'big')
+        offset += count
+    if offset + length > len(data):
+        raise TrapError('truncated value at %d' % offset)
+    return tag, data[offset:offset + length], offset + length
+
+
+def read_elements(data):
+    # Every (tag, value) element of a constructed value
+    elements = []
+    offset = 0
+    while offset < len(data):
+        tag, value, offset = read_tlv(data, offset)
+        elements.append((tag, value))
+    return elements
+
+
+def decode_oid(value):
+    if not value:
+        raise TrapError('empty OID')
+    arcs = [value[0] // 40, value[0] % 40] if value[0] < 80 else [2, value[0] - 80]
+    arc = 0
+    for byte in value[1:]:
+        arc = (arc << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    return '.'.join(str(arc) for arc in arcs)
+
+
+def decode_value(tag, value):
+    if tag == TAG_INTEGER:
+        return int.from_bytes(value, 'big', signed=True)
+    if tag in UNSIGNED_TAGS:
+        return int.from_bytes(value, 'big')
+    if tag == TAG_OID:
+        return decode_oid(value)
+    if tag == TAG_IP_ADDRESS:
+        return socket.inet_ntoa(value)
+    if tag == TAG_OCTET_STRING:
+        return value.decode('utf-8', 'replace')
+    return None
+
+
+def decode_trap(packet):
+    """
+        Decode an SNMPv2c trap (or inform) packet into (community, {oid: value}).  Raises TrapError for
+        anything else (SNMPv1/v3, other PDUs, malformed packets).
+    """
+    tag, message, _ = read_tlv(packet, 0)
+    if tag != TAG_SEQUENCE:
+        raise TrapError('not an SNMP message')
+    elements = read_elements(message)
+    if len(elements) != 3 or elements[0][0] != TAG_INTEGER or elements[1][0] != TAG_OCTET_STRING:
+        raise TrapError('not an SNMP message')
+    if decode_value(*elements[0]) != 1:
+        raise TrapError('not SNMPv2c')
+    if elements[2][0] not in (TAG_TRAP_V2, TAG_INFORM):
+        raise TrapError('not a trap PDU (0x%02x)' % elements[2][0])
+    pdu = read_elements(elements[2][1])
+    if len(pdu) != 4 or pdu[3][0] != TAG_SEQUENCE:
+        raise TrapError('bad trap PDU')
+    varbinds = {}
+    for bind_tag, bind in read_elements(pdu[3][1]):
+        pair = read_elements(bind)
+        if bind_tag != TAG_SEQUENCE or len(pair) != 2 or pair[0][0] != TAG_OID:
+            raise TrapError('bad varbind')
+        varbinds[decode_oid(pair[0][1])] = decode_value(*pair[1])
+    return elements[1][1].decode('utf-8', 'replace'), varbinds
+
+
+def if_index_to_interface(if_index):
+    # "fc<slot>/<port>" of an MDS fc ifIndex, None for other interface types
+    offset = if_index - FC_IF_INDEX_BASE
+    if offset < 0 or offset >= 0x1000000:
+        return None
+    return 'fc%d/%d' % (offset // FC_SLOT_STRIDE + 1, offset % FC_SLOT_STRIDE // FC_PORT_STRIDE + 1)
+
+
+def interface_to_if_index(interface):
+    match = fc_interface_regex.match(interface)
+    if not match:
+        raise ValueError('%s is not an fc interface' % interface)
+    return FC_IF_INDEX_BASE + (int(match.group(1)) - 1) * FC_SLOT_STRIDE + (int(match.group(2)) - 1) * FC_PORT_STRIDE
+
+
+def link_event(varbinds):
+    """
+        ('up' or 'down', interface) of a link trap, or None for other traps and non-fc interfaces.  ifName is
+        used when the trap carries it, otherwise the interface is worked out from the ifIndex.
+    """
+    event = LINK_TRAPS.get(varbinds.get(SNMP_TRAP_OID))
+    if not event:
+        return None
+    interface = None
+    for oid, value in varbinds.items():
+        if oid.startswith(IF_NAME_OID) and value:
+            interface = value
+            break
+        if oid.startswith(IF_INDEX_OID) and interface is None:
+            interface = if_index_to_interface(int(oid[len(IF_INDEX_OID):]))
+    if not interface or not fc_interface_regex.match(interface):
+        return None
+    return event, interface
+
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    count = (length.bit_length() + 7) // 8
+    return bytes([0x80 | count]) + length.to_bytes(count, 'big')
+
+
+def encode_tlv(tag, value):
+    return bytes([tag]) + encode_length(len(value)) + value
+
+
+def encode_integer(number, tag=TAG_INTEGER):
+    if tag in UNSIGNED_TAGS:
+        return encode_tlv(tag, number.to_bytes(number.bit_length() // 8 + 1, 'big'))
+    return encode_tlv(tag, number.to_bytes((number + (number < 0)).bit_length() // 8 + 1, 'big', signed=True))
+
+
+def encode_oid(oid):
+    arcs = [int(arc) for arc in oid.split('.')]
+    body = bytes([arcs[0] * 40 + arcs[1]])
+    for arc in arcs[2:]:
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        body += bytes(chunk)
+    return encode_tlv(TAG_OID, body)
+
+
+def encode_link_trap(interface, event, community=DEFAULT_COMMUNITY, with_name=True, uptime=0, request_id=1):
+    """
+        SNMPv2c linkUp/linkDown trap for an fc interface, shaped like the ones MDS sends (ifIndex, ifAdminStatus,
+        ifOperStatus and, with with_name, ifName).
+    """
+    if_index = interface_to_if_index(interface)
+    status = 1 if event == 'up' else 2
+    trap_oid = [oid for oid, trap_event in LINK_TRAPS.items() if trap_event == event][0]
+    binds = [(SYS_UPTIME_OID, encode_integer(uptime, TAG_TIMETICKS)),
+             (SNMP_TRAP_OID, encode_oid(trap_oid)),
+             (IF_INDEX_OID + str(if_index), encode_integer(if_index)),
+             ('1.3.6.1.2.1.2.2.1.7.%d' % if_index, encode_integer(1)),
+             ('1.3.6.1.2.1.2.2.1.8.%d' % if_index, encode_integer(status))]
+    if with_name:
+        binds.append((IF_NAME_OID + str(if_index), encode_tlv(TAG_OCTET_STRING, interface.encode('ascii'))))
+    varbinds = b''.join(encode_tlv(TAG_SEQUENCE, encode_oid(oid) + value) for oid, value in binds)
+    pdu = encode_tlv(TAG_TRAP_V2, encode_integer(request_id) + encode_integer(0) + encode_integer(0) + encode_tlv(TAG_SEQUENCE, varbinds))
+    return encode_tlv(TAG_SEQUENCE, encode_integer(1) + encode_tlv(TAG_OCTET_STRING, community.encode('utf-8')) + pdu)
+
+
+def send_link_trap(host, interface, event, port=DEFAULT_TRAP_PORT, community=DEFAULT_COMMUNITY, source=None, with_name=True):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        if source:
+            sock.bind((source, 0))
+        sock.sendto(encode_link_trap(interface, event, community, with_name), (host, port))
+    finally:
+        sock.close()
+
+
+class TrapQueue(object):
+    """
+        Ports with a pending link event.  A port is held for window seconds after its first trap; more traps for
+        it in that time (a flapping link, linkDown followed by linkUp) only update the last event, so each port is
+        re-checked once per window.
+    """
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ready_event = threading.Event()
+        self.merged = 0
+
+    def add(self, switch, interface, event, now=None):
+        now = now or time.time()
+        with self.lock:
+            key = (switch, interface)
+            if key in self.pending:
+                self.pending[key]['event'] = event
+                self.pending[key]['traps'] += 1
+                self.merged += 1
+            else:
+                self.pending[key] = {'first': now, 'event': event, 'traps': 1}
+            self.ready_event.set()
+
+    def due(self, now=None):
+        # Pop {switch: {interface: pending entry}} of the ports whose window has passed
+        now = now or time.time()
+        due = {}
+        with self.lock:
+            for key, entry in list(self.pending.items()):
+                if now - entry['first'] >= self.window:
+                    del self.pending[key]
+                    due.setdefault(key[0], {})[key[1]] = entry
+            if not self.pending:
+                self.ready_event.clear()
+        return due
+
+    def wait(self, timeout=None):
+        # Block until the next pending port is due (or timeout), then return due()
+        if not self.ready_event.wait(timeout):
+            return {}
+        with self.lock:
+            first = min([entry['first'] for entry in self.pending.values()] or [time.time()])
+        delay = first + self.window - time.time()
+        if delay > 0:
+            time.sleep(min(delay, timeout) if timeout else delay)
+        return self.due()
+
+
+class TrapListener(object):
+    """
+        UDP trap receiver.  Traps are attributed to a switch by their source address (switches maps address ->
+        switch name); link events from known switches go on queue, everything else is counted and dropped.
+    """
+    def __init__(self, switches, queue, port=DEFAULT_TRAP_PORT, host='', community=DEFAULT_COMMUNITY):
+        self.switches = switches
+        self.queue = queue
+        self.community = community
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        self.stats = {'received': 0, 'link': 0, 'ignored': 0, 'unknown': 0, 'bad': 0}
+        self.running = False
+
+    def handle(self, packet, address):
+        self.stats['received'] += 1
+        try:
+            community, varbinds = decode_trap(packet)
+        except TrapError as e:
+            self.stats['bad'] += 1
+            logging.debug('%s: undecodable trap: %s' % (address, e))
+            return
+        if self.community and community != self.community:
+            self.stats['ignored'] += 1
+            return
+        switch = self.switches.get(address)
+        if switch is None:
+            self.stats['unknown'] += 1
+            logging.info('trap from %s, which is not in the inventory' % address)
+            return
+        event = link_event(varbinds)
+        if event is None:
+            self.stats['ignored'] += 1
+            return
+        self.stats['link'] += 1
+        self.queue.add(switch, event[1], event[0])
+
+    def serve(self):
+        while self.running:
+            try:
+                packet, address = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            if not self.running:
+                # shutdown() in stop() wakes recvfrom with an empty datagram
+                return
+            self.handle(packet, address[0])
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def add_trap_arguments(parser):
+    parser.add_argument('--trap-port', type=int, default=DEFAULT_TRAP_PORT,
+                        help='UDP port to receive traps on (default: %d)' % DEFAULT_TRAP_PORT)
+    parser.add_argument('--community', default=DEFAULT_COMMUNITY,
+                        help='SNMP community of the traps, empty to accept any (default: %s)' % DEFAULT_COMMUNITY)
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW,
+                        help='seconds to merge repeated traps of a port before re-checking it (default: %s)' % DEFAULT_WINDOW)
+
+
+def main():
+    # Local trap sender for testing a listener: python3 mds_traps.py send fc1/5 down --port 1162
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='action')
+    send = subparsers.add_parser('send', help='send linkUp/linkDown traps for fc interfaces')
+    send.add_argument('interface', help='fc interface, e.g. fc1/5')
+    send.add_argument('event', choices=('up', 'down'))
+    send.add_argument('--host', default='127.0.0.1', help='listener address (default: 127.0.0.1)')
+    send.add_argument('--port', type=int, default=DEFAULT_TRAP_PORT, help='listener port (default: %d)' % DEFAULT_TRAP_PORT)
+    send.add_argument('--source', help='local address to send from, standing in for the switch address')
+    send.add_argument('--community', default=DEFAULT_COMMUNITY)
+    send.add_argument('--count', type=int, default=1, help='send the trap this many times (a flapping port)')
+    send.add_argument('--no-ifname', action='store_true', help='leave out ifName so the listener maps the ifIndex')
+    args = parser.parse_args()
+    if args.action != 'send':
+        parser.error('nothing to do')
+
+    for _ in range(args.count):
+        send_link_trap(args.host, args.interface, args.event, args.port, args.community, args.source, not args.no_ifname)
+    print('Sent %d link%s trap(s) for %s to %s:%d' % (args.count, args.event.capitalize(), args.interface, args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_waves.py
+#  Description:  Fabric-aware rolling-wave scheduler for the change scripts.  Hosts are dual-pathed
+#                across fabric A and B, so switches are changed one fabric at a time: every switch of
+#                a fabric runs concurrently (capped per site), then the wave is health checked and the
+#                next fabric only starts when the first one passed.
+#
+
+import threading
+import time
+
+from mds_fleet import DEFAULT_WORKERS, SwitchResult, run_fleet
+from mds_inventory import add_inventory_argument
+from mds_parsers import parse_port_brief_records
+from mds_session import SessionPool
+
+UP_STATUSES = ('up', 'trunking')
+# Ports flap for a while after a change, so the health check waits and re-polls before a port counts as down
+DEFAULT_SETTLE = 30
+DEFAULT_SETTLE_POLLS = 3
+
+
+def add_wave_arguments(parser):
+    add_inventory_argument(parser)
+    parser.add_argument('--site-limit', type=int, default=0,
+                        help='with --inventory, at most this many switches of one site are changed at the same time (default: no limit)')
+    parser.add_argument('--settle', type=int, default=DEFAULT_SETTLE,
+                        help='with --inventory, seconds to wait after a wave before each health check poll (default: %d)' % DEFAULT_SETTLE)
+    parser.add_argument('--settle-polls', type=int, default=DEFAULT_SETTLE_POLLS,
+                        help='with --inventory, health check polls before a port that is still down fails the wave (default: %d)' % DEFAULT_SETTLE_POLLS)
+
+
+def plan_waves(switches, inventory):
+    """
+        Group switches into one wave per fabric of the loaded Inventory, in inventory order of the fabrics.
+        Returns (waves, unknown) where waves is a list of (fabric, [switch, ...]) and unknown lists the
+        switches missing from the inventory, which are never changed since their fabric is not known.
+    """
+    waves = []
+    fabrics = {}
+    unknown = []
+    for switch in switches:
+        entry = inventory.switches.get(switch)
+        if not entry or not entry['fabric']:
+            unknown.append(switch)
+            continue
+        fabric = entry['fabric']
+        if fabric not in fabrics:
+            fabrics[fabric] = []
+            waves.append((fabric, fabrics[fabric]))
+        fabrics[fabric].append(switch)
+    order = inventory.names()
+    for fabric, wave in waves:
+        wave.sort(key=order.index)
+    return waves, unknown
+
+
+def _site_limited(result, task, args, inventory, site_locks):
+    # Run task for one switch while holding a slot of its site
+    lock = site_locks.get(inventory.switches[result.switch]['site'])
+    if lock is None:
+        task(result, *args)
+        return
+    with lock:
+        task(result, *args)
+
+
+def up_ports(result, pool):
+    # Health check task: record the ports that are up or trunking on one switch
+    records = parse_port_brief_records(pool.run(result.switch, 'show interface brief').splitlines())
+    result.data['up_ports'] = set(record['interface'] for record in records if record['status'] in UP_STATUSES)
+    pool.close_switch(result.switch)
+    result.ok = True
+
+
+def check_wave(results, before, workers, settle=DEFAULT_SETTLE, polls=DEFAULT_SETTLE_POLLS):
+    """
+        A wave is healthy when every switch in it reported success, still answers after the change and
+        has no port down that was up or trunking before the wave.  The switches are polled up to polls times,
+        settle seconds apart, and only those still unhealthy are polled again.  Returns a list of problems,
+        empty when healthy.
+    """
+    problems = ['%s: change failed' % result.switch for result in results if not result.ok]
+    pending = [result.switch for result in results]
+    for poll in range(max(polls, 1)):
+        if settle > 0:
+            time.sleep(settle)
+        with SessionPool() as pool:
+            after = run_fleet(pending, up_ports, args=(pool,), workers=workers)
+        unhealthy = {}
+        for check in after:
+            if not check.ok:
+                unhealthy[check.switch] = '%s: not answering after the change' % check.switch
+                continue
+            went_down = before.get(check.switch, set()) - check.data['up_ports']
+            if went_down:
+                unhealthy[check.switch] = '%s: %d ports went down (%s)' % (check.switch, len(went_down), ', '.join(sorted(went_down)))
+        pending = [switch for switch in pending if switch in unhealthy]
+        if not pending:
+            break
+        if poll < polls - 1:
+            print('\t*** %d switches not settled yet, checking again in %d seconds ***' % (len(pending), settle))
+    problems.extend(unhealthy[switch] for switch in pending)
+    return problems
+
+
+def run_waves(switches, task, args=(), workers=DEFAULT_WORKERS, inventory=None, site_limit=0,
+              settle=DEFAULT_SETTLE, settle_polls=DEFAULT_SETTLE_POLLS):
+    """
+        Run task(result, *args) like run_fleet, one fabric at a time when inventory, the Inventory from
+        load_inventory, has an inventory file loaded; its fabric and site columns decide the waves.
+        Within a wave up to workers switches run at once, and at most site_limit per site when set.
+        After each wave but the last the health check waits settle seconds and polls up to settle_polls times.
+        When a wave fails its health check the remaining fabrics are not touched and their switches
+        are reported as failed.  Returns a list of SwitchResult in wave order.
+    """
+    if inventory is None or not inventory.switches:
+        return run_fleet(switches, task, args=args, workers=workers)
+    waves, unknown = plan_waves(switches, inventory)
+    results = []
+    for switch in unknown:
+        result = SwitchResult(switch)
+        result.log('\t*** %s is not in the inventory, not changed ***' % switch)
+        results.append(result)
+    for index, (fabric, wave) in enumerate(waves):
+        print('\n===== Wave %d of %d: fabric %s, %d switches =====' % (index + 1, len(waves), fabric, len(wave)))
+        # A lock per site with site_limit slots, shared by all switches of that site in this wave
+        site_locks = {}
+        if site_limit > 0:
+            for switch in wave:
+                site_locks.setdefault(inventory.switches[switch]['site'], threading.BoundedSemaphore(site_limit))
+        with SessionPool() as pool:
+            before = dict((check.switch, check.data['up_ports'])
+                          for check in run_fleet(wave, up_ports, args=(pool,), workers=workers) if check.ok)
+        wave_results = run_fleet(wave, _site_limited, args=(task, args, inventory, site_locks), workers=workers)
+        results.extend(wave_results)
+        if index == len(waves) - 1:
+            break
+        problems = check_wave(wave_results, before, workers, settle, settle_polls)
+        if not problems:
+            print('\t*** Fabric %s passed the health check ***' % fabric)
+            continue
+        print('\t*** Fabric %s failed the health check, stopping before fabric %s ***' % (fabric, waves[index + 1][0]))
+        for problem in problems:
+            print('\t    ' + problem)
+        for remaining_fabric, remaining in waves[index + 1:]:
+            for switch in remaining:
+                result = SwitchResult(switch)
+                result.log('\t*** Not changed: fabric %s failed the health check ***' % fabric)
+                results.append(result)
+        break
+    return results
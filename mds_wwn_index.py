@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+#
+#  Name:  mds_wwn_index.py
+#  Description:  Fabric-wide WWN location index.  The device-alias database is distributed across a
+#                fabric, so it is downloaded once per fabric; the FLOGI database of every switch is merged
+#                into one pwwn -> (fabric, switch, port, vsan, fcid, alias) map that is kept on disk and
+#                answers "where is this WWN (or alias) logged in" without asking any switch.
+#
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from mds_fleet import add_workers_argument, run_fleet
+from mds_inventory import add_inventory_argument, load_inventory
+from mds_json import add_parser_argument, devalias_dict, flogi_records, run_json
+from mds_parsers import parse_devalias, parse_flogi_records
+from mds_session import SessionPool
+
+DEFAULT_INDEX_FILE = os.environ.get('MDS_WWN_INDEX', os.path.expanduser('~/.cache/mds_tools/wwn_index.json'))
+
+fc_port_regex = re.compile(r'^fc\d+/\d+$')
+hex_regex = re.compile(r'^[0-9a-f]{16}$')
+
+
+def add_index_argument(parser):
+    parser.add_argument('--index-file', default=DEFAULT_INDEX_FILE,
+                        help='saved WWN index (default: $MDS_WWN_INDEX or %s)' % DEFAULT_INDEX_FILE)
+
+
+def normalize_wwn(key):
+    # "20:00:00:25:B5:00:00:01", "2000-0025-b500-0001" or "20000025b5000001" -> "20:00:00:25:b5:00:00:01"; None if not a WWN
+    digits = re.sub(r'[:.\-\s]', '', key.lower())
+    if not hex_regex.match(digits):
+        return None
+    return ':'.join(digits[index:index + 2] for index in range(0, 16, 2))
+
+
+class FabricAliases(object):
+    """
+        Device-alias database of each fabric, downloaded by the first switch of the fabric that asks for it.
+        Safe to share between the tasks of a fleet run.
+    """
+    def __init__(self):
+        self.aliases = {}
+        self.lock = threading.Lock()
+        self.fabric_locks = {}
+
+    def fetch(self, fabric, switch, pool, parser_mode='auto'):
+        # Return {pwwn: alias} of fabric, downloading it from switch unless another switch already did
+        with self.lock:
+            fabric_lock = self.fabric_locks.setdefault(fabric, threading.Lock())
+        with fabric_lock:
+            if fabric not in self.aliases:
+                data = run_json(pool, switch, 'sh device-alias database') if parser_mode != 'regex' else None
+                if data is not None:
+                    aliases = devalias_dict(data)
+                else:
+                    aliases = parse_devalias(pool.run(switch, 'sh device-alias database'))
+                self.aliases[fabric] = dict((pwwn.lower(), alias) for pwwn, alias in aliases.items())
+            return self.aliases[fabric]
+
+
+def collect_flogi_records(switch, pool, parser_mode='auto'):
+    # FLOGI records of a switch, as JSON where supported
+    if parser_mode != 'regex':
+        data = run_json(pool, switch, 'sh flogi database')
+        if data is not None:
+            return flogi_records(data)
+    return parse_flogi_records(pool.run(switch, 'sh flogi database'))
+
+
+class WWNIndex(object):
+    """
+        entries: {pwwn: {'fabric', 'switch', 'port', 'vsan', 'fcid', 'alias'}} of every logged in WWN.
+        aliases: {alias: pwwn} of every fabric's device-alias database, logged in or not.
+        alias_names: {pwwn: alias}, the reverse of aliases for constant-time alias_of.
+        ports:   {switch: {port: [pwwn, ...]}} built from entries for per-port lookups.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.aliases = {}
+        self.alias_names = {}
+        self.ports = {}
+        self.built = {}
+
+    def set_alias(self, alias, pwwn):
+        # Point alias at pwwn in both directions, dropping the reverse entry of a pwwn the alias used to name
+        previous = self.aliases.get(alias)
+        if previous is not None and previous != pwwn and self.alias_names.get(previous) == alias:
+            del self.alias_names[previous]
+        self.aliases[alias] = pwwn
+        self.alias_names[pwwn] = alias
+
+    def move_login(self, pwwn, switch, port):
+        # Before pwwn is recorded on switch/port, remove it from the port list of the switch/port it was logged in on
+        entry = self.entries.get(pwwn)
+        if entry is None or (entry['switch'], entry['port']) == (switch, port):
+            return
+        owner_ports = self.ports.get(entry['switch'], {})
+        pwwns = owner_ports.get(entry['port'], [])
+        if pwwn in pwwns:
+            pwwns.remove(pwwn)
+            if not pwwns:
+                del owner_ports[entry['port']]
+
+    def update_switch(self, fabric, switch, records, aliases):
+        """
+            Replace the logins of switch with records; aliases ({pwwn: alias} of the fabric) names the logins the
+            flogi output did not name, and is merged into the alias map.
+        """
+        for pwwns in self.ports.get(switch, {}).values():
+            for pwwn in pwwns:
+                if self.entries.get(pwwn, {}).get('switch') == switch:
+                    del self.entries[pwwn]
+        ports = {}
+        for record in records:
+            self.move_login(record['pwwn'], switch, record['interface'])
+            self.entries[record['pwwn']] = {'fabric': fabric, 'switch': switch, 'port': record['interface'],
+                                            'vsan': record['vsan'], 'fcid': record['fcid'],
+                                            'alias': record['alias'] or aliases.get(record['pwwn'])}
+            ports.setdefault(record['interface'], []).append(record['pwwn'])
+        self.ports[switch] = ports
+        for pwwn, alias in aliases.items():
+            self.set_alias(alias, pwwn)
+        self.built[switch] = time.time()
+
+    def update_port(self, fabric, switch, port, records):
+        # Replace the logins of one port of switch (re-checked after a link trap); unnamed logins are named from the alias map
+        for pwwn in self.ports.get(switch, {}).get(port, []):
+            if self.entries.get(pwwn, {}).get('switch') == switch:
+                del self.entries[pwwn]
+        pwwns = []
+        for record in records:
+            self.move_login(record['pwwn'], switch, port)
+            self.entries[record['pwwn']] = {'fabric': fabric, 'switch': switch, 'port': port,
+                                            'vsan': record['vsan'], 'fcid': record['fcid'],
+                                            'alias': record['alias'] or self.alias_of(record['pwwn'])}
+            pwwns.append(record['pwwn'])
+        ports = self.ports.setdefault(switch, {})
+        if pwwns:
+            ports[port] = pwwns
+        else:
+            ports.pop(port, None)
+
+    def flogi_info(self, switch):
+        # {fc port: alias, pwwn or "trunk"} of a switch as the validator reports it; logins that moved away are skipped
+        flogi_info = {}
+        for port, pwwns in self.ports.get(switch, {}).items():
+            if not fc_port_regex.match(port):
+                continue
+            pwwns = [pwwn for pwwn in pwwns if self.entries.get(pwwn, {}).get('switch') == switch]
+            if not pwwns:
+                continue
+            if len(pwwns) > 1:
+                flogi_info[port] = "trunk"
+            else:
+                flogi_info[port] = self.entries[pwwns[0]]['alias'] or pwwns[0]
+        return flogi_info
+
+    def lookup(self, key):
+        """
+            Return (pwwn, entry) for a WWN in any common notation or a device-alias; entry is None when the WWN
+            is known (from an alias) but not logged in anywhere.  Returns (None, None) when unknown.
+        """
+        pwwn = normalize_wwn(key) or self.aliases.get(key)
+        if pwwn is None:
+            return None, None
+        return pwwn, self.entries.get(pwwn)
+
+    def alias_of(self, pwwn):
+        entry = self.entries.get(pwwn)
+        if entry and entry['alias']:
+            return entry['alias']
+        return self.alias_names.get(pwwn)
+
+    def save(self, index_file):
+        directory = os.path.dirname(os.path.abspath(index_file))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'entries': self.entries, 'aliases': self.aliases, 'built': self.built}, f)
+        os.replace(tmp_path, index_file)
+
+    @classmethod
+    def load(cls, index_file):
+        # The saved index, or an empty one when there is none
+        index = cls()
+        try:
+            with open(index_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        index.entries = data.get('entries', {})
+        for alias, pwwn in data.get('aliases', {}).items():
+            index.set_alias(alias, pwwn)
+        index.built = data.get('built', {})
+        for pwwn, entry in index.entries.items():
+            index.ports.setdefault(entry['switch'], {}).setdefault(entry['port'], []).append(pwwn)
+        return index
+
+
+def fabric_of(inventory, switch):
+    # Fabric of a switch in the inventory; switches without one share the '' fabric
+    entry = inventory.switches.get(switch)
+    return entry['fabric'] if entry else ''
+
+
+def collect_switch_logins(result, pool, inventory, aliases, parser_mode='auto'):
+    # Fleet task: FLOGI records of one switch and the alias database of its fabric
+    try:
+        result.data['records'] = collect_flogi_records(result.switch, pool, parser_mode)
+        result.data['aliases'] = aliases.fetch(fabric_of(inventory, result.switch), result.switch, pool, parser_mode)
+        result.ok = True
+    finally:
+        pool.close_switch(result.switch)
+
+
+def build_index(inventory, switches, pool, index=None, workers=10, parser_mode='auto'):
+    """
+        Collect switches into index (a new one by default).  Switches that fail keep their previous entries.
+        Returns (index, results).
+    """
+    index = index or WWNIndex()
+    aliases = FabricAliases()
+    results = run_fleet(switches, collect_switch_logins, args=(pool, inventory, aliases, parser_mode), workers=workers)
+    for result in results:
+        if result.ok:
+            index.update_switch(fabric_of(inventory, result.switch), result.switch, result.data['records'], result.data['aliases'])
+    return index, results
+
+
+def print_lookup(index, key):
+    pwwn, entry = index.lookup(key)
+    if pwwn is None:
+        print('%-40s not found' % key)
+    elif entry is None:
+        print('%-40s %s (%s) is not logged in' % (key, pwwn, index.alias_of(pwwn)))
+    else:
+        print('%-40s %-24s %-8s %-18s %-8s %-6s %-10s %s' % (key, pwwn, entry['fabric'] or '--', entry['switch'], entry['port'],
+                                                           entry['vsan'], entry['fcid'], entry['alias'] or '--'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('lookup', nargs='*', help='WWNs (any notation) or device-aliases to locate')
+    parser.add_argument('--rebuild', action='store_true', help='collect every inventory switch before looking up')
+    parser.add_argument('--max-age', type=int, default=0,
+                        help='rebuild when the saved index is older than this many seconds (default: 0, never)')
+    add_index_argument(parser)
+    add_inventory_argument(parser)
+    add_parser_argument(parser)
+    add_workers_argument(parser)
+    args = parser.parse_args()
+
+    index = WWNIndex.load(args.index_file)
+    oldest = min(index.built.values()) if index.built else 0
+    if args.rebuild or not index.entries or (args.max_age and time.time() - oldest > args.max_age):
+        if not args.inventory:
+            parser.error('building the index needs an inventory of the switches (--inventory or $MDS_INVENTORY)')
+        inventory = load_inventory(args.inventory, args.inventory_state)
+        print('Building WWN index from %d switches ...' % len(inventory.names()))
+        with SessionPool(timeout=10) as pool:
+            index, results = build_index(inventory, inventory.names(), pool, WWNIndex(), args.workers, args.parser)
+        for result in results:
+            if not result.ok:
+                print('%s: collection failed %s' % (result.switch, ' '.join(message.strip() for message in result.messages)))
+        index.save(args.index_file)
+        print('%d logins, %d device-aliases indexed\n' % (len(index.entries), len(index.aliases)))
+
+    if args.lookup:
+        print('%-40s %-24s %-8s %-18s %-8s %-6s %-10s %s' % ('Lookup', 'PWWN', 'Fabric', 'Switch', 'Port', 'VSAN', 'FCID', 'Alias'))
+        for key in args.lookup:
+            print_lookup(index, key)
+
+
+if __name__ == '__main__':
+    main()
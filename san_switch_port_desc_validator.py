@@ -3,24 +3,50 @@
 #  Title:  san_switch_port_desc_validator.py
 #  Author:  T. Reppert
 #  Description:
-#    This script scans every switch in the switch list in the main() section for port description and flogi'd device-alias or wwn on that port
+#    This script scans every switch in the inventory (--inventory, see mds_inventory.py) for port description and flogi'd device-alias or wwn on that port
 #
 #    If the description and the device-alias flogi'd match, the port is not printed.
 #
 #    This does not include blade chassis ISL ports or ISL's between 9710's or any ports labeled with the word: "decom"
 #    This script assumes that SSH keys were configured on all involved switches for the user executing this script
 #
+#    All four outputs of a switch are collected over one SSH session and switches are collected
+#    concurrently (--workers); the report is printed once every switch has returned.
+#
+#    Each run stores a fingerprint of every switch (time of the last running-config change, FLOGI count
+#    and device-alias database status) with its result.  On the next run a switch whose fingerprint is
+#    unchanged is reported from the stored result instead of being collected again (--full collects all).
+#
+#    The device-alias database is downloaded once per fabric rather than from every switch, and the FLOGI
+#    logins of the collected switches refresh the fabric-wide WWN index (mds_wwn_index.py, --index-file).
+#
+#    With --listen the script stays up after the report and receives the SNMP link traps enabled by
+#    cisco_mds_snmp_trap.py (see mds_traps.py).  Only the ports named in linkUp/linkDown traps are re-checked,
+#    a few seconds after their first trap (--window), and the stored results are updated in place.
+#
 #  Original creation date:  2/22/17
 
 import re
-import subprocess
+import os
+import time
+import json
+import hashlib
+import tempfile
+import argparse
 
-def build_port_dict(switch):
+from mds_cache import ShowCache, add_cache_arguments
+from mds_fleet import add_workers_argument, run_fleet
+from mds_inventory import add_inventory_argument, load_inventory
+from mds_json import add_parser_argument, flogi_records, port_desc_dict, run_json, status_dict
+from mds_parsers import parse_flogi_records
+from mds_session import SessionPool
+from mds_timing import Timings, add_metrics_arguments, measure
+from mds_traps import TrapListener, TrapQueue, add_trap_arguments
+from mds_wwn_index import FabricAliases, WWNIndex, add_index_argument, fabric_of
+
+def parse_port_desc(output):
     # Parse list of port descriptions defined on switch
     port_dict = {}
-    output = subprocess.Popen(
-        ['/usr/bin/ssh', '-q', '-o UserKnownHostsFile=/dev/null', '-o StrictHostKeyChecking=no', '-o ConnectTimeout=10',
-         switch, "sh int desc"], stdout=subprocess.PIPE).communicate()[0]
     desc_regex = re.compile(r'^(fc[1-9][0-5]*/[1-9][0-9]*)\s+(.*)',re.M)
     desc_data = output.splitlines()
     for line in desc_data:
@@ -30,12 +56,9 @@ def build_port_dict(switch):
 
     return port_dict
 
-def build_status_dict(switch):
+def parse_status(output):
     # Parse list of port brief defined on switch
     port_status_dict = {}
-    output = subprocess.Popen(
-        ['/usr/bin/ssh', '-q', '-o UserKnownHostsFile=/dev/null', '-o StrictHostKeyChecking=no', '-o ConnectTimeout=10',
-         switch, "sh int"], stdout=subprocess.PIPE).communicate()[0]
     status_regex = re.compile(r'^(fc[1-9][0-5]*/[1-9][0-9]*)\s+([ a-zA-Z\(\)\-]+).*',re.M)
     status_data = output.splitlines()
 
@@ -46,97 +69,242 @@ def build_status_dict(switch):
 
     return port_status_dict
 
-def build_devalias_dict(switch):
-    # Parse list of device aliases defined on switch
-    output = subprocess.Popen(
-        ['/usr/bin/ssh', '-q', '-o UserKnownHostsFile=/dev/null', '-o StrictHostKeyChecking=no', '-o ConnectTimeout=10',
-         switch, "sh device-alias database"], stdout=subprocess.PIPE).communicate()[0]
-    deval_info = {}
-    deval_regex = re.compile('^device-alias name (.*) pwwn (.*)$',re.M)
-    deval_data = output.split('\n')
-    for line in deval_data:
-        deval_match = deval_regex.search(line)
-        if deval_match:
-            deval_info[(deval_match.group(2))] = deval_match.group(1).strip()
-
-    return deval_info
-
-def build_flogi_dict(switch):
-    # Parse flogi database for device aliases logged in on port
-    output = subprocess.Popen(
-        ['/usr/bin/ssh', '-q', '-o UserKnownHostsFile=/dev/null', '-o StrictHostKeyChecking=no', '-o ConnectTimeout=10',
-         switch, "sh flogi database"], stdout=subprocess.PIPE).communicate()[0]
-    
-    flogi_out_regex = re.compile(r'^(fc[\s\S]*?)(port|Total)',re.M)
-    fc_only_flogi = flogi_out_regex.search(output)
-    fc_only_string = fc_only_flogi.group(1)
-    fc_line_check = re.compile(r'^(fc[1-9][0-5]*\/[1-9][0-9]*)\s+.*')
-    devalias_line_check = re.compile(r'\[(.*)\]')
-    wwn_regex = re.compile(r'^(fc[1-9][0-5]*\/[1-9][0-9]*)\s+([0-9]*[0-9]*)\s+([\w\d]+)\s+([\w\d:]+)\s+([\w\d:]+)')
-    fc_section = fc_only_string.split('\n')
-    flogi_info = {}
-    last_port_name = ''
-    port_name = ''
-    for line in fc_section:
-        line = line.strip()
-        port_check = fc_line_check.match(line)
-        devalias_check = devalias_line_check.search(line)
-        wwn_check = wwn_regex.search(line)
-        if port_check:
-            port_name = port_check.group(1)
-            if port_name == last_port_name:
-                flogi_info[port_name] = "trunk"
-                continue
-            if wwn_check:
-                flogi_info[port_name] = wwn_check.group(4)
-        elif devalias_check:
-            if flogi_info.get(port_name) != "trunk":
-                flogi_info[port_name] = devalias_check.group(1)
-
-        last_port_name = port_name
-    return flogi_info
+DEFAULT_STATE_FILE = os.environ.get('MDS_VALIDATOR_STATE', os.path.expanduser('~/.cache/mds_tools/port_desc_validator_state.json'))
+# Small outputs that change whenever anything the report depends on can have changed: any config change
+# (descriptions, shutdowns), any login or logout, any device-alias commit
+FINGERPRINT_COMMANDS = ('show running-config | include "last done"',
+                        'show flogi database | include Total',
+                        'show device-alias status')
+# Stored per switch for the report; the device-alias database itself is only needed to resolve the FLOGI aliases
+STORED_KEYS = ('port_desc', 'flogi_info', 'port_state', 'parser')
+
+def switch_fingerprint(switch, pool):
+    # sha1 over the fingerprint outputs of a switch, always read live: a cached output would hide a change
+    digest = hashlib.sha1()
+    for cmd in FINGERPRINT_COMMANDS:
+        digest.update(pool.run(switch, cmd, use_cache=False).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_state(state_file):
+    # Stored {switch: {'fingerprint', 'collected', port_desc, flogi_info, port_state, parser}} of the last run
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state_file, state):
+    directory = os.path.dirname(os.path.abspath(state_file))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_file)
+
+REPORT_FORMAT = "%18s%10s%40s%40s%40s%20s"
+decom_line_check = re.compile(r'decom',re.I)
+
+def check_port(desc, flogi, status):
+    # Match? column of a port whose description, flogi'd device-alias (or wwn, or "trunk") and status are given,
+    # or None when the port is not reported (matching, ISL, unlabeled, decom, trunking or shut down)
+    status = status or ''
+    match_chk = "NO"
+    if desc == flogi:
+        match_chk = "YES"
+    if flogi == "trunk" or 'ISL' in desc or '_EXT' in desc or '_X' in desc:
+        match_chk = "ISL"
+    if desc == '--':
+        match_chk = "--"
+    if decom_line_check.search(desc):
+        match_chk = "decom"
+    if match_chk != "ISL" and match_chk != "--" and "trunking" not in status and match_chk != "YES" and match_chk != "decom" and "Administratively down" not in status:
+        return match_chk
+    return None
+
+def collect_switch(result, pool, parser_mode='auto', state=None, inventory=None, aliases=None):
+    # Gather the outputs of one switch over its single pooled session, as JSON where the switch supports
+    # it and through the regex parsers otherwise.  The device-alias database is the same on every switch
+    # of a fabric, so it comes from aliases, which downloads it once per fabric.  When state (stored results
+    # of the last run) has the same fingerprint for the switch, nothing else is collected and the stored
+    # result is used.
+    switch = result.switch
+    previous = (state or {}).get(switch)
+    aliases = aliases or FabricAliases()
+    paths = []
+    use_json = [parser_mode != 'regex']
+
+    def collect(cmd, json_parser, regex_parser, *json_args):
+        if use_json[0]:
+            data = run_json(pool, switch, cmd)
+            if data is not None:
+                paths.append('json')
+                with measure(pool.timings, switch, 'parse', json_parser.__name__):
+                    return json_parser(data, *json_args)
+            if parser_mode == 'json':
+                raise ValueError("'%s | json' is not supported on %s" % (cmd, switch))
+            # Release without JSON support for this output; stay on the regex path for this switch
+            use_json[0] = False
+        paths.append('regex')
+        output = pool.run(switch, cmd)
+        with measure(pool.timings, switch, 'parse', regex_parser.__name__):
+            return regex_parser(output)
+
+    try:
+        # Fingerprint first, so a change made while the outputs are collected shows up on the next run
+        fingerprint = switch_fingerprint(switch, pool)
+        if previous and previous.get('fingerprint') == fingerprint:
+            result.data.update(previous)
+            result.data['unchanged'] = True
+            result.ok = True
+            return
+        result.data['fingerprint'] = fingerprint
+        result.data['collected'] = time.time()
+        result.data['port_desc'] = collect("sh int desc", port_desc_dict, parse_port_desc)
+        result.data['flogi_records'] = collect("sh flogi database", flogi_records, parse_flogi_records)
+        result.data['port_state'] = collect("sh int", status_dict, parse_status)
+        result.data['fabric'] = fabric_of(inventory, switch) if inventory else ''
+        result.data['aliases'] = aliases.fetch(result.data['fabric'], switch, pool, parser_mode if use_json[0] else 'regex')
+        result.data['parser'] = paths[0] if len(set(paths)) == 1 else 'mixed'
+        result.ok = True
+    finally:
+        pool.close_switch(switch)
+
+def recheck_ports(result, pool, due):
+    # Fleet task: description, state and FLOGI logins of only the ports of one switch in due ({switch: {port: ...}})
+    switch = result.switch
+    try:
+        for port in sorted(due[switch]):
+            desc = parse_port_desc(pool.run(switch, "sh int %s description" % port)).get(port, '--')
+            status = parse_status(pool.run(switch, "sh int %s" % port)).get(port)
+            records = parse_flogi_records(pool.run(switch, "sh flogi database interface %s" % port))
+            result.data[port] = (desc, status, records)
+        result.ok = True
+    finally:
+        pool.close_switch(switch)
+
+def trap_addresses(inventory, switches):
+    # {management address: switch} used to attribute traps to switches by their source address
+    addresses = {}
+    for switch in switches:
+        try:
+            addresses[inventory.address(switch)] = switch
+        except OSError as e:
+            print('%s: cannot resolve, its traps will be ignored (%s)' % (switch, e))
+    return addresses
+
+def listen(args, inventory, switches, state, index, timings):
+    # Re-check only the ports named in linkUp/linkDown traps against the stored results, until interrupted
+    queue = TrapQueue(args.window)
+    listener = TrapListener(trap_addresses(inventory, switches), queue, args.trap_port, community=args.community).start()
+    print('Listening for link traps on UDP port %d (merging repeats for %ss) ...' % (listener.port, args.window))
+    try:
+        with SessionPool(timeout=10, timings=timings) as pool:
+            while True:
+                due = queue.wait(1.0)
+                due = dict((switch, ports) for switch, ports in due.items() if switch in state)
+                if not due:
+                    continue
+                results = run_fleet(sorted(due), recheck_ports, args=(pool, due), workers=args.workers)
+                for result in results:
+                    switch = result.switch
+                    if not result.ok:
+                        print('%s: re-check failed %s' % (switch, ' '.join(message.strip() for message in result.messages)))
+                        continue
+                    stored = state[switch]
+                    for port, (desc, status, records) in sorted(result.data.items()):
+                        index.update_port(fabric_of(inventory, switch), switch, port, records)
+                        flogi = index.flogi_info(switch).get(port)
+                        stored['port_desc'][port] = desc
+                        stored['port_state'][port] = status
+                        if flogi is None:
+                            stored['flogi_info'].pop(port, None)
+                        else:
+                            stored['flogi_info'][port] = flogi
+                        entry = due[switch][port]
+                        match_chk = check_port(desc, flogi, status)
+                        print('%s link%s (%d trap(s)) %s' % (time.strftime('%H:%M:%S'), entry['event'].capitalize(), entry['traps'],
+                                                             REPORT_FORMAT % (switch, port, desc, status, flogi, match_chk or "OK")))
+                save_state(args.state_file, state)
+                index.save(args.index_file)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
+    print('%(received)d traps received, %(link)d link events, %(unknown)d from unknown switches, %(bad)d undecodable' % listener.stats)
 
 def main():
-    # switches is a list of the switch names that can be ssh'd into using that name 
-    # from the server where this script is executed
-    switches = ['mds1','mds2','mds3','mds4']
+    parser = argparse.ArgumentParser()
+    add_workers_argument(parser)
+    add_parser_argument(parser)
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_inventory_argument(parser)
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE,
+                        help='fingerprints and results of the last run (default: %s)' % DEFAULT_STATE_FILE)
+    parser.add_argument('--full', action='store_true', help='collect every switch even if its fingerprint is unchanged')
+    add_index_argument(parser)
+    parser.add_argument('--listen', action='store_true',
+                        help='after the report, re-check the ports named in SNMP link traps as they arrive')
+    add_trap_arguments(parser)
+    args = parser.parse_args()
+    timings = Timings('san_port_desc_validator')
+    if not args.inventory:
+        parser.error('an inventory of the switches is needed (--inventory or $MDS_INVENTORY)')
+
+    # switches is the list of switch names in the inventory; addresses and host keys come from its state file
+    inventory = load_inventory(args.inventory, args.inventory_state)
+    switches = inventory.names()
     port_desc = {}
     flogi_info = {}
-    devalias_info = {}
     port_state = {}
     flogi_data = {}
-    # Build port description, flogi info, devalias info, and port state dictonaries
-    for switch in switches:
-        port_desc[switch] = build_port_dict(switch)
-        flogi_info[switch] = build_flogi_dict(switch)
-        devalias_info[switch] = build_devalias_dict(switch)
-        port_state[switch] = build_status_dict(switch)
+    state = {} if args.full else load_state(args.state_file)
+    # The FLOGI logins of the collected switches also refresh the fabric-wide WWN index (see mds_wwn_index.py)
+    index = WWNIndex.load(args.index_file)
+    # Build port description, flogi info and port state dictonaries; the device-alias database is fetched once per fabric
+    with SessionPool(timeout=10, cache=ShowCache(args.cache_dir), max_age=args.max_age, timings=timings) as pool:
+        results = run_fleet(switches, collect_switch, args=(pool, args.parser, state, inventory, FabricAliases()), workers=args.workers)
+    for result in results:
+        if not result.ok:
+            print('%s: collection failed' % result.switch)
+            for message in result.messages:
+                print(message)
+            continue
+        if not result.data.get('unchanged'):
+            index.update_switch(result.data['fabric'], result.switch, result.data['flogi_records'], result.data['aliases'])
+            result.data['flogi_info'] = index.flogi_info(result.switch)
+        port_desc[result.switch] = result.data['port_desc']
+        flogi_info[result.switch] = result.data['flogi_info']
+        port_state[result.switch] = result.data['port_state']
+        if result.data.get('unchanged'):
+            print('%s: unchanged since %s, using stored result' % (result.switch, time.ctime(result.data['collected'])))
+        else:
+            print('%s: collected with %s parser' % (result.switch, result.data['parser']))
+            state[result.switch] = dict((key, result.data[key]) for key in ('fingerprint', 'collected') + STORED_KEYS)
+    save_state(args.state_file, dict((switch, state[switch]) for switch in switches if switch in state))
+    index.save(args.index_file)
+    print()
 
-    decom_line_check = re.compile(r'decom',re.I)
-    
     # Generate report of switch port descriptions and the devalias flogi'd on that port 
-    print("%18s%10s%40s%40s%40s%20s" % ("Switch","Port","Description","Status","FLOGI","Match?"))
+    print(REPORT_FORMAT % ("Switch","Port","Description","Status","FLOGI","Match?"))
     for switch in switches:
+        if switch not in port_desc:
+            continue
         flogi_data = flogi_info[switch]
         state_data = port_state[switch]
-        match_chk = ''
-        
+
         for port, desc in sorted(port_desc[switch].items()):
-            match_chk = "NO"
-            if desc == flogi_data.get(port):
-                match_chk = "YES"
-            if flogi_data.get(port) == "trunk" or 'ISL' in desc or '_EXT' in desc or '_X' in desc:
-                match_chk = "ISL"
-            if desc == '--':
-                match_chk = "--"
-            if decom_line_check.search(desc):
-                match_chk = "decom"
-            if match_chk != "ISL" and match_chk != "--" and "trunking" not in state_data.get(port) and match_chk != "YES" and match_chk != "decom" and "Administratively down" not in state_data.get(port):
-                print("%18s%10s%40s%40s%40s%20s" % (switch, port, desc, state_data.get(port), flogi_data.get(port), match_chk))
+            match_chk = check_port(desc, flogi_data.get(port), state_data.get(port))
+            if match_chk:
+                print(REPORT_FORMAT % (switch, port, desc, state_data.get(port), flogi_data.get(port), match_chk))
         print()
+
+    if args.listen:
+        listen(args, inventory, switches, state, index, timings)
+
+    if args.metrics_dir:
+        timings.write(args.metrics_dir)
             
 
 if __name__ == '__main__':
     main()
-
-
@@ -0,0 +1,28 @@
+import numpy as np
+
+from collect_san_port_counters import COUNTER_FIELDS, FIELD_INDEX, counter_deltas
+
+
+def sample(**values):
+    row = [0] * len(COUNTER_FIELDS)
+    for name, value in values.items():
+        row[FIELD_INDEX[name]] = value
+    return np.array([row], dtype=np.uint64)
+
+
+def test_normal_increase():
+    delta = counter_deltas(sample(rx_frames=100, rx_bytes=4000), sample(rx_frames=150, rx_bytes=9000))
+    assert delta[0, FIELD_INDEX['rx_frames']] == 50
+    assert delta[0, FIELD_INDEX['rx_bytes']] == 5000
+
+
+def test_reset_uses_current_value():
+    delta = counter_deltas(sample(rx_errors=5, rx_crc=3, tx_frames=10 ** 6), sample(rx_errors=0, rx_crc=0, tx_frames=7))
+    assert delta[0, FIELD_INDEX['rx_errors']] == 0
+    assert delta[0, FIELD_INDEX['rx_crc']] == 0
+    assert delta[0, FIELD_INDEX['tx_frames']] == 7
+
+
+def test_drop_past_32_bits_is_a_reset_not_a_wrap():
+    delta = counter_deltas(sample(rx_bytes=2 ** 32 - 10), sample(rx_bytes=20))
+    assert delta[0, FIELD_INDEX['rx_bytes']] == 20
@@ -0,0 +1,32 @@
+from mds_fleet import SwitchResult
+from mds_session import apply_config, clean_echo, split_block
+
+KEY_LINE = 'username bob sshkey ssh-rsa ' + 'A' * 400
+
+
+class BlockSession(object):
+    # send_block over a canned switch output
+    def __init__(self, output):
+        self.output = output
+
+    def send_block(self, commands, timeout=None):
+        return split_block(commands, self.output, 'sw1')
+
+
+def test_clean_echo_applies_backspaces_and_drops_escapes():
+    assert clean_echo('exec-timeout 155\x08\x1b[K') == 'exec-timeout 15'
+
+
+def test_scrolled_echo_is_only_a_warning():
+    result = SwitchResult('sw1')
+    output = '$AAAAAAAA\nsw1(config)# exit\nsw1# '
+    apply_config(BlockSession(output), result, [KEY_LINE, 'exit'])
+    assert result.ok
+    assert any('Warning' in message for message in result.messages)
+
+
+def test_error_line_fails_the_push():
+    result = SwitchResult('sw1')
+    output = "bogus\n% Invalid command at '^' marker.\nsw1(config)# exit\nsw1# "
+    apply_config(BlockSession(output), result, ['bogus', 'exit'])
+    assert not result.ok
@@ -0,0 +1,33 @@
+from mds_wwn_index import WWNIndex
+
+PWWN = '20:00:00:25:b5:00:00:01'
+
+
+def login(interface, pwwn=PWWN):
+    return {'interface': interface, 'vsan': '10', 'fcid': '0x010000', 'pwwn': pwwn, 'alias': None}
+
+
+def test_moved_login_is_dropped_from_the_previous_switch():
+    index = WWNIndex()
+    index.update_switch('A', 'x', [login('fc1/1')], {PWWN: 'host1'})
+    index.update_switch('A', 'y', [login('fc1/2')], {})
+    index.update_port('A', 'y', 'fc1/2', [])
+    assert index.flogi_info('x') == {}
+    assert index.flogi_info('y') == {}
+
+
+def test_flogi_info_skips_logins_owned_by_another_switch():
+    index = WWNIndex()
+    index.update_switch('A', 'x', [login('fc1/1')], {})
+    index.ports['x']['fc1/1'].append('20:00:00:25:b5:00:00:02')
+    assert index.flogi_info('x') == {'fc1/1': PWWN}
+
+
+def test_alias_of_uses_the_reverse_alias_map():
+    index = WWNIndex()
+    index.update_switch('A', 'x', [], {PWWN: 'host1'})
+    assert index.alias_of(PWWN) == 'host1'
+    index.update_switch('A', 'x', [], {'20:00:00:25:b5:00:00:02': 'host1'})
+    assert index.alias_of(PWWN) is None
+    index.update_port('A', 'x', 'fc1/1', [login('fc1/1')])
+    assert index.flogi_info('x') == {'fc1/1': PWWN}